@@ -16,8 +16,10 @@ from modules.dashboard import render as render_dashboard
 from modules.contabilidad import render as render_contabilidad
 from modules.productos import render as render_productos
 from modules.cobranza import render as render_cobranza
+from modules.admin import render as render_admin
 
-from modules.auth import mostrar_login, mostrar_logout
+from modules.auth import mostrar_login, mostrar_logout, es_admin
+from utils import scheduler, perfilador, cola_escrituras
 
 # Configurar página
 st.set_page_config(page_title="Gestor Pymes", layout="wide")
@@ -33,25 +35,51 @@ if "usuario" not in st.session_state:
 else:
     mostrar_logout()
 
+# ⏱️ Tareas en segundo plano (un solo hilo por proceso)
+scheduler.iniciar()
+db.iniciar_cola_escrituras()
+if cola_escrituras.activa():
+    estado_cola = cola_escrituras.estado()
+    if estado_cola["pendientes"]:
+        st.sidebar.caption(f"📮 {estado_cola['pendientes']} escrituras pendientes de envío "
+                           f"({estado_cola['retraso_segundos']:.0f} s)")
+    if estado_cola["con_error"]:
+        st.sidebar.error(f"⚠️ {estado_cola['con_error']} escrituras no se pudieron enviar; "
+                         "avisa al administrador.")
+
 # 📋 Menú lateral
+opciones_menu = ["📊 Dashboard", "💸 Ventas", "🧾 Contabilidad", "👥 Clientes", "📦 Productos", "💳 Cobranza"]
+iconos_menu = ["bar-chart", "cash-coin", "clipboard-data", "people", "box", "credit-card"]
+if es_admin():
+    opciones_menu.append("⚙️ Administración")
+    iconos_menu.append("gear")
+
 with st.sidebar:
     selected = option_menu(
         "Menú Principal",
-        ["📊 Dashboard", "💸 Ventas", "🧾 Contabilidad", "👥 Clientes", "📦 Productos", "💳 Cobranza"],
-        icons=["bar-chart", "cash-coin", "clipboard-data", "people", "box", "credit-card"],
+        opciones_menu,
+        icons=iconos_menu,
         menu_icon="briefcase", default_index=0
     )
 
+# 🔬 Perfilado bajo demanda (variable de entorno o interruptor de administrador)
+if es_admin():
+    st.sidebar.toggle("🔬 Perfilar páginas", key="perfilar_paginas",
+                      help="Guarda un perfil de cada rerun en el directorio de perfiles.")
+perfilar_pagina = perfilador.perfilado_global() or st.session_state.get("perfilar_paginas", False)
+
 # 🧭 Navegación modular
-if selected == "📊 Dashboard":
-    render_dashboard()
-elif selected == "💸 Ventas":
-    render_ventas()
-elif selected == "🧾 Contabilidad":
-    render_contabilidad()
-elif selected == "👥 Clientes":
-    render_clientes()
-elif selected == "💳 Cobranza":
-    render_cobranza()
-elif selected == "📦 Productos":
-    render_productos()
+paginas = {
+    "📊 Dashboard": render_dashboard,
+    "💸 Ventas": render_ventas,
+    "🧾 Contabilidad": render_contabilidad,
+    "👥 Clientes": render_clientes,
+    "💳 Cobranza": render_cobranza,
+    "📦 Productos": render_productos,
+    "⚙️ Administración": render_admin,
+}
+if perfilar_pagina:
+    with perfilador.perfilar(st.session_state.get("uid"), selected):
+        paginas[selected]()
+else:
+    paginas[selected]()
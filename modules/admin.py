@@ -0,0 +1,259 @@
+import io
+import datetime
+import pandas as pd
+import streamlit as st
+import plotly.express as px
+from modules.auth import es_admin
+from utils import db, scheduler, perfilador, cola_escrituras, analitica, resiliencia, cache_compartido
+from utils.respaldo import exportar_usuario, restaurar_usuario
+from utils.deduplicar import analizar_duplicados, aplicar_deduplicacion
+from utils.costos_venta import analizar_costos_faltantes, aplicar_costos
+from utils.familias import analizar_familias, aplicar_familias
+from utils.auditoria import analizar_integridad, aplicar_correcciones, REVISAR
+
+
+def render():
+    if not es_admin():
+        st.warning("⚠️ Esta sección es solo para administradores.")
+        st.stop()
+
+    st.title("⚙️ Administración")
+
+    # --- Tareas en segundo plano ---
+    st.subheader("⏱️ Tareas programadas")
+    tareas_df = scheduler.estado_tareas()
+    if tareas_df.empty:
+        st.info("No hay tareas registradas.")
+    else:
+        st.dataframe(tareas_df, use_container_width=True)
+
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            tarea_sel = st.selectbox("Tarea", tareas_df["nombre"].tolist(), key="admin_tarea_sel")
+        with col2:
+            st.write("")
+            if st.button("▶️ Ejecutar ahora", key="admin_ejecutar_tarea"):
+                scheduler.ejecutar_ahora(tarea_sel)
+                st.success(f"✅ Tarea '{tarea_sel}' enviada a ejecución.")
+
+    st.divider()
+
+    # --- Cola de escrituras diferidas ---
+    st.subheader("📮 Cola de escrituras diferidas")
+    if not cola_escrituras.activa():
+        st.info("La escritura diferida está desactivada (MINEGOCIO_ESCRITURA_DIFERIDA=1 para activarla).")
+    else:
+        estado_cola = cola_escrituras.estado()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Pendientes", estado_cola["pendientes"])
+        col2.metric("Con error", estado_cola["con_error"])
+        col3.metric("Retraso", f"{estado_cola['retraso_segundos']:.0f} s")
+        if estado_cola["con_error"]:
+            st.error(f"❌ {estado_cola['con_error']} escrituras agotaron sus reintentos y no se enviaron a "
+                     "Firestore; las posteriores de la misma Clave esperan a que se reintenten.")
+            st.dataframe(pd.DataFrame(cola_escrituras.detalle(solo_errores=True)), use_container_width=True)
+        if estado_cola["pendientes"]:
+            st.dataframe(pd.DataFrame(cola_escrituras.detalle()), use_container_width=True)
+        if estado_cola["con_error"] and st.button("🔁 Reintentar escrituras con error", key="admin_reintentar_cola"):
+            cola_escrituras.reintentar_errores()
+            st.success("✅ Escrituras enviadas de nuevo a la cola.")
+
+    st.divider()
+
+    # --- Cache de lecturas ---
+    st.subheader("🗄️ Cache de lecturas")
+    stats_cache = db.estadisticas_cache()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Backend", stats_cache["backend"])
+    col2.metric("Aciertos", f"{stats_cache['tasa_aciertos']:.0%}",
+                help=f"{stats_cache['aciertos']} aciertos, {stats_cache['fallos']} fallos en este proceso")
+    col3.metric("Entradas", stats_cache["entradas"])
+    col4.metric("Tamaño", f"{stats_cache['mb']:.1f} MB")
+    if stats_cache["backend"] == "memoria":
+        st.caption("Cada proceso guarda su propia copia. Con varios procesos en el mismo equipo, "
+                   "MINEGOCIO_CACHE=sqlite la comparte entre todos.")
+    st.caption(f"Las lecturas vencen a los {cache_compartido.EDAD_MAXIMA_CACHE:g} s "
+               f"(MINEGOCIO_CACHE_EDAD_MAXIMA); límite {cache_compartido.MAX_MB_CACHE:g} MB.")
+
+    st.divider()
+
+    # --- Llamadas a Firestore ---
+    st.subheader("🛡️ Llamadas a Firestore")
+    metricas_llamadas = resiliencia.metricas()
+    if metricas_llamadas.empty:
+        st.info("Aún no hay llamadas registradas en este proceso.")
+    else:
+        st.dataframe(metricas_llamadas, use_container_width=True)
+    st.caption(f"Plazo por intento: {resiliencia.PLAZO_LECTURA:g} s lecturas, {resiliencia.PLAZO_ESCRITURA:g} s "
+               f"escrituras; hasta {resiliencia.MAX_INTENTOS} intentos. Lecturas cubiertas: "
+               f"{'activas' if resiliencia.cobertura_activa() else 'inactivas (MINEGOCIO_FIRESTORE_COBERTURA=1)'}.")
+    if st.button("Reiniciar métricas", key="admin_reiniciar_llamadas"):
+        resiliencia.reiniciar_metricas()
+        st.rerun()
+
+    st.divider()
+
+    # --- Respaldo y restauración ---
+    st.subheader("💾 Respaldo y restauración")
+    uid_respaldo = st.text_input("UID del negocio", value=st.session_state.get("uid", ""), key="admin_uid_respaldo")
+
+    if st.button("Generar respaldo", key="admin_generar_respaldo") and uid_respaldo:
+        with st.spinner("Leyendo colecciones..."):
+            buffer = io.BytesIO()
+            manifiesto = exportar_usuario(uid_respaldo, buffer)
+        st.success(f"✅ {manifiesto['documentos']} documentos en {manifiesto['segundos']} s "
+                   f"({manifiesto['docs_por_segundo']} docs/s).")
+        diferencias = {col: info["diferencias"] for col, info in manifiesto["colecciones"].items()
+                       if info["diferencias"]}
+        if diferencias:
+            st.warning(f"⚠️ Algunos documentos no se restaurarían iguales: {diferencias}")
+        st.download_button(
+            label="📥 Descargar respaldo",
+            data=buffer.getvalue(),
+            file_name=f"respaldo_{uid_respaldo}_{datetime.date.today().isoformat()}.zip",
+            mime="application/zip"
+        )
+
+    archivo = st.file_uploader("Archivo de respaldo (.zip)", type=["zip"], key="admin_archivo_respaldo")
+    confirmar = st.checkbox("Confirmo que los documentos del respaldo sobrescribirán los existentes con el mismo ID",
+                            key="admin_confirmar_restaurar")
+    if st.button("Restaurar respaldo", key="admin_restaurar", disabled=not (archivo and confirmar and uid_respaldo)):
+        with st.spinner("Escribiendo documentos..."):
+            resumen = restaurar_usuario(uid_respaldo, archivo)
+        st.success(f"✅ {resumen['documentos']} documentos restaurados en {resumen['segundos']} s "
+                   f"({resumen['docs_por_segundo']} docs/s).")
+
+    st.divider()
+
+    # --- Claves de producto duplicadas ---
+    st.subheader("🧹 Claves de producto duplicadas")
+    st.caption("Limpieza única: conserva un documento por Clave y reserva las Claves para que no vuelvan a duplicarse.")
+    uid_dedupe = st.text_input("UID del negocio", value=st.session_state.get("uid", ""), key="admin_uid_dedupe")
+    if st.button("Analizar duplicados", key="admin_analizar_duplicados") and uid_dedupe:
+        st.session_state.admin_plan_dedupe = (uid_dedupe, analizar_duplicados(uid_dedupe))
+
+    if st.session_state.get("admin_plan_dedupe"):
+        uid_plan, plan = st.session_state.admin_plan_dedupe
+        repetidas = plan[plan["Clave"].isin(plan.loc[plan["Acción"] == "Eliminar", "Clave"])]
+        if repetidas.empty:
+            st.success(f"✅ No hay Claves duplicadas en '{uid_plan}'.")
+        else:
+            st.dataframe(repetidas, use_container_width=True)
+        if st.button("Aplicar limpieza y reservar Claves", key="admin_aplicar_dedupe"):
+            resumen = aplicar_deduplicacion(uid_plan, plan)
+            del st.session_state.admin_plan_dedupe
+            st.success(f"✅ {resumen['documentos_eliminados']} documentos eliminados, "
+                       f"{resumen['claves_reservadas']} Claves reservadas.")
+
+    st.divider()
+
+    # --- Familias de variantes ---
+    st.subheader("👕 Agrupar productos en familias de variantes")
+    st.caption("Conversión única: los productos con el mismo Marca_Tipo y Modelo pasan a un solo documento "
+               "por modelo con sus variantes de color y talla. Conviene limpiar antes las Claves duplicadas.")
+    uid_familias = st.text_input("UID del negocio", value=st.session_state.get("uid", ""), key="admin_uid_familias")
+    if st.button("Analizar modelos", key="admin_analizar_familias") and uid_familias:
+        st.session_state.admin_plan_familias = (uid_familias, analizar_familias(uid_familias))
+
+    if st.session_state.get("admin_plan_familias"):
+        uid_plan, plan = st.session_state.admin_plan_familias
+        if plan.empty:
+            st.success(f"✅ No hay modelos con varios productos para agrupar en '{uid_plan}'.")
+        else:
+            st.write(plan.groupby(["Marca_Tipo", "Modelo"]).size().rename("Variantes"))
+            st.dataframe(plan[["Familia", "Clave", "Nombre", "Color", "Talla", "Cantidad"]],
+                         use_container_width=True)
+            if st.button("Crear familias", key="admin_aplicar_familias"):
+                resumen = aplicar_familias(uid_plan, plan)
+                del st.session_state.admin_plan_familias
+                st.success(f"✅ {resumen['familias']} familias creadas con "
+                           f"{resumen['productos_convertidos']} productos.")
+
+    st.divider()
+
+    # --- Costo en ventas anteriores ---
+    st.subheader("🧾 Costo en ventas anteriores")
+    st.caption("Relleno único del Costo Unitario en renglones de venta que no lo guardaron al cobrar: "
+               "kardex de la venta, luego costo histórico y al final el costo actual del catálogo.")
+    uid_costos = st.text_input("UID del negocio", value=st.session_state.get("uid", ""), key="admin_uid_costos")
+    if st.button("Analizar ventas sin costo", key="admin_analizar_costos") and uid_costos:
+        st.session_state.admin_plan_costos = (uid_costos, analizar_costos_faltantes(uid_costos))
+
+    if st.session_state.get("admin_plan_costos"):
+        uid_plan, plan = st.session_state.admin_plan_costos
+        if plan.empty:
+            st.success(f"✅ Todas las ventas de '{uid_plan}' tienen Costo Unitario.")
+        else:
+            st.write(plan["Origen"].value_counts().rename("Renglones"))
+            st.dataframe(plan, use_container_width=True)
+            if st.button("Guardar costos propuestos", key="admin_aplicar_costos"):
+                resumen = aplicar_costos(uid_plan, plan)
+                del st.session_state.admin_plan_costos
+                st.success(f"✅ {resumen['renglones_actualizados']} renglones de venta actualizados.")
+
+    st.divider()
+
+    # --- Auditoría de integridad ---
+    st.subheader("🩺 Auditoría de integridad")
+    st.caption("Transacciones duplicadas o sin venta, ventas cuyo Contado + Crédito + Anticipo no cuadra con el "
+               "Importe Neto, existencias negativas y Claves repetidas. Los casos 'Revisar' no se modifican.")
+    uid_auditoria = st.text_input("UID del negocio", value=st.session_state.get("uid", ""), key="admin_uid_auditoria")
+    if st.button("Auditar", key="admin_auditar") and uid_auditoria:
+        st.session_state.admin_plan_auditoria = (uid_auditoria, analizar_integridad(uid_auditoria))
+
+    if st.session_state.get("admin_plan_auditoria"):
+        uid_plan, plan = st.session_state.admin_plan_auditoria
+        if plan.empty:
+            st.success(f"✅ No se encontraron problemas de integridad en '{uid_plan}'.")
+        else:
+            st.write(plan.groupby(["Hallazgo", "Acción"]).size().rename("Casos"))
+            st.dataframe(plan, use_container_width=True)
+            corregibles = (plan["Acción"] != REVISAR).any()
+            if corregibles and st.button("Aplicar correcciones", key="admin_aplicar_auditoria"):
+                resumen = aplicar_correcciones(uid_plan, plan)
+                del st.session_state.admin_plan_auditoria
+                st.success(f"✅ {resumen['correcciones']} correcciones aplicadas; "
+                           f"{resumen['por_revisar']} casos quedan por revisar.")
+
+    st.divider()
+
+    # --- Analítica de negocios ---
+    st.subheader("🌐 Analítica de negocios")
+    st.caption(f"Documentos, almacenamiento y ventas por negocio (consultas collection_group en paralelo; "
+               f"se recalcula como máximo cada {analitica.TTL_RESULTADO // 60} min).")
+    forzar = st.button("🔄 Recalcular analítica", key="admin_analitica_recalcular")
+    if forzar or st.session_state.get("admin_analitica_ver"):
+        st.session_state.admin_analitica_ver = True
+        with st.spinner("Leyendo ventas y transacciones de todos los negocios..."):
+            negocios, mensual = analitica.resumen_negocios(forzar=forzar)
+        if negocios.empty:
+            st.info("No hay datos de negocios.")
+        else:
+            st.caption(f"Calculado: {analitica.resumen_creado():%Y-%m-%d %H:%M} · {len(negocios)} negocios · "
+                       f"{negocios['MB'].sum():.2f} MB estimados")
+            st.dataframe(negocios, use_container_width=True)
+            st.plotly_chart(px.line(mensual, x="Mes", y="MB", color="uid", markers=True,
+                                    title="Crecimiento mensual del almacenamiento (MB)"),
+                            use_container_width=True)
+    else:
+        st.info("Pulsa '🔄 Recalcular analítica' para leer los datos de todos los negocios.")
+
+    st.divider()
+
+    # --- Perfiles de rendimiento ---
+    st.subheader("🔬 Perfiles de rendimiento")
+    st.caption("Activa '🔬 Perfilar páginas' en el menú lateral (o MINEGOCIO_PERFILAR=1) y navega la página lenta.")
+    perfiles = perfilador.listar_perfiles()
+    if not perfiles:
+        st.info("No hay perfiles guardados.")
+    else:
+        nombre_perfil = st.selectbox("Perfil", [n for n, _ in perfiles], key="admin_perfil_sel")
+        ruta_base = dict(perfiles)[nombre_perfil]
+        with open(f"{ruta_base}.txt", encoding="utf-8") as f:
+            st.code(f.read(), language=None)
+        col1, col2, col3 = st.columns(3)
+        for col, ext, mime in ((col1, "html", "text/html"), (col2, "collapsed", "text/plain"),
+                               (col3, "prof", "application/octet-stream")):
+            with col, open(f"{ruta_base}.{ext}", "rb") as f:
+                st.download_button(f"📥 .{ext}", data=f.read(), file_name=f"{nombre_perfil}.{ext}",
+                                   mime=mime, key=f"admin_perfil_{ext}")
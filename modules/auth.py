@@ -3,6 +3,7 @@ import firebase_admin
 from firebase_admin import auth
 import pyrebase  # pip install pyrebase4
 import datetime
+from utils.db import precargar_usuario_async, prerreservar_folios
 
 # 🔹 Configuración de Firebase para cliente (Pyrebase)
 
@@ -33,6 +34,9 @@ def iniciar_sesion(correo, contrasena):
         user = auth_client.sign_in_with_email_and_password(correo, contrasena)
         st.session_state.uid = user["localId"]      # 👈 UID para particionar datos
         st.session_state.usuario = correo
+        # Precargar en segundo plano los datos del usuario mientras se dibuja el dashboard
+        precargar_usuario_async(st.session_state.uid)
+        prerreservar_folios(st.session_state.uid)
         st.success("✅ Inicio de sesión exitoso")
         st.rerun()
     except Exception as e:
@@ -40,6 +44,14 @@ def iniciar_sesion(correo, contrasena):
 
 
 
+# ---------------------------
+# Administradores
+# ---------------------------
+def es_admin():
+    """Los administradores se declaran en secrets.toml: admins = ["correo@dominio.com"]."""
+    return st.session_state.get("usuario") in list(st.secrets.get("admins", []))
+
+
 # ---------------------------
 # Cerrar sesión
 # ---------------------------
@@ -1,12 +1,12 @@
 import streamlit as st
 import pandas as pd
 import io
-from utils.db import guardar_cliente, leer_clientes, actualizar_cliente
+from utils.db import guardar_cliente, leer_clientes, actualizar_cliente, version_vistas
 
-# --- Cachear la lectura de clientes para evitar múltiples llamadas ---
-@st.cache_data(ttl=60)  # cache 1 minuto
-def get_clientes():
-    return pd.DataFrame(leer_clientes())
+# --- Cachear la lectura de clientes por negocio y versión de datos ---
+@st.cache_data(ttl=3600, max_entries=50)
+def get_clientes(uid, version):
+    return pd.DataFrame(leer_clientes(uid))
 
 # Helper para convertir DataFrame a Excel
 def to_excel(df):
@@ -18,14 +18,14 @@ def to_excel(df):
 def render():
     st.title("👥 Gestión de Clientes")
 
-    # Cargar clientes (cacheado)
-    if "clientes" not in st.session_state:
-        st.session_state.clientes = get_clientes()
-    else:
-        # Evitar que se pierdan los cambios tras agregar o editar
-        if st.session_state.get("reload_clientes", False):
-            st.session_state.clientes = get_clientes()
-            st.session_state.reload_clientes = False
+    # Cargar clientes (cacheado); se recargan tras agregar o editar y si cambió la versión de datos
+    uid = st.session_state.get("uid")
+    version = version_vistas(uid)
+    if ("clientes" not in st.session_state or st.session_state.get("reload_clientes", False)
+            or st.session_state.get("clientes_version") != version):
+        st.session_state.clientes = get_clientes(uid, version)
+        st.session_state.clientes_version = version
+        st.session_state.reload_clientes = False
 
     # --- Formulario agregar cliente ---
     with st.form("form_clientes"):
@@ -43,8 +43,6 @@ def render():
         if submitted:
             if not id_cliente:
                 st.error("⚠️ Debes ingresar una clave única para el cliente.")
-            elif id_cliente in st.session_state.clientes["ID"].astype(str).values:
-                st.error("❌ Ya existe un cliente con esa clave única. Usa otra.")
             else:
                 nuevo_cliente = {
                     "ID": id_cliente,
@@ -55,10 +53,13 @@ def render():
                     "RFC": rfc,
                     "Límite de crédito": limite_credito
                 }
-                guardar_cliente(id_cliente, nuevo_cliente)
-                st.session_state.reload_clientes = True
-                st.success("✅ Cliente guardado correctamente")
-                st.rerun()
+                # La unicidad del ID la valida Firestore al crear el documento
+                if not guardar_cliente(id_cliente, nuevo_cliente):
+                    st.error("❌ Ya existe un cliente con esa clave única. Usa otra.")
+                else:
+                    st.session_state.reload_clientes = True
+                    st.success("✅ Cliente guardado correctamente")
+                    st.rerun()
 
     st.divider()
 
@@ -2,7 +2,12 @@ import streamlit as st
 import pandas as pd
 import datetime  # Importación necesaria para manejar fechas
 import io  # Importación necesaria para manejar datos en memoria para Excel
-from utils.db import leer_ventas, guardar_transaccion, leer_transacciones, leer_clientes
+from utils.db import leer_ventas, guardar_transaccion, leer_transacciones, leer_clientes, rango_fechas, \
+    leer_depositos_importados, registrar_depositos
+from utils.reportes import calcular_antiguedad_saldos, calcular_saldos, TIPOS_VENTA_CREDITO, \
+    normalizar_estado_cuenta, conciliar_depositos, repartir_depositos
+from utils.scheduler import leer_resultado
+from modules.tabla_paginada import tabla_paginada
 
 
 # Helper function to convert DataFrame to Excel
@@ -63,70 +68,10 @@ def render():
             transacciones_df[col] = 0.0
         transacciones_df[col] = pd.to_numeric(transacciones_df[col], errors='coerce').fillna(0.0)
 
-    # 1. Calcular el total de crédito otorgado por cliente
-    # Asegurarse de que 'Tipo de venta' sea string para la comparación
-    ventas_df["Tipo de venta"] = ventas_df["Tipo de venta"].astype(str)
-    credito_otorgado = ventas_df[
-        ventas_df["Tipo de venta"].isin(["Crédito", "Mixta"])
-    ].groupby("Cliente")["Monto Crédito"].sum().reset_index()
-    credito_otorgado.rename(columns={"Monto Crédito": "Crédito Otorgado"}, inplace=True)
-
-    # 2. Calcular el total de pagos de cobranza (efectivos) por cliente
-    pagos_cobranza = transacciones_df[
-        transacciones_df["Categoría"].astype(str) == "Cobranza"
-        ].groupby("Cliente")["Monto"].sum().reset_index()
-    pagos_cobranza.rename(columns={"Monto": "Pagos Cobranza"}, inplace=True)
-
-    # 3. Calcular el total de anticipos DISPONIBLES (saldo a favor del cliente)
-    # Esto es: Anticipos Cliente - Anticipos Aplicados
-    anticipos_cliente_recibidos = transacciones_df[
-        transacciones_df["Categoría"].astype(str) == "Anticipo Cliente"
-        ].groupby("Cliente")["Monto"].sum().reset_index()
-    anticipos_cliente_recibidos.rename(columns={"Monto": "Anticipos Recibidos"}, inplace=True)
-
-    # Necesitamos `anticipos_aplicados` para el cálculo del Saldo Anticipos
-    anticipos_aplicados_para_saldo_anticipos = transacciones_df[
-        transacciones_df["Categoría"].astype(str) == "Anticipo Aplicado"
-        ].groupby("Cliente")["Monto"].sum().reset_index()
-    anticipos_aplicados_para_saldo_anticipos.rename(columns={"Monto": "Anticipos Aplicados"}, inplace=True)
-
-    saldo_anticipos = anticipos_cliente_recibidos.merge(anticipos_aplicados_para_saldo_anticipos, on="Cliente",
-                                                        how="left").fillna(0)
-    saldo_anticipos["Saldo Anticipos"] = saldo_anticipos["Anticipos Recibidos"] - saldo_anticipos["Anticipos Aplicados"]
-    # Nos interesan solo los anticipos disponibles (positivos)
-    saldo_anticipos = saldo_anticipos[saldo_anticipos["Saldo Anticipos"] > 0]
-
-    # Unir solo el crédito otorgado y los pagos de cobranza directos
-    saldos_final = pd.merge(credito_otorgado, pagos_cobranza, on="Cliente", how="left").fillna(0)
-
-    # El "Total Pagos y Aplicaciones" para el calculo de deuda solo debe incluir Cobranza
-    saldos_final["Total Pagos y Aplicaciones"] = saldos_final["Pagos Cobranza"]
-
-    # Calcular el Saldo Pendiente
-    saldos_final["Saldo Pendiente"] = saldos_final["Crédito Otorgado"] - saldos_final["Total Pagos y Aplicaciones"]
-
-    # Añadir clientes que solo tienen anticipos (sin deuda actual)
-    # Identificar clientes que tienen anticipos pero no aparecen en saldos_final (no tienen deuda)
-    clientes_solo_anticipos = saldo_anticipos[~saldo_anticipos['Cliente'].isin(saldos_final['Cliente'])]
-
-    if not clientes_solo_anticipos.empty:
-        # Crear un DataFrame con la estructura de saldos_final para estos clientes
-        df_solo_anticipos = pd.DataFrame({
-            "Cliente": clientes_solo_anticipos["Cliente"],
-            "Crédito Otorgado": 0.0,
-            "Pagos Cobranza": 0.0,
-            "Anticipos Aplicados": 0.0,
-            "Total Pagos y Aplicaciones": 0.0,
-            "Saldo Pendiente": 0.0  # Su saldo pendiente es 0, su "saldo" es el anticipo a favor
-        })
-        saldos_final = pd.concat([saldos_final, df_solo_anticipos], ignore_index=True)
-
-    # Merge final para mostrar el saldo de anticipos junto con el saldo pendiente de deuda
-    saldos_completos = pd.merge(saldos_final, saldo_anticipos[['Cliente', 'Saldo Anticipos']], on="Cliente",
-                                how="left").fillna(0)
-
-    # Asegurarse de que el "Saldo Pendiente" no sea negativo (si es 0 o negativo, significa que se cubrió la deuda)
-    saldos_completos["Saldo Pendiente Display"] = saldos_completos["Saldo Pendiente"].apply(lambda x: max(0, x))
+    # Saldos precalculados por el planificador si siguen vigentes; si no, se calculan aquí
+    saldos_completos = leer_resultado(st.session_state.get("uid"), "saldos")
+    if saldos_completos is None:
+        saldos_completos = calcular_saldos(ventas_df, transacciones_df)
 
     # --- Fin preprocesamiento y cálculo de saldos ---
 
@@ -185,6 +130,25 @@ def render():
     else:
         st.info("No hay saldos pendientes para mostrar según el filtro seleccionado.")
 
+    st.divider()
+    st.subheader("⏳ Antigüedad de saldos")
+
+    fecha_corte = st.date_input("Fecha de corte", value=datetime.date.today(), key="antiguedad_fecha_corte")
+    antiguedad_df = calcular_antiguedad_saldos(ventas_df, transacciones_df, fecha_corte)
+    if filtro_cliente_saldos != "Todos los clientes":
+        antiguedad_df = antiguedad_df[antiguedad_df["Cliente"] == filtro_cliente_saldos]
+
+    if not antiguedad_df.empty:
+        st.dataframe(antiguedad_df, use_container_width=True)
+        st.download_button(
+            label="Exportar antigüedad de saldos a Excel",
+            data=to_excel(antiguedad_df),
+            file_name=f"antiguedad_saldos_{fecha_corte.isoformat()}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+    else:
+        st.info("No hay saldos pendientes a la fecha de corte seleccionada.")
+
     st.divider()
     st.subheader("🧾 Registrar nuevo pago")
 
@@ -255,7 +219,7 @@ def render():
         current_transacciones_df = st.session_state.transacciones_data
 
         credito_otorgado_current = current_ventas_df[
-            (current_ventas_df["Tipo de venta"].isin(["Crédito", "Mixta"])) &
+            (current_ventas_df["Tipo de venta"].isin(TIPOS_VENTA_CREDITO)) &
             (current_ventas_df["Cliente"] == cliente_seleccionado)
             ]["Monto Crédito"].sum()
 
@@ -464,77 +428,113 @@ def render():
             st.session_state["pago_anticipo_info"] = {}
             st.rerun()
 
+    st.divider()
+    st.subheader("🏦 Importar estado de cuenta")
+    st.caption("Los depósitos se asignan a clientes por RFC o ID en la referencia, por nombre y por monto igual al "
+               "saldo pendiente. Revisa la propuesta y registra todos los confirmados de una vez; lo que exceda "
+               "el saldo queda como anticipo.")
+    if "banco_msg" in st.session_state:
+        st.success(st.session_state.pop("banco_msg"))
+
+    archivo_banco = st.file_uploader(
+        "Estado de cuenta (CSV o Excel con fecha, referencia o concepto y abono)", type=["csv", "xlsx"],
+        key="banco_archivo"
+    )
+    if archivo_banco is not None:
+        if archivo_banco.name.lower().endswith(".csv"):
+            estado_df = pd.read_csv(archivo_banco, dtype=str)
+        else:
+            estado_df = pd.read_excel(archivo_banco)
+
+        try:
+            depositos_df = normalizar_estado_cuenta(estado_df)
+        except ValueError as e:
+            st.error(f"❌ {e}")
+        else:
+            ya_importados = depositos_df["ID Depósito"].isin(leer_depositos_importados())
+            if ya_importados.any():
+                st.info(f"{int(ya_importados.sum())} depósito(s) de este archivo ya estaban registrados y se omiten.")
+            depositos_df = depositos_df[~ya_importados]
+
+            if depositos_df.empty:
+                st.info("No hay depósitos nuevos por registrar en este archivo.")
+            else:
+                propuesta = conciliar_depositos(depositos_df, clientes_df, saldos_completos)
+                propuesta.insert(0, "Confirmar", propuesta["Confianza"].isin(["Alta", "Media"]))
+                revisada = st.data_editor(
+                    propuesta,
+                    column_config={
+                        "Confirmar": st.column_config.CheckboxColumn("Confirmar"),
+                        "Cliente": st.column_config.SelectboxColumn("Cliente", options=cliente_opciones),
+                        "Monto": st.column_config.NumberColumn("Monto", format="$%.2f"),
+                        "ID Depósito": None,
+                    },
+                    disabled=[c for c in propuesta.columns if c not in ("Confirmar", "Cliente")],
+                    hide_index=True, use_container_width=True, key=f"banco_editor_{archivo_banco.name}"
+                )
+                pagos_banco = repartir_depositos(revisada[revisada["Confirmar"]], saldos_completos)
+
+                col_b1, col_b2, col_b3, col_b4 = st.columns(4)
+                col_b1.metric("Depósitos", len(propuesta))
+                col_b2.metric("Sin cliente", int(revisada["Cliente"].isna().sum()))
+                col_b3.metric("Abonos", f"${pagos_banco['Abono'].sum():,.2f}")
+                col_b4.metric("Anticipos", f"${pagos_banco['Anticipo'].sum():,.2f}")
+
+                if st.button(f"✅ Registrar {len(pagos_banco)} depósito(s)", key="banco_registrar",
+                             disabled=pagos_banco.empty):
+                    try:
+                        registrados, omitidos = registrar_depositos(pagos_banco)
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+                    else:
+                        st.session_state.banco_msg = (
+                            f"✅ {registrados} depósito(s) registrados: ${pagos_banco['Abono'].sum():,.2f} en abonos "
+                            f"y ${pagos_banco['Anticipo'].sum():,.2f} en anticipos."
+                            + (f" {omitidos} ya estaban registrados." if omitidos else "")
+                        )
+                        st.rerun()
+
     st.divider()
     st.subheader("📑 Historial de pagos y anticipos")
 
     # --- Selectores de fecha para el historial ---
+    # Los límites salen de metadatos cacheados por versión de datos, sin copiar el frame
+    fecha_min, fecha_max = rango_fechas("transacciones", st.session_state.get("uid"))
     col_hist1, col_hist2 = st.columns(2)
     with col_hist1:
-        # Asegúrate de que las fechas por defecto sean datetime.date.today()
-        # y que se maneje el caso de DataFrame vacío.
-        default_start_date_hist = datetime.date.today() # Valor por defecto a hoy
-        if not st.session_state.transacciones_data.empty and "Fecha" in st.session_state.transacciones_data.columns:
-            # Convertir a datetime antes de buscar min
-            # Crear una copia para evitar SettingWithCopyWarning
-            temp_df_for_dates = st.session_state.transacciones_data.copy()
-            temp_df_for_dates["Fecha_dt"] = pd.to_datetime(temp_df_for_dates["Fecha"], errors='coerce')
-            # Filtrar NaT antes de encontrar el mínimo, o establecer una fecha predeterminada
-            valid_dates = temp_df_for_dates["Fecha_dt"].dropna()
-            if not valid_dates.empty:
-                default_start_date_hist = valid_dates.min().date()
-
-        start_date_hist = st.date_input("Fecha de inicio (historial)", value=default_start_date_hist)
-
+        start_date_hist = st.date_input("Fecha de inicio (historial)", value=fecha_min or datetime.date.today())
     with col_hist2:
-        default_end_date_hist = datetime.date.today() # Valor por defecto a hoy
-        if not st.session_state.transacciones_data.empty and "Fecha" in st.session_state.transacciones_data.columns:
-            temp_df_for_dates = st.session_state.transacciones_data.copy()
-            temp_df_for_dates["Fecha_dt"] = pd.to_datetime(temp_df_for_dates["Fecha"], errors='coerce')
-            valid_dates = temp_df_for_dates["Fecha_dt"].dropna()
-            if not valid_dates.empty:
-                default_end_date_hist = valid_dates.max().date()
-
-        end_date_hist = st.date_input("Fecha de fin (historial)", value=default_end_date_hist)
-
-
-    historial_transacciones = st.session_state.transacciones_data[
-        st.session_state.transacciones_data["Categoría"].astype(str).isin(
-            ["Cobranza", "Anticipo Cliente", "Anticipo Aplicado"])
-    ].copy() if not st.session_state.transacciones_data.empty else pd.DataFrame()
-
-    if not historial_transacciones.empty:
-        # Asegurarse de que la columna 'Fecha' sea datetime para el filtrado
-        # Crear una copia para evitar SettingWithCopyWarning
-        historial_transacciones["Fecha_dt"] = pd.to_datetime(historial_transacciones["Fecha"], errors='coerce')
-
-        # Eliminar filas con fechas inválidas (NaT) antes de filtrar
-        historial_transacciones.dropna(subset=['Fecha_dt'], inplace=True)
-
-
-        # Aplicar filtro por fechas
+        end_date_hist = st.date_input("Fecha de fin (historial)", value=fecha_max or datetime.date.today())
+
+    columnas_historial = ["Fecha", "Cliente", "Descripción", "Monto", "Método de pago", "Categoría", "Tipo"]
+    transacciones_hist = st.session_state.transacciones_data
+    if transacciones_hist.empty:
+        st.info("Aún no se han registrado pagos o anticipos.")
+    elif not all(col in transacciones_hist.columns for col in columnas_historial):
+        st.info("Columnas necesarias para el historial no encontradas. Asegúrese de que los datos sean correctos.")
+    else:
+        historial_transacciones = transacciones_hist.loc[
+            transacciones_hist["Categoría"].astype(str).isin(["Cobranza", "Anticipo Cliente", "Anticipo Aplicado"]),
+            columnas_historial
+        ]
+        fechas_hist = pd.to_datetime(historial_transacciones["Fecha"], errors="coerce").dt.date
+        en_rango = fechas_hist.notna()
         if start_date_hist:
-            historial_transacciones = historial_transacciones[historial_transacciones["Fecha_dt"].dt.date >= start_date_hist]
+            en_rango &= fechas_hist >= start_date_hist
         if end_date_hist:
-            historial_transacciones = historial_transacciones[historial_transacciones["Fecha_dt"].dt.date <= end_date_hist]
-
-        if all(col in historial_transacciones.columns for col in
-               ["Fecha", "Cliente", "Descripción", "Monto", "Método de pago",
-                "Categoría", "Tipo"]):
-            df_historial_to_display_export = historial_transacciones[
-                ["Fecha", "Cliente", "Descripción", "Monto", "Método de pago", "Categoría", "Tipo"]
-            ].sort_values("Fecha", ascending=False)
-            st.dataframe(df_historial_to_display_export, use_container_width=True)
-
-            if not df_historial_to_display_export.empty:
-                st.download_button(
-                    label="Exportar historial a Excel",
-                    data=to_excel(df_historial_to_display_export),
-                    file_name="historial_pagos_anticipos.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-            else:
-                st.info("No hay pagos o anticipos en el rango de fechas seleccionado.")
+            en_rango &= fechas_hist <= end_date_hist
+        historial_transacciones = historial_transacciones[en_rango]
+
+        if historial_transacciones.empty:
+            st.info("No hay pagos o anticipos en el rango de fechas seleccionado.")
         else:
-            st.info("Columnas necesarias para el historial no encontradas. Asegúrese de que los datos sean correctos.")
-    else:
-        st.info("Aún no se han registrado pagos o anticipos.")
\ No newline at end of file
+            df_historial_to_display_export = tabla_paginada(
+                historial_transacciones, "cobranza_historial", orden_por="Fecha",
+                filtros=["Categoría", "Método de pago"], busqueda=["Cliente", "Descripción"]
+            )
+            st.download_button(
+                label="Exportar historial a Excel",
+                data=to_excel(df_historial_to_display_export),
+                file_name="historial_pagos_anticipos.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
\ No newline at end of file
@@ -3,13 +3,15 @@ import pandas as pd
 import plotly.express as px
 import io
 import datetime
-from utils.db import guardar_transaccion, leer_transacciones
+from utils.db import guardar_transaccion, leer_transacciones, version_vistas
+from utils.graficas import figura
+from modules.tabla_paginada import tabla_paginada
 
 
-# --- Cachear transacciones ---
-@st.cache_data(ttl=60)
-def get_transacciones():
-    df = pd.DataFrame(leer_transacciones())
+# --- Cachear transacciones (por negocio y versión de datos) ---
+@st.cache_data(ttl=3600, max_entries=50)
+def get_transacciones(uid, version):
+    df = pd.DataFrame(leer_transacciones(uid))
     if "Monto" in df.columns:
         df["Monto"] = pd.to_numeric(df["Monto"], errors="coerce").fillna(0.0)
     return df
@@ -22,11 +24,13 @@ def render():
 
     st.title("🧾 Contabilidad")
 
-    # Cargar transacciones
-    if "transacciones" not in st.session_state:
-        st.session_state.transacciones = get_transacciones()
-    elif st.session_state.get("reload_transacciones", False):
-        st.session_state.transacciones = get_transacciones()
+    # Cargar transacciones; se recargan si cambió la versión de datos
+    uid = st.session_state.uid
+    version = version_vistas(uid)
+    if ("transacciones" not in st.session_state or st.session_state.get("reload_transacciones", False)
+            or st.session_state.get("transacciones_version") != version):
+        st.session_state.transacciones = get_transacciones(uid, version)
+        st.session_state.transacciones_version = version
         st.session_state.reload_transacciones = False
 
     # --- Formulario para nueva transacción ---
@@ -79,8 +83,9 @@ def render():
         st.info("Aún no hay transacciones registradas.")
         return
 
-    # Usamos el DataFrame completo para el historial
-    st.dataframe(st.session_state.transacciones, use_container_width=True)
+    # Solo se envía al navegador la página visible del historial
+    tabla_paginada(st.session_state.transacciones, "contabilidad_historial", orden_por="Fecha",
+                   filtros=["Tipo", "Categoría"], busqueda=["Descripción", "Cliente"])
 
     st.divider()
     st.subheader("📉 Balance general")
@@ -114,9 +119,13 @@ def render():
     df_grafico_filtrado = df_grafico[df_grafico["Categoría"] != "Cobranza"]
 
     if not df_grafico_filtrado.empty:
-        resumen_tipo = df_grafico_filtrado.groupby("Tipo")["Monto"].sum().reset_index()
-        fig = px.pie(resumen_tipo, names="Tipo", values="Monto",
-                     title="Ingresos Brutos vs Egresos", template="plotly_white")
+        def construir_pie():
+            resumen_tipo = df_grafico_filtrado.groupby("Tipo")["Monto"].sum().reset_index()
+            return px.pie(resumen_tipo, names="Tipo", values="Monto",
+                          title="Ingresos Brutos vs Egresos", template="plotly_white")
+
+        fig = figura(st.session_state.get("uid"), "contabilidad_distribucion",
+                     df_grafico_filtrado[["Tipo", "Monto"]], construir_pie)
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("No hay datos para mostrar en el gráfico (excluyendo la cobranza).")
@@ -134,16 +143,17 @@ def render():
         )
         st.dataframe(resumen_tipo_categoria, use_container_width=True)
 
-        fig_tc = px.bar(
-            resumen_tipo_categoria,
-            x="Categoría",
-            y="Monto",
-            color="Tipo",
-            barmode="group",
-            title="Importe por categoría y tipo",
-            template="plotly_white",
-            text_auto=".2s"
-        )
+        fig_tc = figura(st.session_state.get("uid"), "contabilidad_tipo_categoria", resumen_tipo_categoria,
+                        lambda: px.bar(
+                            resumen_tipo_categoria,
+                            x="Categoría",
+                            y="Monto",
+                            color="Tipo",
+                            barmode="group",
+                            title="Importe por categoría y tipo",
+                            template="plotly_white",
+                            text_auto=".2s"
+                        ))
         st.plotly_chart(fig_tc, use_container_width=True)
 
     st.subheader("📤 Exportar historial contable")
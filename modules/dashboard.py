@@ -4,39 +4,79 @@ import plotly.express as px
 import io
 import datetime
 from PIL import Image
-from utils.db import leer_ventas, leer_transacciones, leer_clientes, leer_productos
+from concurrent.futures import as_completed
+from utils.db import leer_ventas, leer_transacciones, leer_clientes, leer_productos, precarga_en_curso, \
+    version_vistas
+from utils.reportes import calcular_reorden, VENTANAS_VELOCIDAD, calcular_margenes, AGRUPACIONES_MARGEN
+from utils.graficas import figura, agrupar_por_periodo
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-# --- Funciones cacheadas ---
-@st.cache_data(ttl=60)
-def get_ventas():
-    return pd.DataFrame(leer_ventas())
+# --- Columnas que usa el panel (solo se piden esos campos a Firestore) ---
+CAMPOS_VENTAS = ["Fecha", "Cliente", "Producto", "Clave del Producto", "Cantidad", "Total", "Descuento", "Folio",
+                 "Costo Unitario"]
+CAMPOS_TRANSACCIONES = ["Cliente", "Monto", "Tipo", "Categoría"]
+CAMPOS_CLIENTES = ["ID", "Nombre"]
+CAMPOS_PRODUCTOS = ["Clave", "Nombre", "Precio Unitario", "Costo Unitario", "Cantidad"]
 
 
-@st.cache_data(ttl=60)
-def get_transacciones():
-    df = pd.DataFrame(leer_transacciones())
-    if "Monto" in df.columns:
-        df["Monto"] = pd.to_numeric(df["Monto"], errors="coerce").fillna(0.0)
-    return df
+# --- Funciones cacheadas (por usuario) ---
+@st.cache_data(ttl=3600, max_entries=50)
+def get_ventas(uid, version):
+    # `version` (version_vistas) cambia con cada escritura del usuario y al vencer
+    # las lecturas, así que una escritura se ve en el siguiente rerun, la de otro
+    # proceso en unos minutos, y los derivados de abajo leen los datos de la misma
+    # versión con la que se guardan. ttl y max_entries solo acotan la memoria de
+    # las versiones viejas.
+    return pd.DataFrame(leer_ventas(uid, campos=CAMPOS_VENTAS))
 
 
-@st.cache_data(ttl=60)
-def get_clientes():
-    return pd.DataFrame(leer_clientes())
+@st.cache_data(ttl=3600, max_entries=50)
+def get_transacciones(uid, version):
+    return pd.DataFrame(leer_transacciones(uid, campos=CAMPOS_TRANSACCIONES))
 
 
-@st.cache_data(ttl=60)
-def get_productos():
-    return pd.DataFrame(leer_productos())
+@st.cache_data(ttl=3600, max_entries=50)
+def get_clientes(uid, version):
+    return pd.DataFrame(leer_clientes(uid, campos=CAMPOS_CLIENTES))
+
+
+@st.cache_data(ttl=3600, max_entries=50)
+def get_productos(uid, version):
+    return pd.DataFrame(leer_productos(uid, campos=CAMPOS_PRODUCTOS))
+
+
+@st.cache_data(ttl=3600, max_entries=50)
+def get_reorden(uid, version, ventana, dias_cobertura, dias_entrega):
+    # `version` cambia con cada escritura del usuario, así que el cálculo se reutiliza
+    # mientras los datos no cambien
+    return calcular_reorden(get_ventas(uid, version), get_productos(uid, version), ventana, dias_cobertura,
+                            dias_entrega)
+
+
+@st.cache_data(ttl=3600, max_entries=50)
+def get_margenes(uid, version):
+    return calcular_margenes(get_ventas(uid, version))
+
+
+def esperar_precarga(uid):
+    """Muestra el avance de la precarga lanzada al iniciar sesión hasta que termine."""
+    futuros = precarga_en_curso(uid)
+    if not futuros:
+        return
+    barra = st.progress(0.0, text="Cargando datos del negocio...")
+    nombres = {f: col for col, f in futuros.items()}
+    for i, futuro in enumerate(as_completed(futuros.values()), start=1):
+        barra.progress(i / len(futuros), text=f"Cargado: {nombres[futuro]} ({i}/{len(futuros)})")
+    barra.empty()
 
 
 # --- FUNCIÓN CORREGIDA PARA CALCULAR EL BALANCE ---
 def calcular_balance_contable():
-    transacciones_df = get_transacciones()
+    uid = st.session_state.uid
+    transacciones_df = get_transacciones(uid, version_vistas(uid))
 
     # Ingresos brutos: ventas al contado + ventas a crédito
     ingresos_brutos = transacciones_df[
@@ -82,27 +122,17 @@ def render():
 
     st.markdown("### 📊 Panel financiero en tiempo real")
 
-    # 🔄 Cargar datos solo si no están o si hay reload
-    if "ventas" not in st.session_state or st.session_state.get("reload_ventas", False):
-        st.session_state.ventas = get_ventas()
-        st.session_state.reload_ventas = False
-
-    if "transacciones" not in st.session_state or st.session_state.get("reload_transacciones", False):
-        st.session_state.transacciones = get_transacciones()
-        st.session_state.reload_transacciones = False
-
-    if "clientes" not in st.session_state or st.session_state.get("reload_clientes", False):
-        st.session_state.clientes = get_clientes()
-        st.session_state.reload_clientes = False
+    # ⏳ Si la precarga del login sigue en curso, esperar mostrando el avance
+    uid = st.session_state.uid
+    esperar_precarga(uid)
 
-    if "productos" not in st.session_state or st.session_state.get("reload_productos", False):
-        st.session_state.productos = get_productos()
-        st.session_state.reload_productos = False
-
-    ventas_df = st.session_state.ventas
-    transacciones_df = st.session_state.transacciones
-    clientes_df = st.session_state.clientes
-    productos_df = st.session_state.productos
+    # 🔄 Cargar solo las columnas del panel. No se guardan en session_state para no
+    # compartir frames recortados con las otras páginas.
+    version = version_vistas(uid)
+    ventas_df = get_ventas(uid, version)
+    transacciones_df = get_transacciones(uid, version)
+    clientes_df = get_clientes(uid, version)
+    productos_df = get_productos(uid, version)
 
     # ✅ Asegurar numéricos
     if "Total" not in ventas_df.columns:
@@ -126,9 +156,9 @@ def render():
         "Categoría": ["Ingresos Brutos", "Ingresos Reales", "Egresos Totales", "Balance Neto"],
         "Monto": [ingresos_brutos_calc, ingresos_reales_calc, egresos_totales_calc, balance_neto_calc]
     })
-    st.plotly_chart(px.bar(df_bar, x="Categoría", y="Monto", color="Categoría",
-                           template="plotly_white", title="Distribución por tipo"),
-                    use_container_width=True)
+    st.plotly_chart(figura(uid, "dashboard_composicion", df_bar, lambda: px.bar(
+        df_bar, x="Categoría", y="Monto", color="Categoría", template="plotly_white", title="Distribución por tipo"
+    )), use_container_width=True)
 
     st.divider()
     st.markdown("### 📑 Desglose por tipo y categoría")
@@ -141,7 +171,7 @@ def render():
             .sort_values(by="Monto", ascending=False)
         )
         st.dataframe(resumen_tipo_categoria, use_container_width=True)
-        fig_tc = px.bar(
+        fig_tc = figura(uid, "dashboard_tipo_categoria", resumen_tipo_categoria, lambda: px.bar(
             resumen_tipo_categoria,
             x="Monto",
             y="Categoría",
@@ -151,7 +181,7 @@ def render():
             template="plotly_white",
             text_auto=".2s",
             orientation="h"
-        )
+        ))
         st.plotly_chart(fig_tc, use_container_width=True)
     else:
         st.info("No hay datos de transacciones para mostrar el desglose por categoría.")
@@ -165,10 +195,12 @@ def render():
     with col5:
         st.write("#### Flujo de ventas por día")
         if not ventas_df.empty and "Fecha" in ventas_df.columns:
-            ventas_df['Fecha'] = pd.to_datetime(ventas_df['Fecha'])
-            flujo = ventas_df.groupby("Fecha")["Total"].sum().reset_index().sort_values(by="Fecha")
-            st.plotly_chart(px.line(flujo, x="Fecha", y="Total", markers=True,
-                                    template="plotly_white", title="Ingresos diarios por ventas"),
+            def construir_flujo():
+                flujo, periodo = agrupar_por_periodo(ventas_df, "Fecha", "Total")
+                return px.line(flujo, x="Fecha", y="Total", markers=True,
+                               template="plotly_white", title=f"Ingresos por ventas por {periodo}")
+
+            st.plotly_chart(figura(uid, "dashboard_flujo", ventas_df[["Fecha", "Total"]], construir_flujo),
                             use_container_width=True)
         else:
             st.info("No hay ventas registradas aún para mostrar el flujo diario.")
@@ -180,22 +212,43 @@ def render():
                                                                                                  ascending=False)
         st.subheader("💼 Ventas por cliente")
         st.dataframe(resumen_clientes, use_container_width=True)
-        st.plotly_chart(px.bar(resumen_clientes, x="Cliente", y="Total",
-                               title="Ingresos por cliente", template="plotly_white"),
-                        use_container_width=True)
+        st.plotly_chart(figura(uid, "dashboard_clientes", resumen_clientes, lambda: px.bar(
+            resumen_clientes, x="Cliente", y="Total", title="Ingresos por cliente", template="plotly_white"
+        )), use_container_width=True)
 
         resumen_productos = ventas_df.groupby("Producto")["Cantidad"].sum().reset_index().sort_values(by="Cantidad",
                                                                                                       ascending=False)
         st.subheader("📦 Productos más vendidos (por cantidad)")
         st.dataframe(resumen_productos, use_container_width=True)
-        st.plotly_chart(px.bar(resumen_productos, x="Producto", y="Cantidad",
-                               title="Ranking de productos", template="plotly_white"),
-                        use_container_width=True)
+        st.plotly_chart(figura(uid, "dashboard_productos", resumen_productos, lambda: px.bar(
+            resumen_productos, x="Producto", y="Cantidad", title="Ranking de productos", template="plotly_white"
+        )), use_container_width=True)
     else:
         st.info("No hay datos de ventas para mostrar análisis por cliente y producto.")
         resumen_clientes = pd.DataFrame()
         resumen_productos = pd.DataFrame()
 
+    st.divider()
+    st.subheader("🔁 Sugerencias de reabasto")
+    reorden_df = pd.DataFrame()
+    if not productos_df.empty:
+        col_r1, col_r2, col_r3 = st.columns(3)
+        with col_r1:
+            ventana = st.selectbox("Ventana de velocidad (días)", VENTANAS_VELOCIDAD, index=1, key="reorden_ventana")
+        with col_r2:
+            dias_cobertura = st.number_input("Días de cobertura objetivo", min_value=1, value=30, step=1,
+                                             key="reorden_cobertura")
+        with col_r3:
+            dias_entrega = st.number_input("Días de entrega del proveedor", min_value=0, value=7, step=1,
+                                           key="reorden_entrega")
+
+        reorden_df = get_reorden(uid, version, ventana, int(dias_cobertura), int(dias_entrega))
+        solo_sugeridos = st.checkbox("Mostrar solo productos a reabastecer", value=True, key="reorden_solo")
+        vista_reorden = reorden_df[reorden_df["Sugerido"] > 0] if solo_sugeridos else reorden_df
+        st.dataframe(vista_reorden, use_container_width=True)
+    else:
+        st.info("No hay productos registrados para calcular el reabasto.")
+
     if "Costo Unitario" in productos_df.columns and "Precio Unitario" in productos_df.columns:
         st.divider()
         st.subheader("📊 Margen por producto (Unitario)")
@@ -206,13 +259,30 @@ def render():
         st.info("No hay datos completos de costo unitario o precio unitario para calcular el margen.")
         margen_df = pd.DataFrame()
 
+    st.divider()
+    st.subheader("💹 Margen bruto de lo vendido")
+    margenes = get_margenes(uid, version)
+    if not ventas_df.empty:
+        st.caption("Ingreso neto de descuento menos el costo guardado en cada renglón al momento de la venta.")
+        agrupar_margen = st.radio("Agrupar por", list(AGRUPACIONES_MARGEN), horizontal=True, key="margen_agrupar")
+        tabla_margen = margenes[agrupar_margen]
+        sin_costo = int(tabla_margen["Renglones sin costo"].sum())
+        if sin_costo:
+            st.warning(f"⚠️ {sin_costo} renglones de venta no tienen costo; su margen aparece igual al ingreso. "
+                       f"Un administrador puede rellenarlos desde Administración.")
+        st.dataframe(tabla_margen, use_container_width=True)
+    else:
+        st.info("No hay ventas para calcular el margen.")
+
     st.divider()
     st.subheader("📤 Exportar resumen")
     resumen_para_exportar = {
         "Resumen Financiero": df_bar,
         "Ventas por Cliente": resumen_clientes,
         "Productos Mas Vendidos": resumen_productos,
-        "Margen por Producto": margen_df
+        "Margen por Producto": margen_df,
+        **{f"Margen Bruto por {nombre}": tabla for nombre, tabla in margenes.items()},
+        "Sugerencias de Reabasto": reorden_df
     }
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
@@ -2,18 +2,30 @@ import streamlit as st
 import io
 import pandas as pd
 import datetime
+from utils.reportes import calcular_diferencias_conteo
 from utils.db import (
     guardar_producto,
     leer_productos,
     actualizar_producto_por_clave,
     eliminar_producto_por_clave,
-    guardar_transaccion
+    guardar_transaccion,
+    registrar_movimiento,
+    actualizar_productos_lote,
+    aplicar_ajustes_inventario,
+    leer_kardex,
+    existencias_a_fecha,
+    leer_familias,
+    guardar_familia,
+    agregar_variantes,
+    version_vistas
 )
 
 # --- Cachear productos para reducir llamadas a Firestore ---
-@st.cache_data(ttl=60)
-def get_productos():
-    return leer_productos()
+# `version` (version_vistas) cambia con cada escritura del negocio y al vencer las
+# lecturas: la lectura se reutiliza mientras tanto y nunca se comparte entre negocios
+@st.cache_data(ttl=3600, max_entries=50)
+def get_productos(uid, version):
+    return leer_productos(uid)
 
 
 # Helper para Excel
@@ -26,11 +38,13 @@ def to_excel(df):
 def render():
     st.title("📦 Gestión de Productos")
 
-    # Cargar productos (cacheado)
-    if "productos" not in st.session_state:
-        st.session_state.productos = get_productos()
-    elif st.session_state.get("reload_productos", False):
-        st.session_state.productos = get_productos()
+    # Cargar productos (cacheado); se recargan si cambió la versión de datos
+    uid = st.session_state.get("uid")
+    version = version_vistas(uid)
+    if ("productos" not in st.session_state or st.session_state.get("reload_productos", False)
+            or st.session_state.get("productos_version") != version):
+        st.session_state.productos = get_productos(uid, version)
+        st.session_state.productos_version = version
         st.session_state.reload_productos = False
 
     # --- Agregar nuevo producto ---
@@ -50,18 +64,22 @@ def render():
         submitted_add = st.form_submit_button("Guardar nuevo producto")
 
         if submitted_add:
-            if clave in st.session_state.productos["Clave"].values:
-                st.error(f"❌ Ya existe un producto con la clave '{clave}'.")
+            if not clave:
+                st.error("⚠️ Debes ingresar la clave del producto.")
             elif precio <= 0 or costo < 0 or cantidad <= 0:
                 st.warning("⚠️ El precio y la cantidad deben ser mayores a cero. El costo no puede ser negativo.")
+            # La unicidad de la Clave la valida Firestore al crear su reserva
+            elif not guardar_producto({
+                "Clave": clave, "Nombre": nombre, "Marca_Tipo": marca_tipo,
+                "Modelo": modelo, "Color": color, "Talla": talla,
+                "Categoría": categoria, "Precio Unitario": precio,
+                "Costo Unitario": costo, "Cantidad": cantidad,
+                "Descripción": descripcion
+            }):
+                st.error(f"❌ Ya existe un producto con la clave '{clave}'.")
             else:
-                guardar_producto({
-                    "Clave": clave, "Nombre": nombre, "Marca_Tipo": marca_tipo,
-                    "Modelo": modelo, "Color": color, "Talla": talla,
-                    "Categoría": categoria, "Precio Unitario": precio,
-                    "Costo Unitario": costo, "Cantidad": cantidad,
-                    "Descripción": descripcion
-                })
+                registrar_movimiento(clave, "Entrada", cantidad, costo, existencia=cantidad,
+                                     referencia="Alta de producto")
                 if costo * cantidad > 0:
                     guardar_transaccion({
                         "Fecha": datetime.date.today().isoformat(),
@@ -75,6 +93,95 @@ def render():
 
     st.divider()
 
+    # --- Familias de variantes ---
+    st.subheader("👕 Familias de variantes")
+    st.caption("Un modelo con sus combinaciones de color y talla se guarda en un solo documento; "
+               "en Ventas se elige primero el modelo y luego la variante.")
+    if "familia_msg" in st.session_state:
+        st.success(st.session_state.pop("familia_msg"))
+
+    familias = leer_familias()
+    etiquetas_familia = dict(zip(familias["ID"], familias["Nombre"].astype(str) + " | "
+                                 + familias["Marca_Tipo"].astype(str) + " " + familias["Modelo"].astype(str)))
+    destino = st.selectbox("Familia", ["(Nueva familia)"] + familias["ID"].tolist(),
+                           format_func=lambda f: etiquetas_familia.get(f, f), key="familia_destino")
+    nueva = destino == "(Nueva familia)"
+    if nueva:
+        col_f1, col_f2 = st.columns(2)
+        with col_f1:
+            familia_nombre = st.text_input("Nombre", key="familia_nombre")
+            familia_marca = st.text_input("Marca_Tipo", key="familia_marca")
+            familia_modelo = st.text_input("Modelo", key="familia_modelo")
+        with col_f2:
+            familia_categoria = st.selectbox("Categoría", ["Producto", "Servicio", "Insumos", "Otro"],
+                                             key="familia_categoria")
+            familia_descripcion = st.text_area("Descripción", key="familia_descripcion")
+
+    col_f3, col_f4, col_f5 = st.columns(3)
+    with col_f3:
+        prefijo = st.text_input("Prefijo de clave", key="familia_prefijo", placeholder="POLO")
+        colores = st.text_input("Colores (separados por coma)", key="familia_colores", placeholder="Rojo, Azul")
+    with col_f4:
+        tallas = st.text_input("Tallas (separadas por coma)", key="familia_tallas", placeholder="CH, M, G")
+        precio_familia = st.number_input("Precio Unitario", min_value=0.0, format="%.2f", key="familia_precio")
+    with col_f5:
+        costo_familia = st.number_input("Costo Unitario", min_value=0.0, format="%.2f", key="familia_costo")
+
+    lista_colores = [c.strip() for c in colores.split(",") if c.strip()] or [""]
+    lista_tallas = [t.strip() for t in tallas.split(",") if t.strip()] or [""]
+    if prefijo and (colores.strip() or tallas.strip()):
+        matriz = pd.DataFrame(
+            [{"Clave": "-".join(p for p in [prefijo.strip(), color, talla] if p).upper().replace(" ", ""),
+              "Color": color, "Talla": talla, "Precio Unitario": precio_familia,
+              "Costo Unitario": costo_familia, "Cantidad": 0}
+             for color in lista_colores for talla in lista_tallas]
+        )
+        matriz = st.data_editor(matriz, use_container_width=True, num_rows="dynamic", key="familia_matriz")
+        matriz = matriz.dropna(subset=["Clave"])
+        matriz = matriz[matriz["Clave"].astype(str).str.strip() != ""]
+        numericas = ["Precio Unitario", "Costo Unitario", "Cantidad"]
+        matriz[numericas] = matriz[numericas].apply(pd.to_numeric, errors="coerce").fillna(0.0)
+
+        if st.button(f"💾 Guardar {len(matriz)} variante(s)", key="familia_guardar"):
+            variantes = {str(f["Clave"]).strip(): f for f in matriz.to_dict(orient="records")}
+            if len(variantes) < len(matriz):
+                st.error("❌ Hay Claves repetidas en la matriz.")
+            elif nueva and not familia_modelo:
+                st.error("⚠️ Debes ingresar el modelo de la familia.")
+            else:
+                if nueva:
+                    guardado = guardar_familia({
+                        "Nombre": familia_nombre, "Marca_Tipo": familia_marca, "Modelo": familia_modelo,
+                        "Categoría": familia_categoria, "Descripción": familia_descripcion,
+                    }, variantes) is not None
+                else:
+                    guardado = agregar_variantes(destino, variantes)
+                if not guardado:
+                    st.error("❌ Alguna de las Claves ya existe; no se guardó ninguna variante.")
+                else:
+                    # Entrada inicial de inventario, igual que el alta de un producto
+                    compra = 0.0
+                    for clave_v, f in variantes.items():
+                        if f["Cantidad"] > 0:
+                            registrar_movimiento(clave_v, "Entrada", f["Cantidad"], f["Costo Unitario"],
+                                                 existencia=f["Cantidad"], referencia="Alta de producto")
+                            compra += f["Cantidad"] * f["Costo Unitario"]
+                    if compra > 0:
+                        modelo_txt = familia_modelo if nueva else etiquetas_familia.get(destino, destino)
+                        guardar_transaccion({
+                            "Fecha": datetime.date.today().isoformat(),
+                            "Descripción": f"Compra inicial de inventario: {modelo_txt} ({len(variantes)} variantes)",
+                            "Categoría": "Compras", "Tipo": "Egreso",
+                            "Monto": float(compra), "Cliente": "N/A", "Método de pago": "N/A"
+                        })
+                    st.session_state.familia_msg = f"✅ {len(variantes)} variante(s) guardadas."
+                    st.session_state.reload_productos = True
+                    st.rerun()
+    else:
+        st.info("Escribe el prefijo de clave y los colores o tallas para armar la matriz de variantes.")
+
+    st.divider()
+
     # --- Inventario / Catálogo ---
     st.subheader("📋 Inventario / Catálogo")
     filtro = st.text_input("Buscar por clave o nombre")
@@ -119,6 +226,8 @@ def render():
                     "Cantidad": nueva_cantidad,
                     "Costo Unitario": costo_unitario
                 })
+                registrar_movimiento(producto_sel, "Entrada", cantidad_entrada, costo_unitario,
+                                     existencia=nueva_cantidad, referencia="Reabastecimiento")
                 if costo_unitario * cantidad_entrada > 0:
                     guardar_transaccion({
                         "Fecha": datetime.date.today().isoformat(),
@@ -165,3 +274,171 @@ def render():
             st.session_state.reload_productos = True
             st.success("✅ Producto eliminado.")
             st.rerun()
+
+    st.divider()
+
+    # --- Edición masiva ---
+    st.subheader("🧮 Edición masiva de productos")
+    if "edicion_masiva_resultado" in st.session_state:
+        st.success(st.session_state.pop("edicion_masiva_resultado"))
+
+    if not st.session_state.productos.empty:
+        base = st.session_state.productos
+        modo = st.radio("Modo", ["Regla de precio", "Tabla editable"], horizontal=True, key="masiva_modo")
+        cambios = {}
+
+        if modo == "Regla de precio":
+            col_m1, col_m2, col_m3 = st.columns(3)
+            with col_m1:
+                categoria_regla = st.selectbox("Categoría", ["Todas"] + sorted(base["Categoría"].dropna().astype(str).unique()),
+                                               key="masiva_categoria")
+                marca_regla = st.selectbox("Marca_Tipo", ["Todas"] + sorted(base["Marca_Tipo"].dropna().astype(str).unique()),
+                                           key="masiva_marca")
+            with col_m2:
+                campo_regla = st.selectbox("Campo", ["Precio Unitario", "Costo Unitario"], key="masiva_campo")
+                porcentaje = st.number_input("Ajuste (%)", value=0.0, step=0.5, format="%.2f", key="masiva_porcentaje")
+            with col_m3:
+                redondeo = st.selectbox("Redondear a", [0.01, 0.5, 1.0, 10.0], key="masiva_redondeo")
+
+            filtro_regla = pd.Series(True, index=base.index)
+            if categoria_regla != "Todas":
+                filtro_regla &= base["Categoría"].astype(str) == categoria_regla
+            if marca_regla != "Todas":
+                filtro_regla &= base["Marca_Tipo"].astype(str) == marca_regla
+
+            actual = base.loc[filtro_regla, campo_regla]
+            nuevo = (actual * (1 + porcentaje / 100) / redondeo).round() * redondeo
+            vista = pd.DataFrame({
+                "Clave": base.loc[filtro_regla, "Clave"],
+                "Nombre": base.loc[filtro_regla, "Nombre"],
+                f"{campo_regla} actual": actual,
+                f"{campo_regla} nuevo": nuevo.round(2),
+            })[(nuevo - actual).abs() > 0.001]
+            cambios = {str(c): {campo_regla: float(v)} for c, v in zip(vista["Clave"], vista[f"{campo_regla} nuevo"])}
+        else:
+            editables = ["Nombre", "Marca_Tipo", "Modelo", "Color", "Talla", "Categoría",
+                         "Precio Unitario", "Costo Unitario"]
+            original = base[["Clave"] + editables].reset_index(drop=True)
+            editado = st.data_editor(original, disabled=["Clave"], use_container_width=True,
+                                     num_rows="fixed", key="masiva_editor")
+            distinto = (editado[editables] != original[editables]) & ~(editado[editables].isna() & original[editables].isna())
+            filas = distinto.any(axis=1)
+            vista = editado[filas]
+            for fila, mascara in zip(vista.to_dict(orient="records"), distinto[filas].to_dict(orient="records")):
+                cambios[str(fila["Clave"])] = {
+                    c: (float(fila[c]) if c in ("Precio Unitario", "Costo Unitario") else fila[c])
+                    for c, cambio in mascara.items() if cambio
+                }
+
+        if cambios:
+            st.markdown(f"**Vista previa:** {len(cambios)} producto(s) cambiarán.")
+            st.dataframe(vista, use_container_width=True)
+            if st.button(f"✅ Aplicar {len(cambios)} cambio(s)", key="masiva_aplicar"):
+                actualizados, segundos = actualizar_productos_lote(cambios)
+                st.session_state.edicion_masiva_resultado = (
+                    f"✅ {actualizados} productos actualizados en {segundos:.2f} s "
+                    f"({actualizados / max(segundos, 1e-6):,.0f} productos/s)."
+                )
+                st.session_state.reload_productos = True
+                st.rerun()
+        else:
+            st.info("No hay cambios para aplicar con los criterios actuales.")
+
+    st.divider()
+
+    # --- Conteo físico ---
+    st.subheader("📝 Conteo físico de inventario")
+    if "conteo_resultado" in st.session_state:
+        st.success(st.session_state.pop("conteo_resultado"))
+
+    archivo_conteo = st.file_uploader(
+        "Hoja de conteo (CSV o Excel con columnas Clave y Contado)", type=["csv", "xlsx"], key="conteo_archivo"
+    )
+    if archivo_conteo is not None:
+        if archivo_conteo.name.lower().endswith(".csv"):
+            conteo_df = pd.read_csv(archivo_conteo, dtype={"Clave": str})
+        else:
+            conteo_df = pd.read_excel(archivo_conteo, dtype={"Clave": str})
+
+        try:
+            diferencias_df, no_encontradas = calcular_diferencias_conteo(st.session_state.productos, conteo_df)
+        except ValueError as e:
+            st.error(f"❌ {e}")
+        else:
+            if no_encontradas:
+                st.warning(f"⚠️ {len(no_encontradas)} clave(s) del conteo no existen en el catálogo: "
+                           f"{', '.join(no_encontradas[:20])}{'...' if len(no_encontradas) > 20 else ''}")
+
+            if diferencias_df.empty:
+                st.info("El conteo coincide con el inventario del sistema.")
+            else:
+                col_c1, col_c2, col_c3 = st.columns(3)
+                col_c1.metric("Productos con diferencia", len(diferencias_df))
+                col_c2.metric("Diferencia en unidades", f"{diferencias_df['Diferencia'].sum():,.0f}")
+                col_c3.metric("Diferencia valuada", f"${diferencias_df['Valor Diferencia'].sum():,.2f}")
+                st.dataframe(diferencias_df, use_container_width=True)
+                st.download_button(
+                    label="Descargar diferencias a Excel",
+                    data=to_excel(diferencias_df),
+                    file_name=f"diferencias_conteo_{datetime.date.today().isoformat()}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+                if st.button(f"✅ Aplicar {len(diferencias_df)} ajuste(s)", key="conteo_aplicar"):
+                    ajustados, segundos = aplicar_ajustes_inventario(diferencias_df)
+                    st.session_state.conteo_resultado = (
+                        f"✅ {ajustados} productos ajustados en {segundos:.2f} s."
+                    )
+                    st.session_state.reload_productos = True
+                    st.rerun()
+
+    st.divider()
+
+    # --- Kardex por producto ---
+    st.subheader("📒 Kardex (movimientos de inventario)")
+    if not st.session_state.productos.empty:
+        claves_kardex = st.session_state.productos["Clave"].dropna().unique().tolist()
+        col_k1, col_k2 = st.columns([3, 1])
+        with col_k1:
+            clave_kardex = st.selectbox("Producto", claves_kardex, key="kardex_clave")
+        with col_k2:
+            tam_pagina = st.selectbox("Movimientos por página", [25, 50, 100], key="kardex_tam_pagina")
+
+        # Cursores de las páginas visitadas; se reinician al cambiar de producto o tamaño
+        if st.session_state.get("kardex_filtro") != (clave_kardex, tam_pagina):
+            st.session_state.kardex_filtro = (clave_kardex, tam_pagina)
+            st.session_state.kardex_cursores = [None]
+
+        cursores = st.session_state.kardex_cursores
+        kardex_df, siguiente = leer_kardex(clave_kardex, limite=tam_pagina, despues_de=cursores[-1])
+        if kardex_df.empty:
+            st.info("Sin movimientos registrados para este producto.")
+        else:
+            st.dataframe(kardex_df, use_container_width=True)
+        st.caption(f"Página {len(cursores)}")
+
+        col_k3, col_k4 = st.columns(2)
+        with col_k3:
+            if st.button("⬅️ Anterior", disabled=len(cursores) == 1, key="kardex_anterior"):
+                cursores.pop()
+                st.rerun()
+        with col_k4:
+            if st.button("Siguiente ➡️", disabled=siguiente is None, key="kardex_siguiente"):
+                cursores.append(siguiente)
+                st.rerun()
+
+    st.divider()
+
+    # --- Existencias y valuación a una fecha ---
+    st.subheader("🗓️ Existencias y valuación a fecha")
+    fecha_valuacion = st.date_input("Fecha", value=datetime.date.today(), key="valuacion_fecha")
+    if st.button("Calcular existencias", key="valuacion_calcular"):
+        existencias_df = existencias_a_fecha(fecha_valuacion)
+        st.metric("Valor del inventario", f"${existencias_df['Valor'].sum():,.2f}")
+        st.dataframe(existencias_df, use_container_width=True)
+        if not existencias_df.empty:
+            st.download_button(
+                label="Descargar existencias a Excel",
+                data=to_excel(existencias_df),
+                file_name=f"existencias_{fecha_valuacion.isoformat()}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
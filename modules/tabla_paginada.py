@@ -0,0 +1,59 @@
+import math
+import streamlit as st
+import pandas as pd
+
+TAMANOS_PAGINA = [25, 50, 100, 250]
+
+
+def tabla_paginada(df, clave, orden_por=None, descendente=True, filtros=(), busqueda=()):
+    """
+    Muestra `df` por páginas: solo la página visible se envía al navegador.
+    `filtros` son columnas con filtro de valores y `busqueda` columnas donde se
+    busca texto. Las claves de los widgets usan el prefijo `clave`.
+    Devuelve el DataFrame filtrado y ordenado (completo), p. ej. para exportar.
+    """
+    if df.empty:
+        st.info("No hay registros para mostrar.")
+        return df
+
+    # --- Filtros ---
+    columnas_ui = st.columns(len(filtros) + (1 if busqueda else 0)) if (filtros or busqueda) else []
+    mascara = pd.Series(True, index=df.index)
+    for col_ui, columna in zip(columnas_ui, filtros):
+        with col_ui:
+            opciones = sorted(df[columna].dropna().astype(str).unique())
+            elegidos = st.multiselect(columna, opciones, key=f"{clave}_filtro_{columna}")
+        if elegidos:
+            mascara &= df[columna].astype(str).isin(elegidos)
+    if busqueda:
+        with columnas_ui[-1]:
+            texto = st.text_input("Buscar", key=f"{clave}_buscar", placeholder=", ".join(busqueda))
+        if texto:
+            coincide = pd.Series(False, index=df.index)
+            for columna in busqueda:
+                coincide |= df[columna].astype(str).str.contains(texto, case=False, regex=False, na=False)
+            mascara &= coincide
+    filtrado = df[mascara]
+
+    # --- Orden y tamaño de página ---
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        columnas = list(df.columns)
+        orden = st.selectbox("Ordenar por", columnas, key=f"{clave}_orden",
+                             index=columnas.index(orden_por) if orden_por in columnas else 0)
+    with col2:
+        sentido = st.selectbox("Sentido", ["Descendente", "Ascendente"], key=f"{clave}_sentido",
+                               index=0 if descendente else 1)
+    with col3:
+        tam_pagina = st.selectbox("Filas por página", TAMANOS_PAGINA, index=1, key=f"{clave}_tam")
+    filtrado = filtrado.sort_values(orden, ascending=sentido == "Ascendente", kind="stable")
+
+    # --- Página visible ---
+    total = len(filtrado)
+    paginas = max(1, math.ceil(total / tam_pagina))
+    pagina = st.number_input("Página", min_value=1, max_value=paginas, step=1, key=f"{clave}_pagina")
+    inicio = (min(pagina, paginas) - 1) * tam_pagina
+    st.dataframe(filtrado.iloc[inicio:inicio + tam_pagina], use_container_width=True)
+    st.caption(f"Mostrando {min(inicio + 1, total)}–{min(inicio + tam_pagina, total)} de {total} registros "
+               f"(página {min(pagina, paginas)} de {paginas}).")
+    return filtrado
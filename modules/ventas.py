@@ -1,9 +1,15 @@
+import re
 import streamlit as st
 from io import BytesIO
 import pandas as pd
 import plotly.express as px
 from utils.db import guardar_venta, leer_ventas, leer_transacciones, guardar_transaccion, leer_clientes, leer_productos, \
-    actualizar_producto_por_clave
+    actualizar_producto_por_clave, registrar_movimiento, siguiente_folio, mapa_catalogo, leer_familias, leer_variantes, \
+    leer_existencias
+from utils.reportes import detectar_transacciones_faltantes, TIPOS_VENTA_CREDITO
+from utils.scheduler import leer_resultado
+from utils.graficas import figura, agrupar_por_periodo
+from utils.devoluciones import resumen_folio, devolver_venta
 
 
 # Helper function to convert DataFrame to Excel
@@ -16,6 +22,60 @@ def to_excel(df):
     return processed_data
 
 
+# Columnas del catálogo que necesita el selector de productos
+CAMPOS_CATALOGO_VENTA = ["Clave", "Nombre", "Marca_Tipo", "Precio Unitario", "Cantidad"]
+SIN_FAMILIA = "(Productos individuales)"
+
+# Captura rápida: "CLAVE" o "3*CLAVE"
+PATRON_CAPTURA = re.compile(r"^\s*(?:(\d+)\s*\*\s*)?(.+?)\s*$")
+
+
+def agregar_por_clave():
+    """Callback del campo de captura rápida: agrega o incrementa el renglón del carrito."""
+    texto = st.session_state.get("venta_captura_rapida", "")
+    st.session_state.venta_captura_rapida = ""
+    coincidencia = PATRON_CAPTURA.match(texto or "")
+    if not coincidencia:
+        return
+    cantidad = int(coincidencia.group(1) or 1)
+    clave = coincidencia.group(2)
+
+    catalogo = mapa_catalogo(st.session_state.get("uid"))
+    if clave not in catalogo:
+        clave = clave.upper()
+    producto = catalogo.get(clave)
+    if producto is None:
+        st.session_state.venta_captura_msg = ("error", f"❌ No existe un producto con la clave '{clave}'.")
+        return
+    if cantidad <= 0:
+        st.session_state.venta_captura_msg = ("error", "❌ La cantidad debe ser mayor que cero.")
+        return
+
+    carrito = st.session_state.setdefault("productos_venta", [])
+    renglones = [p for p in carrito if str(p["Clave del Producto"]) == str(clave)]
+    renglon = renglones[0] if renglones else None
+    # La Clave puede estar en varios renglones (p. ej. uno agregado desde el formulario)
+    en_carrito = sum(p["Cantidad"] for p in renglones)
+    if producto["Cantidad"] >= 0 and en_carrito + cantidad > producto["Cantidad"]:
+        st.session_state.venta_captura_msg = (
+            "error", f"❌ Existencia insuficiente de '{producto['Nombre']}': "
+                     f"{int(producto['Cantidad'])} disponibles, {en_carrito} ya en la venta.")
+        return
+
+    if renglon:
+        renglon["Cantidad"] += cantidad
+        renglon["Subtotal"] = renglon["Cantidad"] * renglon["Precio Unitario"]
+    else:
+        carrito.append({
+            "Clave del Producto": clave,
+            "Producto": producto["Nombre"],
+            "Cantidad": cantidad,
+            "Precio Unitario": producto["Precio Unitario"],
+            "Subtotal": cantidad * producto["Precio Unitario"]
+        })
+    st.session_state.venta_captura_msg = ("success", f"✅ {cantidad} × {producto['Nombre']}")
+
+
 def render():
     st.title("💸 Ventas")
 
@@ -30,11 +90,13 @@ def render():
             st.warning("⚠️ No hay clientes registrados. Agrega alguno en 'Clientes'.")
             st.stop()
 
-    if "productos" not in st.session_state or st.session_state.productos.empty:
-        st.session_state.productos = leer_productos()
-        if st.session_state.productos.empty:
-            st.warning("⚠️ No hay productos registrados. Agrega uno en 'Productos'.")
-            st.stop()
+    # Selector en dos pasos: se leen los productos individuales y solo los
+    # encabezados de las familias; las variantes se cargan al elegir un modelo
+    catalogo_df = leer_productos(campos=CAMPOS_CATALOGO_VENTA, variantes=False)
+    familias_df = leer_familias(campos=["ID", "Nombre", "Marca_Tipo", "Modelo"])
+    if catalogo_df.empty and familias_df.empty:
+        st.warning("⚠️ No hay productos registrados. Agrega uno en 'Productos'.")
+        st.stop()
 
     # Cargar ventas y transacciones si no están o recargarlas para asegurar tipos de datos
     # Mantenemos esto fuera del if submitted para que la UI siempre muestre datos frescos
@@ -52,67 +114,14 @@ def render():
     ventas_df = st.session_state.ventas
     transacciones_df = st.session_state.transacciones_data
 
-    ventas_data = ventas_df.to_dict(orient="records")
-    transacciones_data = transacciones_df.to_dict(orient="records")
-
-    # Creamos un set clave para buscar rápido: (Fecha, Cliente, Monto)
-    transacciones_claves = {
-        (t.get("Fecha"), t.get("Cliente"), round(float(t.get("Monto", 0)), 2))
-        for t in transacciones_data
-    }
-
-    transacciones_creadas = 0
-    for venta in ventas_data:
-        fecha = venta.get("Fecha")
-        cliente = venta.get("Cliente")
-        monto_contado = float(venta.get("Monto Contado", 0) or 0)
-        monto_credito = float(venta.get("Monto Crédito", 0) or 0)
-        anticipo = float(venta.get("Anticipo Aplicado", 0) or 0)
-
-        # Contado
-        if monto_contado > 0:
-            clave = (fecha, cliente, round(monto_contado, 2))
-            if clave not in transacciones_claves:
-                guardar_transaccion({
-                    "Fecha": fecha,
-                    "Descripción": f"Pago de contado por venta a {cliente}",
-                    "Categoría": "Ventas",
-                    "Tipo": "Ingreso",
-                    "Monto": monto_contado,
-                    "Cliente": cliente,
-                    "Método de pago": venta.get("Método de pago", "Contado")
-                })
-                transacciones_creadas += 1
-
-        # Anticipo
-        if anticipo > 0:
-            clave = (fecha, cliente, round(anticipo, 2))
-            if clave not in transacciones_claves:
-                guardar_transaccion({
-                    "Fecha": fecha,
-                    "Descripción": f"Anticipo aplicado a venta de {cliente}",
-                    "Categoría": "Anticipo Aplicado",
-                    "Tipo": "Egreso",
-                    "Monto": anticipo,
-                    "Cliente": cliente,
-                    "Método de pago": "Anticipo"
-                })
-                transacciones_creadas += 1
-
-        # Crédito
-        if monto_credito > 0:
-            clave = (fecha, cliente, round(monto_credito, 2))
-            if clave not in transacciones_claves:
-                guardar_transaccion({
-                    "Fecha": fecha,
-                    "Descripción": f"Venta a crédito para {cliente}",
-                    "Categoría": "Ventas a Crédito",
-                    "Tipo": "Ingreso",
-                    "Monto": monto_credito,
-                    "Cliente": cliente,
-                    "Método de pago": "Crédito"
-                })
-                transacciones_creadas += 1
+    # Conciliación precalculada por el planificador si sigue vigente; si no, se calcula aquí
+    faltantes = leer_resultado(st.session_state.get("uid"), "transacciones_faltantes")
+    if faltantes is None:
+        faltantes = detectar_transacciones_faltantes(ventas_df, transacciones_df)
+
+    for transaccion in faltantes.to_dict(orient="records"):
+        guardar_transaccion({k: v for k, v in transaccion.items() if k != "Folio" or v})
+    transacciones_creadas = len(faltantes)
 
     if transacciones_creadas > 0:
         st.success(f"🔄 {transacciones_creadas} transacciones faltantes fueron agregadas automáticamente.")
@@ -129,57 +138,89 @@ def render():
     fecha = st.date_input("Fecha", key="venta_fecha")
     cliente = st.selectbox("Cliente", st.session_state.clientes["Nombre"].tolist(), key="venta_cliente")
 
-    # Formulario para agregar productos a la lista
-    with st.form("form_agregar_producto", clear_on_submit=True):
-        st.markdown("### Agregar producto a la venta")
-
-        df_productos = st.session_state.productos.copy()
-        df_productos["Etiqueta"] = df_productos.apply(
-            lambda row: f"{row['Nombre']} | {row['Clave']} | {row['Marca_Tipo']}", axis=1
+    # Captura rápida con lector de código de barras o teclado
+    st.text_input(
+        "⚡ Captura rápida (Clave o 3*Clave)",
+        key="venta_captura_rapida",
+        on_change=agregar_por_clave,
+        placeholder="Escanea o escribe la clave y presiona Enter"
+    )
+    if "venta_captura_msg" in st.session_state:
+        tipo_msg, texto_msg = st.session_state.pop("venta_captura_msg")
+        (st.success if tipo_msg == "success" else st.error)(texto_msg)
+
+    # Modelo / familia: las variantes se leen solo para el modelo elegido
+    opciones_familia = ([SIN_FAMILIA] if not catalogo_df.empty else []) + familias_df["ID"].tolist()
+    etiquetas_familia = dict(zip(
+        familias_df["ID"],
+        (familias_df["Nombre"].astype(str) + " | " + familias_df["Marca_Tipo"].astype(str) + " "
+         + familias_df["Modelo"].astype(str))
+    ))
+    familia_sel = st.selectbox("Modelo / familia", opciones_familia,
+                               format_func=lambda f: etiquetas_familia.get(f, f), key="venta_familia_sel")
+
+    if familia_sel == SIN_FAMILIA:
+        df_productos = catalogo_df
+        df_productos["Etiqueta"] = (
+            df_productos["Nombre"].astype(str) + " | " + df_productos["Clave"].astype(str) + " | "
+            + df_productos["Marca_Tipo"].astype(str)
         )
-
-        producto_idx = st.selectbox(
-            "Producto/Servicio",
-            df_productos.index,
-            format_func=lambda i: df_productos.loc[i, "Etiqueta"],
-            key="venta_producto_sel"
+    else:
+        df_productos = leer_variantes(familia_sel)
+        df_productos["Etiqueta"] = (
+            df_productos["Color"].astype(str) + " / " + df_productos["Talla"].astype(str) + " | "
+            + df_productos["Clave"].astype(str)
         )
 
-        producto_info_selected = df_productos.loc[[producto_idx]]
+    # Formulario para agregar productos a la lista
+    if df_productos.empty:
+        st.info("Este modelo no tiene variantes registradas.")
+    else:
+        with st.form("form_agregar_producto", clear_on_submit=True):
+            st.markdown("### Agregar producto a la venta")
+
+            producto_idx = st.selectbox(
+                "Producto/Servicio",
+                df_productos.index,
+                format_func=lambda i: df_productos.loc[i, "Etiqueta"],
+                key="venta_producto_sel"
+            )
 
-        col_existencia = "existencia" if "existencia" in producto_info_selected.columns else "Cantidad"
-        existencia_actual = int(producto_info_selected[col_existencia].values[0])
+            producto_info_selected = df_productos.loc[[producto_idx]]
 
-        st.info(f"📦 Existencia actual: *{existencia_actual}* unidades.")
+            col_existencia = "existencia" if "existencia" in producto_info_selected.columns else "Cantidad"
+            existencia_actual = int(producto_info_selected[col_existencia].values[0])
 
-        cantidad = st.number_input("Cantidad", min_value=1, key="cantidad_producto_add")
+            st.info(f"📦 Existencia actual: *{existencia_actual}* unidades.")
 
-        # Validar que la cantidad no exceda la existencia
-        if cantidad > existencia_actual and existencia_actual >= 0:
-            st.warning(f"⚠️ La cantidad solicitada ({cantidad}) excede la existencia actual ({existencia_actual}).")
+            cantidad = st.number_input("Cantidad", min_value=1, key="cantidad_producto_add")
 
-        precio_from_df = float(producto_info_selected["Precio Unitario"].values[0])
-        st.markdown(f"**Precio unitario:** ${precio_from_df:.2f}")
+            # Validar que la cantidad no exceda la existencia
+            if cantidad > existencia_actual and existencia_actual >= 0:
+                st.warning(f"⚠️ La cantidad solicitada ({cantidad}) excede la existencia actual ({existencia_actual}).")
 
-        submitted_add_product = st.form_submit_button("➕ Agregar producto")
+            precio_from_df = float(producto_info_selected["Precio Unitario"].values[0])
+            st.markdown(f"**Precio unitario:** ${precio_from_df:.2f}")
 
-        if submitted_add_product:
-            # Validaciones antes de agregar a la lista
-            if cantidad <= 0:
-                st.error("❌ La cantidad debe ser mayor que cero.")
-            elif cantidad > existencia_actual and existencia_actual >= 0:
-                st.error("❌ No hay suficiente existencia para agregar este producto.")
-            else:
-                # Agregar el producto a la lista temporal
-                producto_dict = {
-                    "Clave del Producto": str(producto_info_selected["Clave"].values[0]),
-                    "Producto": producto_info_selected["Nombre"].values[0],
-                    "Cantidad": cantidad,
-                    "Precio Unitario": precio_from_df,
-                    "Subtotal": cantidad * precio_from_df
-                }
-                st.session_state.productos_venta.append(producto_dict)
-                st.success(f"✅ Se agregó {cantidad} unidad(es) de '{producto_dict['Producto']}' a la venta.")
+            submitted_add_product = st.form_submit_button("➕ Agregar producto")
+
+            if submitted_add_product:
+                # Validaciones antes de agregar a la lista
+                if cantidad <= 0:
+                    st.error("❌ La cantidad debe ser mayor que cero.")
+                elif cantidad > existencia_actual and existencia_actual >= 0:
+                    st.error("❌ No hay suficiente existencia para agregar este producto.")
+                else:
+                    # Agregar el producto a la lista temporal
+                    producto_dict = {
+                        "Clave del Producto": str(producto_info_selected["Clave"].values[0]),
+                        "Producto": producto_info_selected["Nombre"].values[0],
+                        "Cantidad": cantidad,
+                        "Precio Unitario": precio_from_df,
+                        "Subtotal": cantidad * precio_from_df
+                    }
+                    st.session_state.productos_venta.append(producto_dict)
+                    st.success(f"✅ Se agregó {cantidad} unidad(es) de '{producto_dict['Producto']}' a la venta.")
 
     st.divider()
 
@@ -273,7 +314,7 @@ def render():
             total_credito_otorgado = 0.0
             if "Tipo de venta" in ventas_cliente.columns and "Monto Crédito" in ventas_cliente.columns:
                 credito_otorgado_series = ventas_cliente[
-                    ventas_cliente["Tipo de venta"].isin(["Crédito", "Mixta"])
+                    ventas_cliente["Tipo de venta"].isin(TIPOS_VENTA_CREDITO)
                 ]["Monto Crédito"]
                 total_credito_otorgado = float(
                     credito_otorgado_series.sum()) if not credito_otorgado_series.empty else 0.0
@@ -350,7 +391,7 @@ def render():
                 current_total_credito_otorgado = 0.0
                 if "Tipo de venta" in current_ventas_cliente.columns and "Monto Crédito" in current_ventas_cliente.columns:
                     series_credito = current_ventas_cliente[
-                        current_ventas_cliente["Tipo de venta"].isin(["Crédito", "Mixta"])
+                        current_ventas_cliente["Tipo de venta"].isin(TIPOS_VENTA_CREDITO)
                     ]["Monto Crédito"]
                     current_total_credito_otorgado = float(series_credito.sum()) if not series_credito.empty else 0.0
 
@@ -390,29 +431,44 @@ def render():
                     total_anticipo_final_aplicado = anticipo_final_aplicado
                     importe_neto_total = submitted_importe_neto
 
+                    # Existencia y costo de todo el carrito en una sola lectura (de Firestore,
+                    # o del cache más lo pendiente con la escritura diferida), validados antes
+                    # de guardar el primer renglón
+                    existencias = leer_existencias(
+                        [p["Clave del Producto"] for p in st.session_state.productos_venta]
+                    )
+                    pedidas = {}
+                    for producto_venta in st.session_state.productos_venta:
+                        clave_producto = str(producto_venta["Clave del Producto"])
+                        pedidas[clave_producto] = pedidas.get(clave_producto, 0) + producto_venta["Cantidad"]
+                    for clave_producto, cantidad_pedida in pedidas.items():
+                        info = existencias.get(clave_producto)
+                        if info is None:
+                            st.error(f"❌ El producto con clave '{clave_producto}' no existe. Venta no registrada.")
+                            return
+                        existencia = int(info["Cantidad"])
+                        if cantidad_pedida > existencia and existencia >= 0:
+                            nombre = next(p["Producto"] for p in st.session_state.productos_venta
+                                          if str(p["Clave del Producto"]) == clave_producto)
+                            st.error(f"❌ No hay suficiente existencia de {nombre}. "
+                                     f"Solo quedan {existencia} unidades. Venta no registrada.")
+                            return
+                    restantes = {c: int(info["Cantidad"]) for c, info in existencias.items()}
+
+                    # Un folio por venta, compartido por sus renglones y transacciones; se
+                    # toma ya validada la existencia para no gastar folios en ventas rechazadas
+                    folio = siguiente_folio()
+
                     # Iterar sobre la lista de productos
                     for i, producto_venta in enumerate(st.session_state.productos_venta):
                         clave_producto = producto_venta["Clave del Producto"]
                         cantidad_vendida = producto_venta["Cantidad"]
 
-                        # Obtener información fresca del producto para evitar errores
-                        df_prod_temp = leer_productos()
-                        df_prod_temp["Clave"] = df_prod_temp["Clave"].astype(str)
-                        current_producto_info = df_prod_temp[df_prod_temp["Clave"] == clave_producto]
+                        col_existencia = "Cantidad"
+                        current_existencia = restantes[str(clave_producto)]
 
-                        if current_producto_info.empty:
-                            st.error(f"❌ El producto con clave '{clave_producto}' no existe. Venta no registrada.")
-                            return
-
-                        col_existencia = "existencia" if "existencia" in current_producto_info.columns else "Cantidad"
-                        current_existencia = int(
-                            pd.to_numeric(current_producto_info[col_existencia], errors="coerce").fillna(0).iloc[0]
-                        )
-
-                        if cantidad_vendida > current_existencia and current_existencia >= 0:
-                            st.error(f"❌ No hay suficiente existencia de {producto_venta['Producto']}. "
-                                     f"Solo quedan {current_existencia} unidades. Venta no registrada.")
-                            return
+                        # Costo al momento de la venta, para el margen real
+                        costo_unitario = existencias[str(clave_producto)]["Costo Unitario"]
 
                         # APLICAR LOS VALORES TOTALES SOLO EN LA PRIMERA FILA
                         if i == 0:
@@ -434,7 +490,9 @@ def render():
                                         "Anticipo" if total_anticipo_final_aplicado > 0 else "N/A"
                                     )
                                 ),
-                                "Tipo de venta": tipo_venta
+                                "Tipo de venta": tipo_venta,
+                                "Folio": folio,
+                                "Costo Unitario": costo_unitario
                             }
                         else:
                             # Para las filas siguientes, solo guarda la información del producto
@@ -452,14 +510,23 @@ def render():
                                 "Monto Contado": 0.0,
                                 "Anticipo Aplicado": 0.0,
                                 "Método de pago": "N/A",
-                                "Tipo de venta": "Multi-producto"  # Nuevo tipo para identificar
+                                "Tipo de venta": "Multi-producto",  # Nuevo tipo para identificar
+                                "Folio": folio,
+                                "Costo Unitario": costo_unitario
                             }
 
                         guardar_venta(venta_dict)
 
                         # Descontar inventario
                         nueva_cantidad_inventario = current_existencia - cantidad_vendida
+                        restantes[str(clave_producto)] = nueva_cantidad_inventario
                         actualizar_producto_por_clave(clave_producto, {col_existencia: nueva_cantidad_inventario})
+                        registrar_movimiento(
+                            clave_producto, "Venta", -cantidad_vendida,
+                            costo_unitario,
+                            existencia=nueva_cantidad_inventario,
+                            referencia=f"Venta {folio} a {submitted_cliente}"
+                        )
 
                     # --- Transacciones (sin cambios) ---
                     if total_monto_contado_final > 0:
@@ -470,7 +537,8 @@ def render():
                             "Tipo": "Ingreso",
                             "Monto": total_monto_contado_final,
                             "Cliente": submitted_cliente,
-                            "Método de pago": submitted_metodo_pago
+                            "Método de pago": submitted_metodo_pago,
+                            "Folio": folio
                         })
 
                     if total_anticipo_final_aplicado > 0:
@@ -481,7 +549,8 @@ def render():
                             "Tipo": "Egreso",
                             "Monto": float(total_anticipo_final_aplicado),
                             "Cliente": submitted_cliente,
-                            "Método de pago": "Anticipo"
+                            "Método de pago": "Anticipo",
+                            "Folio": folio
                         })
 
                     if total_monto_credito_f > epsilon and total_monto_contado_final <= epsilon and total_anticipo_final_aplicado <= epsilon:
@@ -492,7 +561,8 @@ def render():
                             "Tipo": "Ingreso",
                             "Monto": total_monto_credito_f,
                             "Cliente": submitted_cliente,
-                            "Método de pago": "Crédito"
+                            "Método de pago": "Crédito",
+                            "Folio": folio
                         })
 
                     # --- Refrescar estado y limpiar lista de productos ---
@@ -502,11 +572,55 @@ def render():
                     st.session_state["input_anticipo_visible"] = 0.0
                     st.session_state.productos_venta = []  # Limpiar la lista para la próxima venta
 
-                    st.success("✅ Venta registrada correctamente")
+                    st.success(f"✅ Venta {folio} registrada correctamente")
                     st.rerun()
 
                     # ... (resto del código sin cambios)
 
+    st.divider()
+    st.subheader("↩️ Devoluciones y cancelaciones")
+    if "devolucion_msg" in st.session_state:
+        st.success(st.session_state.pop("devolucion_msg"))
+    folio_devolucion = st.text_input("Folio de la venta", key="devolucion_folio", placeholder="V000123").strip().upper()
+    if folio_devolucion:
+        resumen_dev, ventas_folio, _ = resumen_folio(folio_devolucion)
+        if resumen_dev.empty:
+            st.warning(f"⚠️ No se encontró la venta {folio_devolucion}.")
+        else:
+            primera_venta = ventas_folio[ventas_folio["Tipo de venta"] != "Devolución"].iloc[0]
+            st.caption(f"Venta {folio_devolucion} · {primera_venta['Cliente']} · {primera_venta['Fecha']} · "
+                       f"{primera_venta['Tipo de venta']}")
+            editado = st.data_editor(
+                resumen_dev.assign(Devolver=0.0), hide_index=True, use_container_width=True,
+                disabled=list(resumen_dev.columns), key=f"devolucion_editor_{folio_devolucion}",
+                column_config={"Devolver": st.column_config.NumberColumn("Devolver", min_value=0.0, step=1.0)},
+            )
+            motivo = st.text_input("Motivo", key="devolucion_motivo")
+            col_dev1, col_dev2 = st.columns(2)
+            cantidades = None
+            with col_dev1:
+                devolver = st.button("Devolver cantidades marcadas", key="devolucion_parcial")
+                if devolver:
+                    cantidades = dict(zip(editado["Clave del Producto"], editado["Devolver"]))
+            with col_dev2:
+                cancelar = st.button("Cancelar venta completa", key="devolucion_total")
+            if devolver or cancelar:
+                try:
+                    resultado = devolver_venta(folio_devolucion, cantidades, motivo=motivo)
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                except Exception as e:
+                    st.error(f"❌ No se pudo confirmar la devolución de la venta {folio_devolucion}: {e}. "
+                             "Revisa el histórico de la venta antes de intentarla de nuevo, pudo haberse registrado.")
+                else:
+                    aviso = (f"✅ {'Cancelación' if resultado['completa'] else 'Devolución'} {resultado['registro']} "
+                             f"registrada: ${resultado['importe']:,.2f} (crédito ${resultado['credito']:,.2f}, "
+                             f"anticipo ${resultado['anticipo']:,.2f}, contado ${resultado['contado']:,.2f}).")
+                    if resultado["sin_inventario"]:
+                        aviso += f" Sin regreso a inventario (producto eliminado): {', '.join(resultado['sin_inventario'])}."
+                    st.session_state.devolucion_msg = aviso
+                    st.rerun()
+
     st.divider()
     st.subheader("📋 Histórico de ventas")
 
@@ -542,8 +656,10 @@ def render():
 
     if not st.session_state.ventas.empty:
         st.subheader("📊 Ingresos diarios")
-        df_daily = st.session_state.ventas.copy()
-        df_daily["Total"] = pd.to_numeric(df_daily["Total"], errors='coerce').fillna(0.0)
-        df_daily = df_daily.groupby("Fecha")["Total"].sum().reset_index()
-        fig = px.bar(df_daily, x="Fecha", y="Total", title="Ventas por día", template="plotly_white")
+        def construir_ingresos():
+            df_periodo, periodo = agrupar_por_periodo(st.session_state.ventas, "Fecha", "Total")
+            return px.bar(df_periodo, x="Fecha", y="Total", title=f"Ventas por {periodo}", template="plotly_white")
+
+        fig = figura(st.session_state.get("uid"), "ventas_ingresos", st.session_state.ventas[["Fecha", "Total"]],
+                     construir_ingresos)
         st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
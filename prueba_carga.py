@@ -0,0 +1,248 @@
+# prueba_carga.py
+"""
+Prueba de carga de las páginas de main.py con sesiones simultáneas.
+
+Cada sesión simulada es un AppTest de Streamlit (sin navegador) contra el
+Firestore en memoria de utils/firestore_local.py, con los datos de un solo
+negocio. Los roles repiten flujos reales:
+
+    cajero     -> login, venta de 5 productos
+    cobranza   -> login, abono de un cliente
+    dueño      -> login, abre el Dashboard
+
+Uso:
+    python prueba_carga.py --sesiones 8 --iteraciones 5 --latencia-ms 20
+"""
+import os
+
+# Debe definirse antes de importar utils.db
+os.environ.setdefault("MINEGOCIO_FIRESTORE_LOCAL", "1")
+os.environ.setdefault("MINEGOCIO_TAREAS_DB", os.path.join(".minegocio", "tareas_carga.sqlite3"))
+
+import sys
+import time
+import random
+import logging
+import argparse
+import datetime
+import resource
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+from utils import db
+
+UID_PRUEBA = "negocio_carga"
+TIEMPO_MAXIMO_RERUN = 120  # segundos
+
+# Mismo despacho que main.py, sin option_menu ni Firebase Auth
+SCRIPT_APP = """
+import streamlit as st
+from modules.dashboard import render as render_dashboard
+from modules.ventas import render as render_ventas
+from modules.cobranza import render as render_cobranza
+
+paginas = {
+    "📊 Dashboard": render_dashboard,
+    "💸 Ventas": render_ventas,
+    "💳 Cobranza": render_cobranza,
+}
+paginas[st.session_state.get("pagina", "📊 Dashboard")]()
+"""
+
+ROLES = ["cajero", "cajero", "cobranza", "dueño"]
+
+
+# ---------------------------
+# Datos de prueba
+# ---------------------------
+def sembrar_datos(n_clientes, n_productos, n_ventas, semilla=7):
+    """Llena el Firestore en memoria con un negocio de tamaño realista."""
+    rng = np.random.default_rng(semilla)
+    db.inicializar_firebase()
+    ref = db.db.collection("usuarios").document(UID_PRUEBA)
+    batch = db.db.batch()
+
+    clientes = [f"Cliente {i:04d}" for i in range(n_clientes)]
+    for i, nombre in enumerate(clientes):
+        batch.set(ref.collection("clientes").document(f"C{i:04d}"), {
+            "ID": f"C{i:04d}", "Nombre": nombre, "Correo": f"cliente{i}@ejemplo.com",
+            "Teléfono": "", "Empresa": "", "RFC": "", "Límite de crédito": 50000.0,
+        })
+
+    precios = rng.uniform(20, 2000, n_productos).round(2)
+    for i in range(n_productos):
+        batch.set(ref.collection("productos").document(f"P{i:05d}"), {
+            "Clave": f"SKU{i:05d}", "Nombre": f"Producto {i}", "Marca_Tipo": f"Marca {i % 25}",
+            "Modelo": "", "Color": "", "Talla": "", "Categoría": f"Categoría {i % 10}",
+            "Precio Unitario": float(precios[i]), "Costo Unitario": float(round(precios[i] * 0.6, 2)),
+            "Cantidad": 1_000_000, "Descripción": "",
+        })
+
+    hoy = datetime.date.today()
+    for i in range(n_ventas):
+        p = int(rng.integers(n_productos))
+        cantidad = int(rng.integers(1, 5))
+        total = round(cantidad * float(precios[p]), 2)
+        credito = total if i % 3 == 0 else 0.0
+        fecha = (hoy - datetime.timedelta(days=int(rng.integers(0, 365)))).isoformat()
+        cliente = clientes[int(rng.integers(n_clientes))]
+        batch.set(ref.collection("ventas").document(f"V{i:06d}"), {
+            "Fecha": fecha, "Cliente": cliente, "Producto": f"Producto {p}",
+            "Clave del Producto": f"SKU{p:05d}", "Cantidad": cantidad, "Precio Unitario": float(precios[p]),
+            "Total": total, "Descuento": 0.0, "Importe Neto": total, "Monto Crédito": credito,
+            "Monto Contado": total - credito, "Anticipo Aplicado": 0.0, "Método de pago": "Efectivo",
+            "Tipo de venta": "Crédito" if credito else "Contado",
+        })
+        for tipo_monto, monto, categoria in (("contado", total - credito, "Ventas"),
+                                             ("credito", credito, "Ventas a Crédito")):
+            if monto > 0:
+                batch.set(ref.collection("transacciones").document(f"T{i:06d}{tipo_monto}"), {
+                    "Fecha": fecha, "Descripción": f"Venta a {cliente}", "Categoría": categoria,
+                    "Tipo": "Ingreso", "Monto": monto, "Cliente": cliente, "Método de pago": "Efectivo",
+                })
+    batch.commit()
+    db.invalidar_cache(UID_PRUEBA)
+
+
+# ---------------------------
+# Sesiones simuladas
+# ---------------------------
+class Sesion:
+    def __init__(self, numero, rol):
+        self.numero = numero
+        self.rol = rol
+        self.app = AppTest.from_string(SCRIPT_APP, default_timeout=TIEMPO_MAXIMO_RERUN)
+        self.tiempos = []  # (paso, segundos)
+        self.errores = []
+
+    def _rerun(self, paso, accion=None):
+        inicio = time.perf_counter()
+        (accion or self.app).run()
+        self.tiempos.append((paso, time.perf_counter() - inicio))
+        if self.app.exception:
+            self.errores.append(f"{paso}: {self.app.exception[0].message}")
+
+    def _boton(self, etiqueta):
+        return next(b for b in self.app.button if b.label == etiqueta)
+
+    def login(self):
+        # Equivale a iniciar_sesion() de modules/auth.py tras autenticar
+        inicio = time.perf_counter()
+        self.app.session_state["uid"] = UID_PRUEBA
+        self.app.session_state["usuario"] = f"sesion{self.numero}@ejemplo.com"
+        db.precargar_usuario_async(UID_PRUEBA)
+        self.tiempos.append(("login", time.perf_counter() - inicio))
+
+    def abrir(self, pagina):
+        self.app.session_state["pagina"] = pagina
+        self._rerun(f"abrir {pagina}")
+
+    def venta_5_productos(self):
+        self.abrir("💸 Ventas")
+        opciones = self.app.selectbox(key="venta_producto_sel").options
+        for _ in range(5):
+            self.app.selectbox(key="venta_producto_sel").set_value(random.randrange(len(opciones)))
+            self.app.number_input(key="cantidad_producto_add").set_value(random.randint(1, 3))
+            self._rerun("agregar producto", self._boton("➕ Agregar producto").click())
+        total = float(pd.DataFrame(self.app.session_state["productos_venta"])["Subtotal"].sum())
+        self.app.number_input(key="venta_monto_contado_final").set_value(round(total, 2))
+        self._rerun("registrar venta", self._boton("Finalizar y Registrar Venta").click())
+
+    def abono_cobranza(self):
+        self.abrir("💳 Cobranza")
+        self.app.number_input(key="cobranza_monto_input").set_value(round(random.uniform(10, 50), 2))
+        self._rerun("procesar pago", self._boton("Procesar Pago").click())
+
+    def dashboard(self):
+        self.abrir("📊 Dashboard")
+        self._rerun("rerun Dashboard")
+
+    def ejecutar(self, iteraciones):
+        self.login()
+        flujo = {"cajero": self.venta_5_productos, "cobranza": self.abono_cobranza, "dueño": self.dashboard}[self.rol]
+        for _ in range(iteraciones):
+            try:
+                flujo()
+            except Exception as e:
+                self.errores.append(f"{self.rol}: {e}")
+        return self
+
+    def memoria_estado(self):
+        """Bytes de los DataFrames que la sesión guarda en session_state."""
+        return sum(int(v.memory_usage(deep=True).sum()) for v in self.app.session_state.values()
+                   if isinstance(v, pd.DataFrame))
+
+
+def _rss_mb():
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ---------------------------
+# Reporte
+# ---------------------------
+def reporte(sesiones, segundos_totales, rss_inicial):
+    tiempos = pd.DataFrame(
+        [(s.rol, paso, t) for s in sesiones for paso, t in s.tiempos],
+        columns=["Rol", "Paso", "Segundos"]
+    )
+    reruns = tiempos[tiempos["Paso"] != "login"]
+
+    percentiles = reruns.groupby("Paso")["Segundos"].describe(percentiles=[.5, .95, .99])
+    percentiles = percentiles[["count", "50%", "95%", "99%", "max"]].rename(columns={"count": "Reruns"})
+    percentiles.loc["TOTAL"] = [len(reruns), *reruns["Segundos"].quantile([.5, .95, .99]), reruns["Segundos"].max()]
+
+    memoria = pd.DataFrame({
+        "Sesión": [s.numero for s in sesiones],
+        "Rol": [s.rol for s in sesiones],
+        "MB en session_state": [round(s.memoria_estado() / 2 ** 20, 2) for s in sesiones],
+        "Errores": [len(s.errores) for s in sesiones],
+    })
+
+    with pd.option_context("display.float_format", "{:.3f}".format, "display.width", 120):
+        print("\n=== Latencia por rerun (segundos) ===")
+        print(percentiles)
+        print("\n=== Memoria por sesión ===")
+        print(memoria.to_string(index=False))
+    rss_final = _rss_mb()
+    print(f"\nSesiones: {len(sesiones)} | Reruns: {len(reruns)} | Tiempo total: {segundos_totales:.1f} s")
+    print(f"Throughput: {len(reruns) / segundos_totales:.2f} reruns/s")
+    print(f"RSS del proceso: {rss_final:.0f} MB (≈ {(rss_final - rss_inicial) / len(sesiones):.1f} MB por sesión)")
+
+    errores = [e for s in sesiones for e in s.errores]
+    if errores:
+        print(f"\n⚠️ {len(errores)} errores, primeros:")
+        for e in errores[:10]:
+            print(f"  - {e}")
+    return percentiles, memoria
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones simultáneas de Streamlit.")
+    parser.add_argument("--sesiones", type=int, default=8)
+    parser.add_argument("--iteraciones", type=int, default=3)
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--productos", type=int, default=2000)
+    parser.add_argument("--ventas", type=int, default=10000)
+    parser.add_argument("--latencia-ms", type=float, default=0,
+                        help="Latencia simulada por llamada a Firestore")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.environ["MINEGOCIO_FIRESTORE_LOCAL_LATENCIA_MS"] = "0"
+    print(f"Sembrando {args.clientes} clientes, {args.productos} productos y {args.ventas} ventas...")
+    sembrar_datos(args.clientes, args.productos, args.ventas)
+    os.environ["MINEGOCIO_FIRESTORE_LOCAL_LATENCIA_MS"] = str(args.latencia_ms)
+
+    rss_inicial = _rss_mb()
+    sesiones = [Sesion(i, ROLES[i % len(ROLES)]) for i in range(args.sesiones)]
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sesiones, thread_name_prefix="sesion") as pool:
+        list(pool.map(lambda s: s.ejecutar(args.iteraciones), sesiones))
+    reporte(sesiones, time.perf_counter() - inicio, rss_inicial)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# utils/analitica.py
+"""
+Analítica del operador sobre todos los negocios (usuarios/{uid}/...).
+
+Usa consultas collection_group sobre ventas y transacciones, divididas en
+particiones que se leen en paralelo y por páginas. Los totales por negocio se
+calculan con groupby y el resultado se guarda en memoria durante TTL_RESULTADO.
+
+    python -m utils.analitica
+    python -m utils.analitica --csv negocios.csv
+"""
+import sys
+import time
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from utils import db
+
+COLECCIONES = {"ventas": "Total", "transacciones": "Monto"}  # colección -> campo de importe
+PARTICIONES = 8
+TAM_PAGINA = 1000
+TTL_RESULTADO = 3600  # segundos
+DIAS_RECIENTES = 30
+
+_lock = threading.Lock()
+_resultado = {}  # {"creado": ts, "negocios": df, "mensual": df}
+
+
+# ---------------------------
+# Lectura paralela
+# ---------------------------
+def _tamano_valor(valor):
+    """Bytes que ocupa un valor según las reglas de tamaño de Firestore."""
+    if valor is None or isinstance(valor, bool):
+        return 1
+    if isinstance(valor, (int, float, datetime.datetime, datetime.date)):
+        return 8
+    if isinstance(valor, str):
+        return len(valor.encode("utf-8")) + 1
+    if isinstance(valor, dict):
+        return sum(len(k.encode("utf-8")) + 1 + _tamano_valor(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return sum(_tamano_valor(v) for v in valor)
+    return len(str(valor).encode("utf-8")) + 1
+
+
+def _particiones(coleccion):
+    grupo = db.db.collection_group(coleccion)
+    if hasattr(grupo, "get_partitions"):
+        return [p.query() for p in grupo.get_partitions(PARTICIONES)]
+    return [grupo]  # clientes sin particiones (p. ej. el Firestore en memoria)
+
+
+def _leer_particion(coleccion, consulta):
+    """Filas (uid, colección, fecha, importe, bytes) de una partición, por páginas."""
+    campo_importe = COLECCIONES[coleccion]
+    filas = []
+    ultimo = None
+    while True:
+        pagina = consulta.limit(TAM_PAGINA)
+        if ultimo is not None:
+            pagina = pagina.start_after(ultimo)
+        docs = list(pagina.stream())
+        for d in docs:
+            partes = d.reference.path.split("/")
+            if len(partes) != 4 or partes[0] != "usuarios":
+                continue  # colecciones fuera de usuarios/{uid}
+            datos = d.to_dict() or {}
+            filas.append((
+                partes[1], coleccion, datos.get("Fecha"), datos.get(campo_importe),
+                len(d.reference.path) + 1 + _tamano_valor(datos) + 32,
+            ))
+        if len(docs) < TAM_PAGINA:
+            return filas
+        ultimo = docs[-1]
+
+
+def _leer_documentos():
+    db.inicializar_firebase()
+    with ThreadPoolExecutor(max_workers=PARTICIONES) as pool:
+        futuros = [pool.submit(_leer_particion, col, consulta)
+                   for col in COLECCIONES for consulta in _particiones(col)]
+        filas = [fila for f in futuros for fila in f.result()]
+    df = pd.DataFrame(filas, columns=["uid", "coleccion", "Fecha", "Importe", "Bytes"])
+    df["Fecha"] = pd.to_datetime(df["Fecha"], errors="coerce")
+    df["Importe"] = pd.to_numeric(df["Importe"], errors="coerce").fillna(0.0)
+    return df
+
+
+# ---------------------------
+# Agregados por negocio
+# ---------------------------
+def _agregar(df, hoy=None):
+    hoy = pd.Timestamp(hoy or datetime.date.today())
+    reciente = df["Fecha"] >= hoy - pd.Timedelta(days=DIAS_RECIENTES)
+    ventas = df["coleccion"] == "ventas"
+
+    documentos = df.pivot_table(index="uid", columns="coleccion", values="Bytes", aggfunc="size", fill_value=0) \
+        .reindex(columns=list(COLECCIONES), fill_value=0).add_prefix("Docs ")
+    negocios = pd.concat([
+        documentos,
+        df.groupby("uid").agg(**{
+            "Docs totales": ("Bytes", "size"),
+            "MB": ("Bytes", lambda b: b.sum() / 2 ** 20),
+            "Último movimiento": ("Fecha", "max"),
+        }),
+        df[reciente].groupby("uid")["Bytes"].agg(**{
+            f"Docs últimos {DIAS_RECIENTES} días": "size",
+            f"MB últimos {DIAS_RECIENTES} días": lambda b: b.sum() / 2 ** 20,
+        }),
+        df[ventas].groupby("uid")["Importe"].sum().rename("Ventas totales"),
+        df[ventas & reciente].groupby("uid")["Importe"].sum().rename(f"Ventas últimos {DIAS_RECIENTES} días"),
+    ], axis=1)
+    numericas = negocios.columns.drop("Último movimiento")
+    negocios[numericas] = negocios[numericas].fillna(0).round(3)
+    negocios = negocios.sort_values("Docs totales", ascending=False).reset_index()
+
+    mensual = df.dropna(subset=["Fecha"]).assign(Mes=lambda x: x["Fecha"].dt.to_period("M").dt.to_timestamp()) \
+        .groupby(["uid", "Mes"]).agg(Docs=("Bytes", "size"), MB=("Bytes", lambda b: b.sum() / 2 ** 20)) \
+        .reset_index()
+    return negocios, mensual
+
+
+def resumen_negocios(forzar=False):
+    """
+    (negocios, mensual): totales por negocio y documentos/MB por mes. Se
+    recalcula como máximo cada TTL_RESULTADO segundos salvo con `forzar`.
+    """
+    with _lock:
+        if not forzar and _resultado and time.time() - _resultado["creado"] < TTL_RESULTADO:
+            return _resultado["negocios"].copy(), _resultado["mensual"].copy()
+
+    inicio = time.time()
+    negocios, mensual = _agregar(_leer_documentos())
+    with _lock:
+        _resultado.update(creado=time.time(), negocios=negocios, mensual=mensual)
+    logging.info(f"Analítica de {len(negocios)} negocios en {time.time() - inicio:.1f} s.")
+    return negocios.copy(), mensual.copy()
+
+
+def resumen_creado():
+    """Momento en que se calculó el resumen en memoria, o None."""
+    with _lock:
+        return datetime.datetime.fromtimestamp(_resultado["creado"]) if _resultado else None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) not in (1, 3) or (len(sys.argv) == 3 and sys.argv[1] != "--csv"):
+        print("Uso: python -m utils.analitica [--csv archivo.csv]")
+        sys.exit(1)
+    tabla, _ = resumen_negocios(forzar=True)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(tabla.to_string(index=False))
+    if len(sys.argv) == 3:
+        tabla.to_csv(sys.argv[2], index=False)
+        print(f"Guardado en {sys.argv[2]}")
@@ -0,0 +1,293 @@
+# utils/auditoria.py
+"""
+Auditoría de integridad de un negocio: revisa ventas, transacciones y productos
+con operaciones vectorizadas y propone un plan de correcciones.
+
+Hallazgos:
+  - "Transacción duplicada" / "Transacción huérfana": transacciones de venta
+    (Ventas, Anticipo Aplicado, Ventas a Crédito, con Cliente) que sobran frente
+    a las que las ventas debieron generar (reportes.transacciones_esperadas), con
+    las mismas llaves que la sincronización de Ventas. Se eliminan las sobrantes.
+    Las capturas manuales de Contabilidad (sin Cliente) no se tocan.
+  - "Transacción sin cliente": Cobranza o anticipos sin Cliente; no cuentan en
+    ningún saldo. Solo se informan.
+  - "Venta descuadrada": Contado + Crédito + Anticipo distinto del Importe Neto
+    de la venta (por Folio; los importes van en el primer renglón). Si las partes
+    cuadran con Total − Descuento se corrige el Importe Neto; si no, se informa.
+  - "Existencia negativa": se ajusta a 0 con un movimiento de "Ajuste" en el kardex.
+  - "Clave duplicada": entre productos se elimina el documento que descartaría
+    utils.deduplicar; entre productos y familias solo se informa.
+
+Sin --aplicar solo muestra el plan:
+
+    python -m utils.auditoria <uid>
+    python -m utils.auditoria <uid> --aplicar
+"""
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from google.cloud.firestore_v1.field_path import FieldPath
+from utils import db
+from utils.deduplicar import analizar_duplicados
+from utils.reportes import transacciones_esperadas, CATEGORIAS_VENTA
+
+TAM_LOTE = 500
+TOLERANCIA = 0.01
+CATEGORIAS_CON_CLIENTE = ["Cobranza", "Anticipo Cliente", "Anticipo Aplicado"]
+
+ELIMINAR = "Eliminar"
+ACTUALIZAR = "Actualizar"
+AJUSTAR = "Ajustar existencia"
+REVISAR = "Revisar"
+
+COLUMNAS_PLAN = ["Hallazgo", "Colección", "ID", "Clave", "Folio", "Cliente", "Detalle",
+                 "Acción", "Campo", "Actual", "Valor"]
+
+
+def _hallazgos(df, **valores):
+    """Filas del plan a partir de `df` (columnas del plan que ya tenga) y valores fijos."""
+    plan = pd.DataFrame(index=df.index)
+    for c in COLUMNAS_PLAN:
+        if c in valores:
+            plan[c] = valores[c]
+        elif c in df.columns:
+            plan[c] = df[c]
+        else:
+            plan[c] = "" if c not in ("Actual", "Valor") else np.nan
+    return plan
+
+
+def _leer(uid):
+    """Ventas y transacciones con su ID de documento, productos (plan de deduplicar) y variantes."""
+    lecturas = {
+        "ventas": lambda: db._leer_tipado("ventas", uid, [*db._ESQUEMAS["ventas"], "ID"], campo_id="ID"),
+        "transacciones": lambda: db._leer_tipado("transacciones", uid, [*db._ESQUEMAS["transacciones"], "ID"],
+                                                 campo_id="ID"),
+        "productos": lambda: analizar_duplicados(uid),
+        "familias": lambda: db._leer_tipado("familias_productos", uid, ["ID", "Variantes"], campo_id="ID"),
+    }
+    db.inicializar_firebase()
+    with ThreadPoolExecutor(max_workers=len(lecturas)) as pool:
+        futuros = {nombre: pool.submit(leer) for nombre, leer in lecturas.items()}
+        return {nombre: f.result() for nombre, f in futuros.items()}
+
+
+# ---------------------------
+# Revisiones
+# ---------------------------
+def _llave_conciliacion(df):
+    """(Folio, Categoría) con Folio; (Fecha, Cliente, Monto) sin él, como detectar_transacciones_faltantes."""
+    folio = df["Folio"].fillna("").astype(str)
+    monto = pd.to_numeric(df["Monto"], errors="coerce").fillna(0.0).round(2).map("{:.2f}".format).astype(str)
+    sin_folio = "S|" + df["Fecha"].astype(str) + "|" + df["Cliente"].astype(str) + "|" + monto
+    return sin_folio.where(folio == "", "F|" + folio + "|" + df["Categoría"].astype(str))
+
+
+def _transacciones_sobrantes(ventas, transacciones):
+    esperadas = _llave_conciliacion(transacciones_esperadas(ventas)).value_counts()
+    trans = transacciones.assign(Folio=transacciones["Folio"].fillna("").astype(str),
+                                 Cliente=transacciones["Cliente"].fillna("").astype(str).str.strip())
+    de_venta = trans[trans["Categoría"].isin(CATEGORIAS_VENTA) & (trans["Monto"] > 0) & (trans["Cliente"] != "")]
+    if de_venta.empty:
+        return _hallazgos(de_venta)
+
+    # Dentro de cada llave se conservan tantas como se esperan (en orden de ID)
+    de_venta = de_venta.assign(Llave=_llave_conciliacion(de_venta)).sort_values(["Llave", "ID"])
+    limite = de_venta["Llave"].map(esperadas).fillna(0).astype(int)
+    sobrantes = de_venta[de_venta.groupby("Llave").cumcount() >= limite]
+    if sobrantes.empty:
+        return _hallazgos(sobrantes)
+    limite = limite[sobrantes.index]
+    detalle = ("Repetida; la venta genera " + limite.astype(str)).where(limite > 0, "Ninguna venta la genera")
+    return _hallazgos(
+        sobrantes, Colección="transacciones", Acción=ELIMINAR, Actual=sobrantes["Monto"],
+        Hallazgo=np.where(limite > 0, "Transacción duplicada", "Transacción huérfana"),
+        Detalle=detalle + ": " + sobrantes["Categoría"] + " por "
+        + sobrantes["Monto"].map("${:,.2f}".format).astype(str) + " del " + sobrantes["Fecha"].astype(str),
+    )
+
+
+def _transacciones_sin_cliente(transacciones):
+    cliente = transacciones["Cliente"].fillna("").astype(str).str.strip()
+    sin_cliente = transacciones[transacciones["Categoría"].isin(CATEGORIAS_CON_CLIENTE) & (cliente == "")]
+    return _hallazgos(
+        sin_cliente, Hallazgo="Transacción sin cliente", Colección="transacciones", Acción=REVISAR,
+        Actual=sin_cliente["Monto"],
+        Detalle=sin_cliente["Categoría"].astype(str) + " por "
+        + sin_cliente["Monto"].map("${:,.2f}".format).astype(str) + " del " + sin_cliente["Fecha"].astype(str)
+        + " no cuenta en ningún saldo",
+    )
+
+
+def _ventas_descuadradas(ventas):
+    if ventas.empty:
+        return _hallazgos(ventas)
+    folio = ventas["Folio"].fillna("").astype(str)
+    devolucion = np.where(ventas["Tipo de venta"].astype(str) == "Devolución", "|D", "")
+    v = ventas.assign(
+        Folio=folio,
+        Grupo=("F|" + folio + devolucion).where(folio != "", "I|" + ventas["ID"].astype(str)),
+        Partes=ventas["Monto Contado"] + ventas["Monto Crédito"] + ventas["Anticipo Aplicado"],
+        Neto_Lineas=ventas["Total"] - ventas["Descuento"],
+    )
+    totales = v.groupby("Grupo")[["Partes", "Importe Neto", "Neto_Lineas"]].sum()
+    diferencia = totales["Partes"] - totales["Importe Neto"]
+    totales = totales[diferencia.abs() > TOLERANCIA]
+    if totales.empty:
+        return _hallazgos(v.iloc[:0])
+
+    # El renglón que lleva los importes de la venta (el primero al registrarla)
+    peso = v["Partes"].abs() + v["Importe Neto"].abs()
+    portador = v.loc[peso.groupby(v["Grupo"]).idxmax().reindex(totales.index)].set_index("Grupo")
+    corregible = (totales["Partes"] - totales["Neto_Lineas"]).abs() <= TOLERANCIA
+    nuevo = portador["Importe Neto"] + totales["Partes"] - totales["Importe Neto"]
+    detalle = ("Contado + Crédito + Anticipo = " + totales["Partes"].map("${:,.2f}".format).astype(str)
+               + ", Importe Neto = " + totales["Importe Neto"].map("${:,.2f}".format).astype(str))
+    return _hallazgos(
+        portador, Hallazgo="Venta descuadrada", Colección="ventas", Clave=portador["Clave del Producto"],
+        Acción=np.where(corregible, ACTUALIZAR, REVISAR), Campo="Importe Neto",
+        Actual=portador["Importe Neto"], Valor=nuevo.where(corregible),
+        Detalle=detalle + pd.Series(" (cuadra con Total − Descuento)", index=corregible.index).where(corregible, ""),
+    ).reset_index(drop=True)
+
+
+def _variantes(familias):
+    filas = [{"ID": f["ID"], "Clave": str(clave), "Cantidad": (datos or {}).get("Cantidad")}
+             for f in familias.to_dict("records") for clave, datos in (f.get("Variantes") or {}).items()]
+    df = pd.DataFrame(filas, columns=["ID", "Clave", "Cantidad"])
+    df["Cantidad"] = pd.to_numeric(df["Cantidad"], errors="coerce")
+    return df
+
+
+def _revision_productos(productos, variantes):
+    duplicados = productos[productos["Acción"] == "Eliminar"]
+    conservados = productos[productos["Acción"] == "Conservar"]
+    con_clave = conservados[conservados["Clave"] != ""]
+    partes = [_hallazgos(
+        duplicados, Hallazgo="Clave duplicada", Colección="productos", Acción=ELIMINAR,
+        Detalle="Se conserva " + duplicados["Clave"].map(con_clave.set_index("Clave")["ID"]).fillna("").astype(str)
+        + " (ver utils.deduplicar)",
+    )]
+
+    # Una Clave en un producto individual y en una familia, o en varias familias
+    ubicaciones = pd.concat([con_clave[["Clave", "ID"]].assign(Colección="productos"),
+                             variantes[["Clave", "ID"]].assign(Colección="familias_productos")],
+                            ignore_index=True)
+    ubicaciones = ubicaciones[(ubicaciones["Clave"] != "") & ubicaciones["Clave"].duplicated(keep=False)]
+    partes.append(_hallazgos(ubicaciones, Hallazgo="Clave duplicada", Acción=REVISAR,
+                             Detalle="La Clave está en más de un producto o familia"))
+
+    negativos = pd.concat([conservados[["Clave", "ID", "Cantidad"]].assign(Colección="productos"),
+                           variantes.assign(Colección="familias_productos")], ignore_index=True)
+    negativos = negativos[negativos["Cantidad"] < 0]
+    partes.append(_hallazgos(
+        negativos, Hallazgo="Existencia negativa", Acción=AJUSTAR, Campo="Cantidad",
+        Actual=negativos["Cantidad"], Valor=0.0,
+        Detalle="Existencia de " + negativos["Cantidad"].map("{:g}".format).astype(str) + "; se ajusta a 0",
+    ))
+    return pd.concat(partes, ignore_index=True)
+
+
+# ---------------------------
+# Análisis y aplicación
+# ---------------------------
+def analizar_integridad(uid):
+    """Plan de correcciones: una fila por hallazgo con Colección, ID, Acción y, si aplica, Campo y Valor."""
+    datos = _leer(uid)
+    ventas, transacciones = datos["ventas"], datos["transacciones"]
+    plan = pd.concat([
+        _transacciones_sobrantes(ventas, transacciones),
+        _transacciones_sin_cliente(transacciones),
+        _ventas_descuadradas(ventas),
+        _revision_productos(datos["productos"], _variantes(datos["familias"])),
+    ], ignore_index=True)
+    plan[["Actual", "Valor"]] = plan[["Actual", "Valor"]].astype(float)
+    for c in ["Clave", "Folio", "Cliente", "Campo"]:
+        plan[c] = plan[c].fillna("").astype(str)
+    return plan.sort_values(["Hallazgo", "Colección", "ID"], kind="mergesort").reset_index(drop=True)[COLUMNAS_PLAN]
+
+
+def aplicar_correcciones(uid, plan=None):
+    """
+    Aplica las acciones del plan distintas de "Revisar" en batches de hasta
+    TAM_LOTE escrituras; el ajuste de existencia y su movimiento van en el mismo
+    batch. Conviene aplicar un plan recién analizado. Devuelve un resumen.
+    """
+    inicio = time.time()
+    plan = analizar_integridad(uid) if plan is None else plan
+    db.inicializar_firebase()
+    usuario = db.db.collection("usuarios").document(uid)
+    acciones = plan[plan["Acción"] != REVISAR]
+    costos = {}
+    if (acciones["Acción"] == AJUSTAR).any():
+        catalogo = db.leer_productos(uid, campos=["Clave", "Costo Unitario"]).drop_duplicates("Clave")
+        costos = dict(zip(catalogo["Clave"].astype(str), catalogo["Costo Unitario"]))
+
+    grupos = []  # escrituras de cada corrección
+    for f in acciones.to_dict("records"):
+        ref = usuario.collection(f["Colección"]).document(f["ID"])
+        if f["Acción"] == ELIMINAR:
+            grupos.append([("eliminar", ref, None)])
+        elif f["Acción"] == ACTUALIZAR:
+            grupos.append([("actualizar", ref, {f["Campo"]: float(f["Valor"])})])
+        elif f["Acción"] == AJUSTAR:
+            campo = "Cantidad" if f["Colección"] == "productos" \
+                else FieldPath("Variantes", f["Clave"], "Cantidad").to_api_repr()
+            grupos.append([
+                ("actualizar", ref, {campo: float(f["Valor"])}),
+                ("crear", usuario.collection("movimientos_inventario").document(), db._movimiento_dict(
+                    f["Clave"], "Ajuste", float(f["Valor"]) - float(f["Actual"]), costos.get(f["Clave"], 0.0),
+                    existencia=f["Valor"], referencia="Auditoría de integridad")),
+            ])
+
+    lotes, lote = [], []
+    for grupo in grupos:
+        if len(lote) + len(grupo) > TAM_LOTE:
+            lotes.append(lote)
+            lote = []
+        lote += grupo
+    if lote:
+        lotes.append(lote)
+    for lote in lotes:
+        batch = db.db.batch()
+        for tipo, ref, datos in lote:
+            if tipo == "eliminar":
+                batch.delete(ref)
+            elif tipo == "actualizar":
+                batch.update(ref, datos)
+            else:
+                batch.set(ref, datos)
+        batch.commit()
+
+    db.invalidar_cache(uid)
+    resumen = {
+        "uid": uid,
+        "correcciones": len(grupos),
+        "por_accion": acciones["Acción"].value_counts().to_dict(),
+        "por_revisar": int((plan["Acción"] == REVISAR).sum()),
+        "segundos": round(time.time() - inicio, 2),
+    }
+    logging.info(f"Auditoría de integridad de '{uid}': {resumen}")
+    return resumen
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] != "--aplicar"):
+        print("Uso: python -m utils.auditoria <uid> [--aplicar]")
+        sys.exit(1)
+    uid_arg = sys.argv[1]
+    plan_uid = analizar_integridad(uid_arg)
+    if plan_uid.empty:
+        print("No se encontraron problemas de integridad.")
+    else:
+        print(plan_uid.groupby(["Hallazgo", "Acción"]).size().rename("Casos").to_string())
+        print()
+        print(plan_uid[["Hallazgo", "Colección", "ID", "Clave", "Folio", "Detalle", "Acción"]].to_string(index=False))
+    if len(sys.argv) == 3:
+        print(aplicar_correcciones(uid_arg, plan_uid))
+    else:
+        print("\nSolo análisis. Agrega --aplicar para aplicar las correcciones.")
@@ -0,0 +1,267 @@
+# utils/cache_compartido.py
+"""
+Almacenes del cache de lecturas de utils/db.
+
+- "memoria" (predeterminado): dicts del proceso, como siempre.
+- "sqlite": un archivo SQLite local compartido por todos los procesos de
+  Streamlit del mismo equipo. Guarda los DataFrames tipados serializados y la
+  versión de datos de cada usuario, así que una escritura en un proceso invalida
+  el cache de los demás y cada negocio se descarga de Firestore una sola vez.
+
+Se elige con MINEGOCIO_CACHE=sqlite y MINEGOCIO_CACHE_DB=<ruta>. El archivo solo
+lo escriben los propios procesos de la aplicación (se usa pickle).
+
+En ambos almacenes una lectura vence a los MINEGOCIO_CACHE_EDAD_MAXIMA segundos
+(300 por omisión), así que los cambios que no pasan por este cache (otro equipo,
+la consola de Firestore o, con "memoria", otro proceso) se ven a más tardar en
+ese plazo. El tamaño se limita a MINEGOCIO_CACHE_MAX_MB, descartando primero
+las lecturas usadas hace más tiempo ("memoria") o las más antiguas ("sqlite").
+"""
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+RUTA_BD_CACHE = os.getenv("MINEGOCIO_CACHE_DB", os.path.join(".minegocio", "cache_lecturas.sqlite3"))
+MAX_MB_CACHE = float(os.getenv("MINEGOCIO_CACHE_MAX_MB", "512"))
+EDAD_MAXIMA_CACHE = float(os.getenv("MINEGOCIO_CACHE_EDAD_MAXIMA", "300"))
+
+
+class _Estadisticas:
+    def __init__(self):
+        self.aciertos = 0
+        self.fallos = 0
+
+    def registrar(self, acierto):
+        if acierto:
+            self.aciertos += 1
+        else:
+            self.fallos += 1
+
+    def resumen(self, entradas, total_bytes):
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else 0.0,
+            "entradas": entradas,
+            "mb": round(total_bytes / 2 ** 20, 2),
+        }
+
+
+# ---------------------------
+# Memoria del proceso
+# ---------------------------
+class CacheMemoria:
+    nombre = "memoria"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (uid, colección, columnas) -> (DataFrame, creado, bytes), de la menos a la más usada
+        self._lecturas = OrderedDict()
+        self._versiones = {}
+        self._bytes = 0
+        self._stats = _Estadisticas()
+
+    def version(self, uid):
+        with self._lock:
+            return self._versiones.get(uid, 0)
+
+    def leer(self, clave):
+        with self._lock:
+            entrada = self._lecturas.get(clave)
+            if entrada is None:
+                return None
+            if time.time() - entrada[1] > EDAD_MAXIMA_CACHE:
+                self._quitar(clave)
+                return None
+            self._lecturas.move_to_end(clave)
+            return entrada[0]
+
+    def _quitar(self, clave):
+        self._bytes -= self._lecturas.pop(clave)[2]
+
+    def _poner(self, clave, df, creado):
+        if clave in self._lecturas:
+            self._quitar(clave)
+        tam = int(df.memory_usage(deep=True).sum())
+        self._lecturas[clave] = (df, creado, tam)
+        self._bytes += tam
+
+    def _recortar(self):
+        while self._lecturas and self._bytes > MAX_MB_CACHE * 2 ** 20:
+            self._quitar(next(iter(self._lecturas)))
+
+    def guardar(self, clave, version, df):
+        """Guarda `df` solo si la versión de datos del usuario sigue siendo `version`."""
+        with self._lock:
+            if self._versiones.get(clave[0], 0) == version:
+                self._poner(clave, df, time.time())
+                self._recortar()
+
+    def actualizar(self, uid, funcion):
+        """
+        Reemplaza cada entrada de `uid` por `funcion(colección, columnas, df)`
+        (None la descarta) y avanza su versión, en un solo paso.
+        """
+        with self._lock:
+            for clave in [k for k in self._lecturas if k[0] == uid]:
+                df, creado, _ = self._lecturas[clave]
+                nuevo = funcion(clave[1], clave[2], df)
+                if nuevo is None:
+                    self._quitar(clave)
+                else:
+                    self._poner(clave, nuevo, creado)  # conserva su edad: no es una lectura nueva
+            self._versiones[uid] = self._versiones.get(uid, 0) + 1
+            self._recortar()
+
+    def registrar(self, acierto):
+        with self._lock:
+            self._stats.registrar(acierto)
+
+    def invalidar(self, uid):
+        with self._lock:
+            for clave in [k for k in self._lecturas if k[0] == uid]:
+                self._quitar(clave)
+            self._versiones[uid] = self._versiones.get(uid, 0) + 1
+
+    def estadisticas(self):
+        with self._lock:
+            return self._stats.resumen(len(self._lecturas), self._bytes)
+
+
+# ---------------------------
+# SQLite compartido entre procesos
+# ---------------------------
+class CacheSQLite:
+    nombre = "sqlite"
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta or RUTA_BD_CACHE
+        self._local = threading.local()
+        self._stats = _Estadisticas()
+
+    def _con(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            carpeta = os.path.dirname(self.ruta)
+            if carpeta:
+                os.makedirs(carpeta, exist_ok=True)
+            con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("CREATE TABLE IF NOT EXISTS versiones (uid TEXT PRIMARY KEY, version INTEGER)")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS lecturas (
+                    uid TEXT, coleccion TEXT, columnas TEXT, version INTEGER,
+                    datos BLOB, bytes INTEGER, creado REAL,
+                    PRIMARY KEY (uid, coleccion, columnas)
+                )
+            """)
+            self._local.con = con
+        return con
+
+    @staticmethod
+    def _version(con, uid):
+        fila = con.execute("SELECT version FROM versiones WHERE uid = ?", (uid,)).fetchone()
+        return fila[0] if fila else 0
+
+    def version(self, uid):
+        return self._version(self._con(), uid)
+
+    def leer(self, clave):
+        uid, col, columnas = clave
+        fila = self._con().execute(
+            "SELECT l.datos FROM lecturas l LEFT JOIN versiones v ON v.uid = l.uid "
+            "WHERE l.uid = ? AND l.coleccion = ? AND l.columnas = ? AND l.version = COALESCE(v.version, 0) "
+            "AND l.creado >= ?",
+            (uid, col, "\x1f".join(columnas), time.time() - EDAD_MAXIMA_CACHE)
+        ).fetchone()
+        return pickle.loads(fila[0]) if fila else None
+
+    def guardar(self, clave, version, df):
+        uid, col, columnas = clave
+        datos = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        con = self._con()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            if self._version(con, uid) == version:
+                con.execute("INSERT OR REPLACE INTO lecturas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (uid, col, "\x1f".join(columnas), version, datos, len(datos), time.time()))
+                self._recortar(con)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _recortar(con):
+        """Descarta las entradas más antiguas si el archivo pasa de MAX_MB_CACHE."""
+        exceso = (con.execute("SELECT COALESCE(SUM(bytes), 0) FROM lecturas").fetchone()[0]
+                  - MAX_MB_CACHE * 2 ** 20)
+        if exceso <= 0:
+            return
+        liberado = 0
+        for rowid, tam in con.execute("SELECT rowid, bytes FROM lecturas ORDER BY creado").fetchall():
+            con.execute("DELETE FROM lecturas WHERE rowid = ?", (rowid,))
+            liberado += tam
+            if liberado >= exceso:
+                break
+
+    def actualizar(self, uid, funcion):
+        con = self._con()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            version = self._version(con, uid)
+            filas = con.execute(
+                "SELECT coleccion, columnas, datos, creado FROM lecturas WHERE uid = ? AND version = ? "
+                "AND creado >= ?", (uid, version, time.time() - EDAD_MAXIMA_CACHE)
+            ).fetchall()
+            con.execute("DELETE FROM lecturas WHERE uid = ?", (uid,))
+            for col, columnas, datos, creado in filas:
+                nuevo = funcion(col, tuple(columnas.split("\x1f")), pickle.loads(datos))
+                if nuevo is not None:
+                    # Conserva su edad: corregir una lectura no la vuelve más reciente
+                    datos = pickle.dumps(nuevo, protocol=pickle.HIGHEST_PROTOCOL)
+                    con.execute("INSERT INTO lecturas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (uid, col, columnas, version + 1, datos, len(datos), creado))
+            con.execute("INSERT INTO versiones VALUES (?, 1) "
+                        "ON CONFLICT(uid) DO UPDATE SET version = version + 1", (uid,))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def registrar(self, acierto):
+        self._stats.registrar(acierto)  # contadores de este proceso
+
+    def invalidar(self, uid):
+        con = self._con()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute("DELETE FROM lecturas WHERE uid = ?", (uid,))
+            con.execute("INSERT INTO versiones VALUES (?, 1) "
+                        "ON CONFLICT(uid) DO UPDATE SET version = version + 1", (uid,))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def estadisticas(self):
+        entradas, total = self._con().execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM lecturas"
+        ).fetchone()
+        return self._stats.resumen(entradas, total)
+
+
+_ALMACENES = {"memoria": CacheMemoria, "sqlite": CacheSQLite}
+
+
+def crear():
+    """Almacén indicado por MINEGOCIO_CACHE (memoria si no se define)."""
+    nombre = os.getenv("MINEGOCIO_CACHE", "memoria").lower()
+    if nombre not in _ALMACENES:
+        raise ValueError(f"MINEGOCIO_CACHE='{nombre}' no es válido; opciones: {', '.join(_ALMACENES)}")
+    return _ALMACENES[nombre]()
@@ -0,0 +1,222 @@
+# utils/cola_escrituras.py
+"""
+Cola local y durable de escrituras diferidas (write-behind).
+
+Con MINEGOCIO_ESCRITURA_DIFERIDA=1, utils/db guarda ventas, transacciones,
+movimientos y cambios de existencia en esta cola SQLite y responde de inmediato.
+Un hilo las envía a Firestore por lotes, con reintentos y espera exponencial.
+Cada operación lleva una clave de idempotencia (uid/colección/ID de documento),
+así que reenviarla tras un fallo no duplica datos.
+
+Las operaciones con la misma llave de orden (p. ej. uid/productos/Clave para los
+cambios de existencia, que son valores absolutos) se confirman en el orden en que
+llegaron: mientras una espera su reintento o quedó en 'error', las siguientes de
+esa llave no se envían.
+"""
+import os
+import json
+import time
+import random
+import sqlite3
+import logging
+import threading
+
+RUTA_BD_COLA = os.getenv("MINEGOCIO_COLA_DB", os.path.join(".minegocio", "cola_escrituras.sqlite3"))
+TAM_LOTE = 400
+INTERVALO_ENVIO = 1.0      # segundos entre revisiones de la cola
+MAX_INTENTOS = 12          # después queda en estado 'error' para revisión manual
+
+_despertar = threading.Event()
+_lock = threading.Lock()
+_hilo = None
+
+
+def activa():
+    return os.getenv("MINEGOCIO_ESCRITURA_DIFERIDA", "").lower() in ("1", "true", "si", "sí")
+
+
+def _json_default(valor):
+    if hasattr(valor, "item"):  # escalares de numpy
+        return valor.item()
+    if hasattr(valor, "isoformat"):
+        return valor.isoformat()
+    return str(valor)
+
+
+# ---------------------------
+# Tabla de la cola (SQLite)
+# ---------------------------
+def _conexion():
+    carpeta = os.path.dirname(RUTA_BD_COLA)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    con = sqlite3.connect(RUTA_BD_COLA, timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS pendientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            clave_idempotencia TEXT UNIQUE,
+            uid TEXT,
+            coleccion TEXT,
+            operacion TEXT,
+            doc_id TEXT,
+            datos TEXT,
+            creado REAL,
+            intentos INTEGER DEFAULT 0,
+            proximo_intento REAL DEFAULT 0,
+            estado TEXT DEFAULT 'pendiente',
+            ultimo_error TEXT,
+            orden TEXT
+        )
+    """)
+    try:
+        # Colas creadas antes de la llave de orden
+        con.execute("ALTER TABLE pendientes ADD COLUMN orden TEXT")
+        con.execute("UPDATE pendientes SET orden = CASE WHEN operacion = 'actualizar_clave' "
+                    "THEN uid || '/' || coleccion || '/' || json_extract(datos, '$.Clave') "
+                    "ELSE clave_idempotencia END WHERE orden IS NULL")
+    except sqlite3.OperationalError:
+        pass
+    con.execute("CREATE INDEX IF NOT EXISTS pendientes_orden ON pendientes (orden, id)")
+    return con
+
+
+def encolar(uid, coleccion, operacion, doc_id, datos, clave_idempotencia, orden=None):
+    """
+    Guarda la operación en disco. Si la clave ya estaba en la cola, no hace nada.
+    `orden` agrupa las operaciones que deben confirmarse en orden de llegada.
+    """
+    with _conexion() as con:
+        con.execute(
+            "INSERT OR IGNORE INTO pendientes "
+            "(clave_idempotencia, uid, coleccion, operacion, doc_id, datos, creado, orden) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (clave_idempotencia, uid, coleccion, operacion, doc_id,
+             json.dumps(datos, default=_json_default, ensure_ascii=False), time.time(),
+             orden or clave_idempotencia)
+        )
+    _despertar.set()
+
+
+def _filas(cursor):
+    columnas = [c[0] for c in cursor.description]
+    return [dict(zip(columnas, fila), datos=json.loads(fila[columnas.index("datos")])) for fila in cursor]
+
+
+def pendientes(uid, coleccion):
+    """Operaciones aún no confirmadas de `uid` en `coleccion`, en orden de llegada."""
+    with _conexion() as con:
+        return _filas(con.execute(
+            "SELECT * FROM pendientes WHERE uid = ? AND coleccion = ? ORDER BY id", (uid, coleccion)
+        ))
+
+
+def estado():
+    """Profundidad y retraso de la cola."""
+    with _conexion() as con:
+        n, errores, mas_antiguo = con.execute(
+            "SELECT COUNT(*), SUM(estado = 'error'), MIN(creado) FROM pendientes"
+        ).fetchone()
+    return {
+        "pendientes": n,
+        "con_error": errores or 0,
+        "retraso_segundos": round(time.time() - mas_antiguo, 1) if mas_antiguo else 0.0,
+    }
+
+
+def detalle(limite=200, solo_errores=False):
+    with _conexion() as con:
+        filas = _filas(con.execute(
+            "SELECT * FROM pendientes WHERE estado = 'error' OR ? = 0 ORDER BY id LIMIT ?",
+            (int(solo_errores), limite)
+        ))
+    return [{k: v for k, v in f.items() if k != "datos"} for f in filas]
+
+
+def reintentar_errores():
+    with _conexion() as con:
+        con.execute("UPDATE pendientes SET estado = 'pendiente', intentos = 0, proximo_intento = 0 "
+                    "WHERE estado = 'error'")
+    _despertar.set()
+
+
+# ---------------------------
+# Envío en segundo plano
+# ---------------------------
+def _marcar_fallo(con, op, error):
+    intentos = op["intentos"] + 1
+    espera = min(300, 2 ** intentos) + random.random()
+    if intentos >= MAX_INTENTOS:
+        logging.error(f"Escritura diferida {op['clave_idempotencia']} quedó en error tras {intentos} intentos: {error}")
+    con.execute(
+        "UPDATE pendientes SET intentos = ?, proximo_intento = ?, estado = ?, ultimo_error = ? WHERE id = ?",
+        (intentos, time.time() + espera, "error" if intentos >= MAX_INTENTOS else "pendiente", str(error), op["id"])
+    )
+
+
+def enviar_pendientes(enviar, al_confirmar):
+    """
+    Envía un lote de operaciones vencidas con `enviar(ops)`. Si el lote falla, se
+    reintenta operación por operación para que una sola no bloquee a las demás;
+    las posteriores con la misma llave de orden esperan a la que falló. Las que
+    tienen una anterior de su llave en espera o en 'error' no se toman.
+    `al_confirmar(uids)` se llama con los negocios que tuvieron escrituras confirmadas.
+    Devuelve cuántas operaciones se confirmaron.
+    """
+    ahora = time.time()
+    with _conexion() as con:
+        ops = _filas(con.execute(
+            "SELECT * FROM pendientes p WHERE estado = 'pendiente' AND proximo_intento <= ? "
+            "AND NOT EXISTS (SELECT 1 FROM pendientes q WHERE q.orden = p.orden AND q.id < p.id "
+            "AND (q.estado = 'error' OR q.proximo_intento > ?)) "
+            "ORDER BY id LIMIT ?",
+            (ahora, ahora, TAM_LOTE)
+        ))
+    if not ops:
+        return 0
+
+    try:
+        enviar(ops)
+        confirmadas, fallidas = ops, []
+    except Exception as e:
+        logging.warning(f"Lote de {len(ops)} escrituras falló ({e}); se envían una por una.")
+        confirmadas, fallidas, detenidas = [], [], set()
+        for op in ops:
+            if op["orden"] in detenidas:
+                continue  # se envía después de la que falló, en otra vuelta
+            try:
+                enviar([op])
+                confirmadas.append(op)
+            except Exception as e_op:
+                fallidas.append((op, e_op))
+                detenidas.add(op["orden"])
+
+    with _conexion() as con:
+        con.executemany("DELETE FROM pendientes WHERE id = ?", [(op["id"],) for op in confirmadas])
+        for op, error in fallidas:
+            _marcar_fallo(con, op, error)
+    if confirmadas:
+        al_confirmar({op["uid"] for op in confirmadas})
+    return len(confirmadas)
+
+
+def _bucle(enviar, al_confirmar):
+    while True:
+        try:
+            while enviar_pendientes(enviar, al_confirmar) == TAM_LOTE:
+                pass
+        except Exception as e:
+            logging.error(f"Error en el envío de la cola de escrituras: {e}")
+        _despertar.wait(INTERVALO_ENVIO)
+        _despertar.clear()
+
+
+def iniciar(enviar, al_confirmar):
+    """Arranca el hilo de envío una sola vez por proceso."""
+    global _hilo
+    with _lock:
+        if _hilo is not None:
+            return
+        _hilo = threading.Thread(target=_bucle, args=(enviar, al_confirmar), name="cola-escrituras", daemon=True)
+        _hilo.start()
+        logging.info("Cola de escrituras diferidas iniciada.")
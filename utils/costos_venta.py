@@ -0,0 +1,140 @@
+# utils/costos_venta.py
+"""
+Relleno único del Costo Unitario en los renglones de venta anteriores a que se
+guardara al cobrar (ver reportes.calcular_margenes).
+
+Para cada renglón sin costo se usa el mejor dato disponible, en este orden:
+  1. "Movimiento de la venta": el movimiento de kardex de esa venta (mismo Folio y Clave).
+  2. "Histórico": el último costo conocido de la Clave (kardex o fotos de
+     existencias) hasta el día de la venta.
+  3. "Histórico posterior": el primer costo conocido después de la venta.
+  4. "Catálogo": el Costo Unitario actual del producto.
+Sin --aplicar solo muestra el plan:
+
+    python -m utils.costos_venta <uid>
+    python -m utils.costos_venta <uid> --aplicar
+"""
+import sys
+import time
+import logging
+import pandas as pd
+from google.cloud.firestore_v1.field_path import FieldPath
+from utils import db
+
+TAM_LOTE = 500
+
+
+def _coleccion(uid, col):
+    db.inicializar_firebase()
+    return db.db.collection("usuarios").document(uid).collection(col)
+
+
+def _leer(uid, col, campos):
+    filas = []
+    for d in _coleccion(uid, col).select([FieldPath(c).to_api_repr() for c in campos]).stream():
+        datos = d.to_dict() or {}
+        filas.append({"ID": d.id, **{c: datos.get(c) for c in campos}, "_tiene_costo": "Costo Unitario" in datos})
+    return pd.DataFrame(filas, columns=["ID", *campos, "_tiene_costo"])
+
+
+def _costos_conocidos(uid):
+    """(Fecha, Clave, Costo Unitario, Referencia) de kardex y fotos de existencias, con costo > 0."""
+    movs = _leer(uid, "movimientos_inventario", ["Fecha", "Clave", "Costo Unitario", "Referencia"])
+    fotos = _leer(uid, "existencias_snapshots", ["Fecha", "Clave", "Costo Unitario"])
+    costos = pd.concat([movs, fotos.assign(Referencia="")], ignore_index=True)
+    costos["Fecha"] = pd.to_datetime(costos["Fecha"], errors="coerce")
+    costos["Clave"] = costos["Clave"].astype(str)
+    costos["Costo Unitario"] = pd.to_numeric(costos["Costo Unitario"], errors="coerce")
+    costos["Referencia"] = costos["Referencia"].fillna("").astype(str)
+    return costos[(costos["Costo Unitario"] > 0) & costos["Fecha"].notna()]
+
+
+def analizar_costos_faltantes(uid):
+    """
+    Plan de relleno: una fila por renglón de venta sin Costo Unitario con ID,
+    Fecha, Folio, Clave, Costo Unitario propuesto y Origen.
+    """
+    columnas = ["ID", "Fecha", "Folio", "Clave", "Producto", "Costo Unitario", "Origen"]
+    ventas = _leer(uid, "ventas", ["Fecha", "Folio", "Clave del Producto", "Producto", "Costo Unitario"])
+    ventas = ventas[~ventas["_tiene_costo"]].drop(columns="Costo Unitario") \
+        .rename(columns={"Clave del Producto": "Clave"})
+    if ventas.empty:
+        return pd.DataFrame(columns=columnas)
+
+    ventas["Clave"] = ventas["Clave"].astype(str)
+    ventas["Folio"] = ventas["Folio"].fillna("").astype(str)
+    # Las ventas guardan solo la fecha: cuenta todo lo registrado ese día
+    ventas["Limite"] = pd.to_datetime(ventas["Fecha"], errors="coerce").dt.normalize() + pd.Timedelta(days=1)
+    ventas["Costo Unitario"] = float("nan")
+    ventas["Origen"] = "Sin costo"
+    costos = _costos_conocidos(uid)
+
+    def asignar(valores, origen):
+        libre = ventas["Costo Unitario"].isna() & valores.notna()
+        ventas.loc[libre, "Costo Unitario"] = valores[libre]
+        ventas.loc[libre, "Origen"] = origen
+
+    # 1. Movimiento registrado por la propia venta ("Venta {folio} a ...")
+    de_venta = costos[costos["Referencia"].str.startswith("Venta ")].assign(
+        Folio=lambda c: c["Referencia"].str.split(" ").str[1]
+    ).drop_duplicates(["Folio", "Clave"], keep="last").set_index(["Folio", "Clave"])["Costo Unitario"]
+    claves_venta = pd.MultiIndex.from_frame(ventas[["Folio", "Clave"]])
+    asignar(pd.Series(de_venta.reindex(claves_venta).to_numpy(), index=ventas.index), "Movimiento de la venta")
+
+    # 2 y 3. Último costo conocido hasta la venta y, si no hay, el primero después
+    con_fecha = ventas[ventas["Limite"].notna()].sort_values("Limite")
+    historico = costos.sort_values("Fecha")[["Fecha", "Clave", "Costo Unitario"]]
+    for direccion, origen in (("backward", "Histórico"), ("forward", "Histórico posterior")):
+        if con_fecha.empty or historico.empty:
+            break
+        cruce = pd.merge_asof(
+            con_fecha[["Limite", "Clave"]].reset_index(), historico, left_on="Limite", right_on="Fecha",
+            by="Clave", direction=direccion, allow_exact_matches=direccion == "forward"
+        ).set_index("index")["Costo Unitario"]
+        asignar(cruce.reindex(ventas.index), origen)
+
+    # 4. Costo actual del catálogo
+    catalogo = db.leer_productos(uid, campos=["Clave", "Costo Unitario"])
+    catalogo = catalogo[catalogo["Costo Unitario"] > 0].drop_duplicates("Clave")
+    asignar(ventas["Clave"].map(catalogo.set_index(catalogo["Clave"].astype(str))["Costo Unitario"]), "Catálogo")
+
+    ventas["Costo Unitario"] = ventas["Costo Unitario"].fillna(0.0)
+    return ventas[columnas].sort_values(["Fecha", "ID"]).reset_index(drop=True)
+
+
+def aplicar_costos(uid, plan=None):
+    """Guarda el Costo Unitario propuesto en cada renglón del plan. Es idempotente. Devuelve un resumen."""
+    inicio = time.time()
+    plan = analizar_costos_faltantes(uid) if plan is None else plan
+    ref_ventas = _coleccion(uid, "ventas")
+
+    filas = plan[["ID", "Costo Unitario"]].to_dict("records")
+    for i in range(0, len(filas), TAM_LOTE):
+        batch = db.db.batch()
+        for fila in filas[i:i + TAM_LOTE]:
+            batch.update(ref_ventas.document(fila["ID"]), {"Costo Unitario": float(fila["Costo Unitario"])})
+        batch.commit()
+
+    db.invalidar_cache(uid)
+    resumen = {
+        "uid": uid,
+        "renglones_actualizados": len(filas),
+        "por_origen": plan["Origen"].value_counts().to_dict(),
+        "segundos": round(time.time() - inicio, 2),
+    }
+    logging.info(f"Relleno de costos de '{uid}': {resumen}")
+    return resumen
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] != "--aplicar"):
+        print("Uso: python -m utils.costos_venta <uid> [--aplicar]")
+        sys.exit(1)
+    uid_arg = sys.argv[1]
+    plan_uid = analizar_costos_faltantes(uid_arg)
+    print(plan_uid.to_string(index=False) if not plan_uid.empty else "Todas las ventas tienen Costo Unitario.")
+    if len(sys.argv) == 3:
+        print(aplicar_costos(uid_arg, plan_uid))
+    else:
+        print("\nSolo análisis. Agrega --aplicar para guardar los costos propuestos.")
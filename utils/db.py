@@ -1,17 +1,27 @@
 # utils/db.py
 import os
 import json
+import datetime
+import time
 import base64
 import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 import pandas as pd
 import streamlit as st
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.api_core.exceptions import AlreadyExists
+from urllib.parse import quote
 from dotenv import load_dotenv
+from utils import cola_escrituras, cache_compartido, resiliencia
 
 load_dotenv()
 
 db = None  # cliente global Firestore
+_init_lock = threading.Lock()
 
 
 # ---------------------------
@@ -21,6 +31,18 @@ def inicializar_firebase():
     global db
     if db is not None:
         return
+    with _init_lock:
+        if db is None:
+            _inicializar_firebase()
+
+
+def _inicializar_firebase():
+    global db
+    # Firestore en memoria para pruebas de carga (ver utils/firestore_local.py)
+    if os.getenv("MINEGOCIO_FIRESTORE_LOCAL"):
+        from utils.firestore_local import ClienteLocal
+        db = ClienteLocal.compartido()
+        return
     if not firebase_admin._apps:
         # 1) Prioridad: secreta B64
         if "FIREBASE_PRIVATE_KEY_B64" in st.secrets:
@@ -61,111 +83,484 @@ def _ref_write(col):
     return ref
 
 
+# ---------- Esquema tipado por colección ----------
+# Columnas de cada colección y su tipo. Los lectores devuelven siempre estas
+# columnas (o el subconjunto pedido en `campos`), rellenando las ausentes.
+_ESQUEMAS = {
+    "ventas": {
+        "Fecha": "texto", "Cliente": "texto", "Producto": "texto", "Clave del Producto": "texto",
+        "Cantidad": "num", "Precio Unitario": "num", "Total": "num", "Descuento": "num",
+        "Importe Neto": "num", "Monto Crédito": "num", "Monto Contado": "num",
+        "Anticipo Aplicado": "num", "Método de pago": "texto", "Tipo de venta": "texto",
+        "Folio": "texto", "Costo Unitario": "num",
+    },
+    "clientes": {
+        "ID": "texto", "Nombre": "texto", "Correo": "texto", "Teléfono": "texto",
+        "Empresa": "texto", "RFC": "texto", "Límite de crédito": "num",
+    },
+    "transacciones": {
+        "Fecha": "texto", "Descripción": "texto", "Categoría": "texto", "Tipo": "texto",
+        "Monto": "num", "Cliente": "texto", "Método de pago": "texto", "Folio": "texto",
+    },
+    "productos": {
+        "Clave": "texto", "Nombre": "texto", "Marca_Tipo": "texto", "Modelo": "texto",
+        "Color": "texto", "Talla": "texto", "Categoría": "texto", "Precio Unitario": "num",
+        "Costo Unitario": "num", "Cantidad": "num", "Descripción": "texto",
+    },
+    # Un documento por modelo; Variantes es {Clave: {Color, Talla, Precio Unitario,
+    # Costo Unitario, Cantidad}} (ver "Familias de variantes" más abajo)
+    "familias_productos": {
+        "ID": "texto", "Nombre": "texto", "Marca_Tipo": "texto", "Modelo": "texto",
+        "Categoría": "texto", "Descripción": "texto", "Variantes": "mapa",
+    },
+}
+
+
+def _leer_tipado(col, uid, campos=None, campo_id=None):
+    """Lee `col` con las columnas del esquema (o solo `campos`) y aplica los tipos."""
+    esquema = _ESQUEMAS[col]
+    columnas = list(campos) if campos else list(esquema)
+    df = _cached_read_union(col, columnas, uid or _uid(), campo_id=campo_id)
+    if cola_escrituras.activa():
+        df = _fusionar_pendientes(col, uid or _uid(), columnas, df, campo_id)
+    for c in columnas:
+        if esquema.get(c) == "num":
+            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0)
+    return df
+
+
+# ---------- Cache compartido por usuario ----------
+# Las lecturas se guardan por (uid, colección, columnas) y se comparten entre
+# sesiones; con MINEGOCIO_CACHE=sqlite también entre procesos del mismo equipo
+# (ver utils/cache_compartido.py). Cada escritura invalida las entradas del
+# usuario y avanza su versión de datos, que usan los resultados precalculados.
+# Las lecturas vencen a los MINEGOCIO_CACHE_EDAD_MAXIMA segundos, así que la
+# precarga periódica vuelve a leer lo vencido; lo que no admite ese retraso
+# (la existencia al cobrar) se lee directo con leer_existencias.
+_cache_lock = threading.RLock()
+_cache = cache_compartido.crear()
+_ultimo_acceso = {}
+
+
+def version_datos(uid):
+    return _cache.version(uid)
+
+
+def version_vistas(uid):
+    """
+    Versión con la que las páginas guardan sus st.cache_data y sus DataFrames de
+    sesión: la versión de datos más el periodo de EDAD_MAXIMA_CACHE en curso. La
+    versión de datos solo la avanzan las escrituras de este proceso (o de este
+    equipo, con MINEGOCIO_CACHE=sqlite); con el periodo, lo escrito por otros
+    procesos o equipos llega a las páginas a más tardar en dos periodos.
+    """
+    return version_datos(uid), int(time.time() // cache_compartido.EDAD_MAXIMA_CACHE)
+
+
+def invalidar_cache(uid):
+    if not uid:
+        return
+    _cache.invalidar(uid)
+
+
+def aplicar_en_cache(uid, funcion):
+    """
+    Tras una escritura cuyo efecto ya se conoce, corrige en su lugar las lecturas
+    en cache de `uid` en vez de descartarlas. `funcion(colección, columnas, df)`
+    devuelve el DataFrame nuevo (sin modificar `df`) o None para descartar la
+    entrada. Avanza la versión de datos.
+    """
+    if uid:
+        _cache.actualizar(uid, funcion)
+        st.cache_data.clear()
+
+
+def estadisticas_cache():
+    """Backend, aciertos, fallos, entradas y MB del cache de lecturas."""
+    return {"backend": _cache.nombre, **_cache.estadisticas()}
+
+
+def usuarios_activos(horas=24):
+    """UIDs que han leído datos en las últimas `horas`."""
+    limite = time.time() - horas * 3600
+    with _cache_lock:
+        return [uid for uid, ts in _ultimo_acceso.items() if ts >= limite]
+
+
 # ---------- Lectura base cacheada (solo user) ----------
-def _cached_read_union(col: str, columnas: list, uid: str | None):
+def _cached_read_union(col: str, columnas: list, uid: str | None, campo_id: str | None = None):
     """
     Lee solo datos del usuario actual (usuarios/{uid}/{col}).
+    Si `campo_id` se indica, el ID del documento se guarda en esa columna.
+    Cuando `columnas` no cubre todo el esquema, solo se piden esos campos a
+    Firestore (select) y, si la lectura completa ya está en cache, se recorta de ahí.
     """
-    inicializar_firebase()
-
     if not uid:
         return pd.DataFrame(columns=columnas)
 
+    completas = tuple(_ESQUEMAS.get(col, columnas))
+    clave = (uid, col, tuple(columnas))
+    with _cache_lock:
+        _ultimo_acceso[uid] = time.time()
+    # La versión se toma antes de leer para no guardar datos de una versión vieja
+    version = _cache.version(uid)
+    df_cache = _cache.leer(clave)
+    if df_cache is None and clave[2] != completas and set(columnas) <= set(completas):
+        df_completo = _cache.leer((uid, col, completas))
+        df_cache = df_completo[columnas] if df_completo is not None else None
+    _cache.registrar(df_cache is not None)
+    if df_cache is not None:
+        return df_cache.copy()
+
+    inicializar_firebase()
     ref_user = db.collection("usuarios").document(uid).collection(col)
-    docs_user = list(ref_user.stream())
+    # Las colecciones con Clave se deduplican por Clave aunque no se pida, para que
+    # cualquier selección de columnas tenga los mismos renglones que la completa
+    por_clave = "Clave" in completas
+    leidas = columnas if not por_clave or "Clave" in columnas else [*columnas, "Clave"]
+    campos_firestore = [c for c in leidas if c != campo_id]
+    if campos_firestore and set(campos_firestore) < set(completas) - {campo_id}:
+        ref_user = ref_user.select([FieldPath(c).to_api_repr() for c in campos_firestore])
+    docs_user = resiliencia.leer(col, lambda timeout: list(ref_user.stream(timeout=timeout)))
 
     if not docs_user:
-        return pd.DataFrame(columns=columnas)
+        df_user = pd.DataFrame(columns=columnas)
+    else:
+        filas = []
+        for d in docs_user:
+            data = d.to_dict() or {}
+            if campo_id:
+                data[campo_id] = d.id
+            filas.append({c: data.get(c, None) for c in leidas})
+        df_user = pd.DataFrame(filas)
 
-    df_user = pd.DataFrame([{c: d.to_dict().get(c, None) for c in columnas} for d in docs_user])
+        # Asegurar columnas
+        for c in leidas:
+            if c not in df_user.columns:
+                df_user[c] = None
 
-    # Asegurar columnas
-    for c in columnas:
-        if c not in df_user.columns:
-            df_user[c] = None
+        if por_clave:
+            df_user = df_user.drop_duplicates(subset=["Clave"], keep="first")
 
-    # Deduplicar por Clave si aplica
-    if "Clave" in columnas and "Clave" in df_user.columns:
-        df_user = df_user.drop_duplicates(subset=["Clave"], keep="first")
+        df_user = df_user[columnas]
 
-    return df_user[columnas]
+    # Solo se guarda si nadie escribió mientras se leía
+    _cache.guardar(clave, version, df_user)
+    return df_user.copy()
 
 
 def _clear_cache():
     # Limpiar cache de lecturas tras cualquier escritura
     st.cache_data.clear()
+    invalidar_cache(_uid())
+
+
+def _tras_escritura():
+    """
+    Tras una alta o cambio que puede quedar en la cola de escritura diferida. Si
+    quedó en la cola, las lecturas en cache siguen valiendo (_leer_tipado les suma
+    lo pendiente): solo avanza la versión de datos, y se invalidan cuando el envío
+    se confirma. Así la venta no vuelve a leer de Firestore entre renglones.
+    """
+    if cola_escrituras.activa():
+        aplicar_en_cache(_uid(), lambda col, columnas, df: df)
+    else:
+        _clear_cache()
+
+
+# ---------- Escritura diferida ----------
+# Ver utils/cola_escrituras.py. Las altas llevan un ID de documento generado en
+# el cliente, que es su clave de idempotencia; las lecturas agregan lo pendiente.
+def _encolar_alta(col, datos):
+    """Con la escritura diferida activa, encola el alta en `col` y devuelve True."""
+    if not cola_escrituras.activa():
+        return False
+    uid = _uid()
+    doc_id = _ref_write(col).document().id
+    cola_escrituras.encolar(uid, col, "set", doc_id, datos, f"{uid}/{col}/{doc_id}")
+    return True
+
+
+def _guardar_alta(col, datos):
+    """Alta en `col`: a la cola si está activa; si no, directa con el mismo ID de cliente, que la hace reintentable."""
+    if not _encolar_alta(col, datos):
+        ref = _ref_write(col).document()
+        resiliencia.escribir(f"alta {col}", lambda timeout: ref.set(datos, timeout=timeout))
+
+
+def _fusionar_pendientes(col, uid, columnas, df, campo_id=None):
+    """Agrega a `df` las altas y cambios de `col` que siguen en la cola local."""
+    pendientes = cola_escrituras.pendientes(uid, col) if uid else []
+    if not pendientes:
+        return df
+
+    altas = [p for p in pendientes if p["operacion"] == "set"]
+    if altas:
+        # Con el ID de documento se descartan las altas que ya llegaron a Firestore
+        # entre la lectura y la consulta de la cola
+        con_id = _cached_read_union(col, [*columnas, "__id__"], uid, campo_id="__id__")
+        nuevas = [{c: p["datos"].get(c, p["doc_id"] if c == campo_id else None) for c in columnas}
+                  for p in altas if p["doc_id"] not in set(con_id["__id__"])]
+        df = con_id.drop(columns="__id__")
+        if nuevas:
+            df = pd.concat([df, pd.DataFrame(nuevas, columns=columnas)], ignore_index=True)
+
+    for p in pendientes:
+        if p["operacion"] == "actualizar_clave" and "Clave" in df.columns:
+            mascara = df["Clave"].astype(str) == str(p["datos"]["Clave"])
+            for campo, valor in p["datos"]["campos"].items():
+                if campo in df.columns:
+                    df.loc[mascara, campo] = valor
+    return df
+
+
+def _enviar_pendientes(ops):
+    """Confirma en Firestore un lote de operaciones de la cola (un solo batch)."""
+    inicializar_firebase()
+    batch = db.batch()
+    ids_productos = {}
+    variantes = {}  # uid -> {Clave: campos} de las Claves que no son productos individuales
+    for op in ops:
+        ref = db.collection("usuarios").document(op["uid"]).collection(op["coleccion"])
+        if op["operacion"] == "set":
+            batch.set(ref.document(op["doc_id"]), op["datos"])
+        elif op["operacion"] == "actualizar_clave":
+            if op["uid"] not in ids_productos:
+                ids_productos[op["uid"]] = _ids_por_clave(ref)
+            clave = str(op["datos"]["Clave"])
+            doc_id = ids_productos[op["uid"]].get(clave)
+            if doc_id:
+                batch.update(ref.document(doc_id), op["datos"]["campos"])
+            else:
+                variantes.setdefault(op["uid"], {}).setdefault(clave, {}).update(op["datos"]["campos"])
+    for uid, cambios in variantes.items():
+        for ref_familia, rutas in _escrituras_variantes(uid, cambios)[0]:
+            batch.update(ref_familia, rutas)
+    resiliencia.escribir("cola de escrituras", batch.commit)
+
+
+def iniciar_cola_escrituras():
+    """Arranca el envío de la cola si la escritura diferida está activa."""
+    if cola_escrituras.activa():
+        cola_escrituras.iniciar(_enviar_pendientes, lambda uids: [invalidar_cache(u) for u in uids])
+
+
+# ---------- Precarga ----------
+_pool_precarga = ThreadPoolExecutor(max_workers=4, thread_name_prefix="precarga")
+_precargas = {}  # uid -> {colección: Future}
+
+
+def precargar_usuario_async(uid):
+    """
+    Lanza en paralelo la lectura de las colecciones principales de `uid` hacia el
+    cache compartido. Devuelve {colección: Future}; si ya hay una precarga en curso
+    para ese usuario, devuelve la misma.
+    """
+    if not uid:
+        return {}
+    with _cache_lock:
+        en_curso = _precargas.get(uid)
+        if en_curso and not all(f.done() for f in en_curso.values()):
+            return en_curso
+        lectores = {
+            "ventas": leer_ventas, "transacciones": leer_transacciones,
+            "clientes": leer_clientes, "productos": leer_productos,
+        }
+        futuros = {col: _pool_precarga.submit(lector, uid) for col, lector in lectores.items()}
+        _precargas[uid] = futuros
+    return futuros
+
+
+def precarga_en_curso(uid):
+    """Futuros de la precarga de `uid` si aún no termina, o None."""
+    with _cache_lock:
+        futuros = _precargas.get(uid)
+    if not futuros or all(f.done() for f in futuros.values()):
+        return None
+    return futuros
+
+
+def precargar_usuario(uid):
+    """Llena el cache compartido con las colecciones principales de `uid`."""
+    futuros = precargar_usuario_async(uid)
+    wait(futuros.values())
+    for f in futuros.values():
+        f.result()
 
 
 # ---------------------------
 # Ventas
 # ---------------------------
 def guardar_venta(venta_dict):
-    _ref_write("ventas").add(venta_dict)
+    _guardar_alta("ventas", venta_dict)
     logging.info("Venta guardada.")
-    _clear_cache()
+    _tras_escritura()
 
 
-def leer_ventas():
-    columnas = [
-        "Fecha", "Cliente", "Producto", "Clave del Producto",
-        "Cantidad", "Precio Unitario", "Total", "Descuento", "Importe Neto",
-        "Monto Crédito", "Monto Contado", "Anticipo Aplicado",
-        "Método de pago", "Tipo de venta"
-    ]
-    uid = _uid()
-    df = _cached_read_union("ventas", columnas, uid)
-    for col in ["Cantidad", "Precio Unitario", "Total", "Descuento", "Importe Neto",
-                "Monto Crédito", "Monto Contado", "Anticipo Aplicado"]:
-        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0)
-    return df
+def leer_ventas(uid=None, campos=None):
+    return _leer_tipado("ventas", uid, campos)
+
+
+# ---------- Folios de venta ----------
+# Cada proceso reserva bloques de TAM_BLOQUE_FOLIOS folios creando el documento
+# bloques_folios/{n} con create(): si otro proceso ya tomó ese bloque, se intenta
+# el siguiente. Es una subcolección directa de usuarios/{uid}, así que entra en
+# el respaldo y tras restaurarlo la numeración continúa. No hay un documento contador que se actualice
+# en cada venta, así que varias cajas no compiten por la misma escritura.
+# Los folios no usados de un bloque se pierden si el proceso se reinicia.
+# El siguiente bloque se reserva en segundo plano al iniciar sesión y cuando el
+# actual va a la mitad. Con la escritura diferida activa la venta no espera a
+# Firestore: si no hay bloque listo usa un folio provisional (VL...), único pero
+# fuera de la secuencia.
+TAM_BLOQUE_FOLIOS = 20
+_folio_lock = threading.Lock()
+_bloques_folio = {}  # uid -> [siguiente folio, último folio del bloque]
+_bloques_siguientes = {}  # uid -> Future del bloque reservado por adelantado
+_pool_folios = ThreadPoolExecutor(max_workers=1, thread_name_prefix="folios")
+
+
+def _formato_folio(numero):
+    return f"V{numero:06d}"
+
+
+def _reservar_bloque_folios(uid):
+    ref_usuario = db.collection("usuarios").document(uid)
+    ref = ref_usuario.collection("bloques_folios")
+    # Bloques reservados antes en contadores/folios_venta/bloques, fuera del respaldo
+    ref_anterior = ref_usuario.collection("contadores").document("folios_venta").collection("bloques")
+    numero = 0
+    for ref_bloques in (ref, ref_anterior):
+        ultimo = resiliencia.leer("bloques de folios", lambda timeout: list(
+            ref_bloques.order_by("numero", direction=firestore.Query.DESCENDING).limit(1).stream(timeout=timeout)))
+        if ultimo:
+            numero = max(numero, ultimo[0].to_dict()["numero"] + 1)
+    while True:
+        try:
+            # Reintentar es seguro: si el create sí se aplicó, el reintento da
+            # AlreadyExists y solo se pierde ese bloque
+            ref_bloque = ref.document(f"{numero:08d}")
+            datos = {"numero": numero, "reservado": _ahora()}
+            resiliencia.escribir("reservar folios", lambda timeout: ref_bloque.create(datos, timeout=timeout))
+            break
+        except AlreadyExists:
+            numero += 1
+    inicio = numero * TAM_BLOQUE_FOLIOS + 1
+    return [inicio, inicio + TAM_BLOQUE_FOLIOS - 1]
+
+
+def _prerreservar_folios(uid):
+    """Lanza la reserva del siguiente bloque si no hay una en curso o lista (con _folio_lock)."""
+    futuro = _bloques_siguientes.get(uid)
+    if futuro is None or (futuro.done() and futuro.exception() is not None):
+        _bloques_siguientes[uid] = _pool_folios.submit(_reservar_bloque_folios, uid)
+
+
+def prerreservar_folios(uid):
+    """Reserva en segundo plano el primer bloque de folios de `uid` (al iniciar sesión)."""
+    if not uid:
+        return
+    inicializar_firebase()
+    with _folio_lock:
+        bloque = _bloques_folio.get(uid)
+        if bloque is None or bloque[0] > bloque[1]:
+            _prerreservar_folios(uid)
+
+
+def _tomar_bloque(uid):
+    """El bloque reservado por adelantado o uno nuevo; None si la venta no debe esperarlo."""
+    futuro = _bloques_siguientes.pop(uid, None)
+    if cola_escrituras.activa():
+        if futuro is not None and futuro.done() and futuro.exception() is None:
+            return futuro.result()
+        if futuro is not None and not futuro.done():
+            _bloques_siguientes[uid] = futuro
+        else:
+            _prerreservar_folios(uid)
+        return None
+    if futuro is not None:
+        try:
+            return futuro.result()
+        except Exception as e:
+            logging.warning(f"Falló la reserva anticipada de folios de '{uid}', se reintenta: {e}")
+    return _reservar_bloque_folios(uid)
+
+
+def _folio_provisional():
+    return f"VL{datetime.datetime.now():%y%m%d%H%M%S}{uuid.uuid4().hex[:4].upper()}"
+
+
+def siguiente_folio(uid=None):
+    """Folio legible y único por negocio (V000001, V000002, ...)."""
+    uid = uid or _uid()
+    inicializar_firebase()
+    with _folio_lock:
+        bloque = _bloques_folio.get(uid)
+        if bloque is None or bloque[0] > bloque[1]:
+            bloque = _tomar_bloque(uid)
+            if bloque is None:
+                folio = _folio_provisional()
+                logging.warning(f"Sin bloque de folios listo para '{uid}': folio provisional {folio}.")
+                return folio
+            _bloques_folio[uid] = bloque
+        folio = bloque[0]
+        bloque[0] += 1
+        if bloque[1] - bloque[0] < TAM_BLOQUE_FOLIOS // 2:
+            _prerreservar_folios(uid)
+    return _formato_folio(folio)
+
+
+def buscar_folio(folio, uid=None):
+    """Renglones de venta y transacciones de un folio: (ventas_df, transacciones_df)."""
+    inicializar_firebase()
+    ref = db.collection("usuarios").document(uid or _uid())
+    resultado = []
+    for col in ("ventas", "transacciones"):
+        consulta = ref.collection(col).where("Folio", "==", folio)
+        docs = resiliencia.leer(f"folio {col}", lambda timeout: list(consulta.stream(timeout=timeout)))
+        filas = [{"ID": d.id, **(d.to_dict() or {})} for d in docs]
+        resultado.append(pd.DataFrame(filas, columns=["ID", *_ESQUEMAS[col]]))
+    return tuple(resultado)
 
 
 # ---------------------------
 # Clientes
 # ---------------------------
 def guardar_cliente(id_cliente, cliente_dict):
-    _ref_write("clientes").document(id_cliente).set(cliente_dict)
+    """
+    Crea el cliente con su ID como ID de documento. create() falla en el servidor
+    si ya existe, así que la validación es atómica entre sesiones.
+    Devuelve False si el ID ya estaba registrado.
+    """
+    try:
+        ref = _ref_write("clientes").document(id_cliente)
+        resiliencia.escribir("alta clientes", lambda timeout: ref.create(cliente_dict, timeout=timeout),
+                             idempotente=False)
+    except AlreadyExists:
+        logging.info(f"Cliente '{id_cliente}' ya existe.")
+        return False
     logging.info(f"Cliente '{id_cliente}' guardado.")
     _clear_cache()
+    return True
 
 
 def actualizar_cliente(id_cliente, datos_nuevos):
-    _ref_write("clientes").document(id_cliente).update(datos_nuevos)
+    ref = _ref_write("clientes").document(id_cliente)
+    resiliencia.escribir("actualizar clientes", lambda timeout: ref.update(datos_nuevos, timeout=timeout))
     logging.info(f"Cliente '{id_cliente}' actualizado.")
     _clear_cache()
 
 
-def leer_clientes():
-    columnas = ["ID", "Nombre", "Correo", "Teléfono", "Empresa", "RFC", "Límite de crédito"]
-    inicializar_firebase()
-    uid = _uid()
-    if not uid:
-        return pd.DataFrame(columns=columnas)
-
-    ref = db.collection("usuarios").document(uid).collection("clientes")
-    docs = list(ref.stream())
-    if not docs:
-        return pd.DataFrame(columns=columnas)
-
-    filas = []
-    for d in docs:
-        data = d.to_dict() or {}
-        data["ID"] = d.id
-        filas.append({c: data.get(c, None) for c in columnas})
-    df = pd.DataFrame(filas)
-
-    if "Límite de crédito" in df.columns:
-        df["Límite de crédito"] = pd.to_numeric(df["Límite de crédito"], errors="coerce").fillna(0.0)
-    return df[columnas]
+def leer_clientes(uid=None, campos=None):
+    return _leer_tipado("clientes", uid, campos, campo_id="ID")
 
 
 # ---------------------------
 # Transacciones
 # ---------------------------
 def guardar_transaccion(transaccion_dict):
-    _ref_write("transacciones").add(transaccion_dict)
+    _guardar_alta("transacciones", transaccion_dict)
     logging.info("Transacción guardada.")
-    _clear_cache()
+    _tras_escritura()
 
 
 def registrar_pago_cobranza(cliente, monto, metodo_pago, fecha, descripcion=""):
@@ -178,17 +573,76 @@ def registrar_pago_cobranza(cliente, monto, metodo_pago, fecha, descripcion=""):
         "Cliente": cliente,
         "Método de pago": metodo_pago,
     }
-    _ref_write("transacciones").add(pago_dict)
+    _guardar_alta("transacciones", pago_dict)
     logging.info("Pago de cobranza registrado.")
-    _clear_cache()
+    _tras_escritura()
 
 
-def leer_transacciones():
-    columnas = ["Fecha", "Descripción", "Categoría", "Tipo", "Monto", "Cliente", "Método de pago"]
-    uid = _uid()
-    df = _cached_read_union("transacciones", columnas, uid)
-    df["Monto"] = pd.to_numeric(df["Monto"], errors="coerce").fillna(0.0)
-    return df
+def leer_transacciones(uid=None, campos=None):
+    return _leer_tipado("transacciones", uid, campos)
+
+
+# ---------- Depósitos bancarios ----------
+# Cada depósito importado de un estado de cuenta deja una marca en
+# depositos_bancarios/{ID Depósito} (ver reportes.normalizar_estado_cuenta),
+# creada con create() en el mismo batch que sus transacciones: un depósito no
+# se registra dos veces aunque el archivo se importe de nuevo.
+DEPOSITOS_POR_BATCH = 166  # marca + Cobranza + Anticipo Cliente: hasta 3 escrituras por depósito
+
+
+def leer_depositos_importados(uid=None):
+    """IDs de los depósitos bancarios ya registrados (sin leer sus campos)."""
+    inicializar_firebase()
+    uid = uid or _uid()
+    if not uid:
+        return set()
+    ref = db.collection("usuarios").document(uid).collection("depositos_bancarios")
+    docs = resiliencia.leer("depositos_bancarios", lambda timeout: list(ref.select([]).stream(timeout=timeout)))
+    return {d.id for d in docs}
+
+
+def registrar_depositos(pagos, metodo_pago="Transferencia"):
+    """
+    Registra depósitos conciliados (ver reportes.repartir_depositos): el Abono como
+    "Cobranza" y el excedente como "Anticipo Cliente", en batches de hasta
+    DEPOSITOS_POR_BATCH depósitos. Los ya registrados se omiten.
+    Devuelve (depósitos registrados, depósitos omitidos).
+    """
+    ref_transacciones = _ref_write("transacciones")
+    ref_depositos = _ref_write("depositos_bancarios")
+    importados = leer_depositos_importados()
+    filas = [f for f in pagos.to_dict(orient="records") if f["ID Depósito"] not in importados]
+
+    registrados = 0
+    try:
+        for i in range(0, len(filas), DEPOSITOS_POR_BATCH):
+            lote = filas[i:i + DEPOSITOS_POR_BATCH]
+            batch = db.batch()
+            for f in lote:
+                fecha = f["Fecha"].isoformat() if hasattr(f["Fecha"], "isoformat") else str(f["Fecha"])
+                batch.create(ref_depositos.document(f["ID Depósito"]), {
+                    "Fecha": fecha, "Referencia": f["Referencia"], "Monto": float(f["Monto"]),
+                    "Cliente": f["Cliente"], "Importado": _ahora(),
+                })
+                for categoria, monto, descripcion in (
+                    ("Cobranza", f["Abono"], f"Depósito bancario de {f['Cliente']}: {f['Referencia']}"),
+                    ("Anticipo Cliente", f["Anticipo"], f"Anticipo por depósito bancario de {f['Cliente']}: {f['Referencia']}"),
+                ):
+                    if monto > 0.005:
+                        batch.set(ref_transacciones.document(), {
+                            "Fecha": fecha, "Descripción": descripcion, "Categoría": categoria, "Tipo": "Ingreso",
+                            "Monto": float(monto), "Cliente": f["Cliente"], "Método de pago": metodo_pago,
+                        })
+            resiliencia.escribir("registrar depósitos", batch.commit, idempotente=False)
+            registrados += len(lote)
+    except AlreadyExists:
+        raise ValueError("Otra sesión registró alguno de estos depósitos al mismo tiempo; "
+                         "vuelve a cargar el archivo para ver los pendientes.")
+    finally:
+        if registrados:
+            logging.info(f"{registrados} depósitos bancarios registrados.")
+            _clear_cache()
+    return registrados, len(pagos) - len(filas)
 
 
 def leer_cobranza():
@@ -206,12 +660,69 @@ def calcular_balance_contable():
 # ---------------------------
 # Productos
 # ---------------------------
+# Cada Clave reserva un documento en claves_productos; el producto y su reserva
+# se escriben en el mismo batch con create(), que falla si la Clave ya existe.
+# Los productos anteriores a las reservas (sin utils.deduplicar) se reservan al
+# dar de alta una Clave igual: ver _reservar_claves_anteriores.
+def _id_clave(clave):
+    """ID de documento válido para una Clave (sin '/', '.', '..' ni '__x__')."""
+    return "k_" + quote(str(clave), safe="")
+
+
+def _reservar_claves_anteriores(claves):
+    """
+    Crea la reserva que falte para las `claves` que ya tienen un producto
+    individual, así el create() del alta falla igual que con cualquier Clave
+    registrada. Con una sola Clave consulta esa reserva y ese producto; con
+    varias lee una vez los IDs de las reservas y las Claves de productos.
+    """
+    ref_claves = _ref_write("claves_productos")
+    ref_productos = _ref_write("productos")
+    claves = [str(c) for c in claves]
+    if len(claves) == 1:
+        ref_reserva = ref_claves.document(_id_clave(claves[0]))
+        if resiliencia.leer("reserva de Clave", ref_reserva.get).exists:
+            return
+        consulta = ref_productos.where("Clave", "==", claves[0]).limit(1)
+        docs = resiliencia.leer("productos por Clave", lambda timeout: list(consulta.stream(timeout=timeout)))
+        ids = {claves[0]: d.id for d in docs}
+    else:
+        reservadas = resiliencia.leer("reservas de Clave",
+                                      lambda timeout: list(ref_claves.select([]).stream(timeout=timeout)))
+        reservadas = {d.id for d in reservadas}
+        buscadas = set(claves)
+        ids = {c: i for c, i in _ids_por_clave(ref_productos).items()
+               if c in buscadas and _id_clave(c) not in reservadas}
+
+    for clave, producto_id in ids.items():
+        ref_reserva = ref_claves.document(_id_clave(clave))
+        try:
+            datos = {"Clave": clave, "producto_id": producto_id}
+            resiliencia.escribir("reservar Clave", lambda timeout: ref_reserva.create(datos, timeout=timeout),
+                                 idempotente=False)
+        except AlreadyExists:
+            pass  # otra sesión la reservó al mismo tiempo
+
+
 def guardar_producto(producto_dict):
+    """Devuelve False si la Clave ya estaba registrada."""
     for campo in ["Marca_Tipo", "Modelo", "Color", "Talla"]:
         producto_dict.setdefault(campo, "")
-    _ref_write("productos").add(producto_dict)
+
+    _reservar_claves_anteriores([producto_dict["Clave"]])
+    ref_producto = _ref_write("productos").document()
+    batch = db.batch()
+    batch.create(_ref_write("claves_productos").document(_id_clave(producto_dict["Clave"])),
+                 {"Clave": producto_dict["Clave"], "producto_id": ref_producto.id})
+    batch.set(ref_producto, producto_dict)
+    try:
+        resiliencia.escribir("alta productos", batch.commit, idempotente=False)
+    except AlreadyExists:
+        logging.info(f"Producto '{producto_dict['Clave']}' ya existe.")
+        return False
     logging.info("Producto guardado.")
     _clear_cache()
+    return True
 
 
 def actualizar_producto_por_clave(clave, campos_actualizados):
@@ -223,20 +734,88 @@ def actualizar_producto_por_clave(clave, campos_actualizados):
     if ref_user is None:
         return
 
-    q_user = ref_user.where("Clave", "==", clave).get()
+    if cola_escrituras.activa():
+        # El ID del documento se resuelve al enviar; los valores son absolutos,
+        # así que reintentar la operación no altera el resultado siempre que los
+        # cambios de una misma Clave se confirmen en orden (llave `orden`)
+        cola_escrituras.encolar(_uid(), "productos", "actualizar_clave", None,
+                                {"Clave": clave, "campos": campos_actualizados},
+                                f"{_uid()}/productos/{uuid.uuid4().hex}", orden=f"{_uid()}/productos/{clave}")
+        logging.info(f"Producto '{clave}' actualizado (pendiente de envío).")
+        _tras_escritura()
+        return
+
+    consulta = ref_user.where("Clave", "==", clave)
+    q_user = resiliencia.leer("productos por Clave", consulta.get)
     if q_user:
-        ref_user.document(q_user[0].id).update(campos_actualizados)
-        logging.info(f"Producto '{clave}' actualizado.")
-        _clear_cache()
+        ref = ref_user.document(q_user[0].id)
+        resiliencia.escribir("actualizar productos", lambda timeout: ref.update(campos_actualizados, timeout=timeout))
+    else:
+        id_familia = _familia_de_clave(_ref_write("claves_productos"), clave)
+        if not id_familia:
+            return
+        ref = _ref_write("familias_productos").document(id_familia)
+        rutas = _rutas_variante(clave, campos_actualizados)
+        resiliencia.escribir("actualizar variantes", lambda timeout: ref.update(rutas, timeout=timeout))
+    logging.info(f"Producto '{clave}' actualizado.")
+    _clear_cache()
+
+
+def _ids_por_clave(ref):
+    """{Clave: ID de documento} leyendo solo el campo Clave."""
+    ids = {}
+    for d in resiliencia.leer("IDs por Clave", lambda timeout: list(ref.select(["Clave"]).stream(timeout=timeout))):
+        ids.setdefault(str((d.to_dict() or {}).get("Clave")), d.id)
+    return ids
+
+
+def actualizar_productos_lote(cambios):
+    """
+    Aplica {clave: {campo: valor}} a muchos productos: una sola lectura de IDs
+    (solo el campo Clave), commits en batches de 500 y una sola invalidación de cache.
+    Devuelve (productos actualizados, segundos).
+    """
+    inicio = time.time()
+    ref = _ref_write("productos")
+    ids = _ids_por_clave(ref)
+
+    pendientes = [(ref.document(ids[str(c)]), campos) for c, campos in cambios.items() if str(c) in ids]
+    # Las variantes de una misma familia se juntan en una sola escritura
+    de_familias, n_variantes = _escrituras_variantes(
+        _uid(), {str(c): campos for c, campos in cambios.items() if str(c) not in ids})
+    actualizados = len(pendientes) + n_variantes
+    pendientes += de_familias
+    for i in range(0, len(pendientes), 500):
+        batch = db.batch()
+        for doc_ref, campos in pendientes[i:i + 500]:
+            batch.update(doc_ref, campos)
+        resiliencia.escribir("actualizar productos en lote", batch.commit)
+
+    segundos = time.time() - inicio
+    logging.info(f"{actualizados} productos actualizados en lote ({segundos:.2f} s).")
+    _clear_cache()
+    return actualizados, segundos
 
 
 def eliminar_producto_por_clave(clave):
     ref = _ref_write("productos")
-    q = ref.where("Clave", "==", clave).get()
+    ref_claves = _ref_write("claves_productos")
+    q = resiliencia.leer("productos por Clave", ref.where("Clave", "==", clave).get)
+    batch = db.batch()
     if q:
-        ref.document(q[0].id).delete()
-        logging.info(f"Producto '{clave}' eliminado.")
-        _clear_cache()
+        batch.delete(ref.document(q[0].id))
+        if len(q) == 1:  # la reserva se libera solo con el último documento de la Clave
+            batch.delete(ref_claves.document(_id_clave(clave)))
+    else:
+        id_familia = _familia_de_clave(ref_claves, clave)
+        if not id_familia:
+            return
+        batch.update(_ref_write("familias_productos").document(id_familia),
+                     {FieldPath("Variantes", str(clave)).to_api_repr(): firestore.DELETE_FIELD})
+        batch.delete(ref_claves.document(_id_clave(clave)))
+    resiliencia.escribir("eliminar productos", batch.commit)
+    logging.info(f"Producto '{clave}' eliminado.")
+    _clear_cache()
 
 
 def obtener_id_producto(clave):
@@ -245,13 +824,464 @@ def obtener_id_producto(clave):
     return fila.index[0] if not fila.empty else None
 
 
-def leer_productos():
-    columnas = [
-        "Clave", "Nombre", "Marca_Tipo", "Modelo", "Color", "Talla",
-        "Categoría", "Precio Unitario", "Costo Unitario", "Cantidad", "Descripción"
+def leer_productos(uid=None, campos=None, variantes=True):
+    """
+    Catálogo plano. Incluye un renglón por cada variante de las familias; con
+    variantes=False solo los productos individuales (ver leer_variantes).
+    """
+    productos = _leer_tipado("productos", uid, campos)
+    if not variantes:
+        return productos
+    familias = _leer_tipado("familias_productos", uid, campo_id="ID")
+    if familias.empty:
+        return productos
+    filas = _explotar_familias(familias)
+    if cola_escrituras.activa():
+        filas = _fusionar_pendientes("productos", uid or _uid(), list(filas.columns), filas)
+    filas = filas[list(productos.columns)]
+    return filas if productos.empty else pd.concat([productos, filas], ignore_index=True)
+
+
+def _existencia(datos):
+    campos = ["Cantidad", "Costo Unitario"]
+    valores = pd.to_numeric(pd.Series([datos.get(c) for c in campos], dtype=object), errors="coerce").fillna(0.0)
+    return dict(zip(campos, valores.astype(float).tolist()))
+
+
+def leer_existencias(claves, uid=None):
+    """
+    {Clave: {"Cantidad", "Costo Unitario"}} de `claves` leídos directo de Firestore,
+    sin el cache de lecturas: es lo que valida una venta contra la existencia.
+    Las variantes se buscan por su reserva en claves_productos. Con la escritura
+    diferida activa se usa el catálogo con los cambios que siguen en la cola, que
+    es lo más reciente que conoce esta caja. Las Claves inexistentes no aparecen.
+    """
+    uid = uid or _uid()
+    claves = list(dict.fromkeys(str(c) for c in claves))
+    if cola_escrituras.activa():
+        df = leer_productos(uid, campos=["Clave", "Cantidad", "Costo Unitario"])
+        df = df[df["Clave"].astype(str).isin(claves)].drop_duplicates(subset=["Clave"])
+        return {str(c): _existencia(f) for c, f in zip(df["Clave"], df.to_dict("records"))}
+
+    inicializar_firebase()
+    ref_usuario = db.collection("usuarios").document(uid)
+    existencias = {}
+    for i in range(0, len(claves), 30):  # límite del operador "in"
+        consulta = ref_usuario.collection("productos").where("Clave", "in", claves[i:i + 30]) \
+            .select(["Clave", "Cantidad", FieldPath("Costo Unitario").to_api_repr()])
+        for d in resiliencia.leer("existencias", lambda timeout: list(consulta.stream(timeout=timeout))):
+            datos = d.to_dict() or {}
+            existencias.setdefault(str(datos.get("Clave")), _existencia(datos))
+
+    por_familia = {}
+    ref_claves = ref_usuario.collection("claves_productos")
+    for clave in [c for c in claves if c not in existencias]:
+        reserva = resiliencia.leer("reserva de Clave", ref_claves.document(_id_clave(clave)).get)
+        if reserva.exists and reserva.get("familia_id"):
+            por_familia.setdefault(reserva.get("familia_id"), []).append(clave)
+    for id_familia, claves_familia in por_familia.items():
+        ref_familia = ref_usuario.collection("familias_productos").document(id_familia)
+        variantes = (resiliencia.leer("familia", ref_familia.get).to_dict() or {}).get("Variantes") or {}
+        for clave in claves_familia:
+            if clave in variantes:
+                existencias[clave] = _existencia(variantes[clave])
+    return existencias
+
+
+# ---------- Familias de variantes ----------
+# Un modelo con muchas combinaciones de Color y Talla se guarda como un solo
+# documento de familias_productos con el mapa Variantes {Clave: {...}}, en lugar
+# de un documento de productos por combinación. Cada Clave de variante se
+# reserva en claves_productos con el ID de su familia (familia_id), así que las
+# Claves siguen siendo únicas entre productos individuales y variantes.
+# Los cambios a una variante van a la ruta Variantes.<Clave>.<campo>.
+CAMPOS_FAMILIA = ["Nombre", "Marca_Tipo", "Modelo", "Categoría", "Descripción"]
+CAMPOS_VARIANTE = ["Color", "Talla", "Precio Unitario", "Costo Unitario", "Cantidad"]
+MAX_VARIANTES_LOTE = 499  # una reserva por variante más la familia, en un batch de 500
+
+
+def _explotar_familias(familias):
+    """Un renglón con el esquema de productos por cada variante de `familias`."""
+    esquema = _ESQUEMAS["productos"]
+    filas = [
+        {**{c: familia.get(c) for c in CAMPOS_FAMILIA}, **{c: variante.get(c) for c in CAMPOS_VARIANTE},
+         "Clave": clave}
+        for familia in familias.to_dict("records")
+        for clave, variante in (familia.get("Variantes") or {}).items()
     ]
-    uid = _uid()
-    df = _cached_read_union("productos", columnas, uid)
-    for col in ["Precio Unitario", "Costo Unitario", "Cantidad"]:
-        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0)
-    return df
\ No newline at end of file
+    df = pd.DataFrame(filas, columns=list(esquema))
+    for c, tipo in esquema.items():
+        if tipo == "num":
+            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0)
+    return df
+
+
+def leer_familias(uid=None, campos=None):
+    """Encabezados de las familias (ID, Nombre, Marca_Tipo, Modelo, ...), sin leer sus variantes."""
+    return _leer_tipado("familias_productos", uid, campos or ["ID", *CAMPOS_FAMILIA], campo_id="ID")
+
+
+def leer_variantes(id_familia, uid=None):
+    """Variantes de una sola familia como renglones del catálogo plano (un documento leído)."""
+    uid = uid or _uid()
+    if not uid or not id_familia:
+        return _explotar_familias(pd.DataFrame())
+    clave = (uid, f"familias_productos/{id_familia}", tuple(_ESQUEMAS["productos"]))
+    version = _cache.version(uid)
+    df = _cache.leer(clave)
+    _cache.registrar(df is not None)
+    if df is not None:
+        return df.copy()
+
+    completas = _cache.leer((uid, "familias_productos", tuple(_ESQUEMAS["familias_productos"])))
+    if completas is not None:
+        df = _explotar_familias(completas[completas["ID"] == id_familia])
+    else:
+        inicializar_firebase()
+        ref = db.collection("usuarios").document(uid).collection("familias_productos").document(id_familia)
+        doc = resiliencia.leer("familia", ref.get)
+        df = _explotar_familias(pd.DataFrame([doc.to_dict()] if doc.exists else []))
+    _cache.guardar(clave, version, df)
+    return df.copy()
+
+
+def _variantes_validas(variantes):
+    """{Clave: datos de la variante} con solo los campos de variante y números como float."""
+    if len(variantes) > MAX_VARIANTES_LOTE:
+        raise ValueError(f"Una familia admite hasta {MAX_VARIANTES_LOTE} variantes por operación.")
+    validas = {}
+    for clave, datos in variantes.items():
+        validas[str(clave)] = fila = {}
+        for c in CAMPOS_VARIANTE:
+            valor = datos.get(c)
+            if _ESQUEMAS["productos"][c] == "num":
+                valor = pd.to_numeric(valor, errors="coerce")
+                fila[c] = 0.0 if pd.isna(valor) else float(valor)
+            else:
+                fila[c] = "" if pd.isna(valor) else str(valor)
+    return validas
+
+
+def guardar_familia(familia_dict, variantes, id_familia=None):
+    """
+    Crea una familia con `variantes` ({Clave: {Color, Talla, Precio Unitario,
+    Costo Unitario, Cantidad}}) y la reserva de cada Clave en un solo batch.
+    Devuelve el ID de la familia, o None si alguna Clave ya estaba registrada.
+    """
+    variantes = _variantes_validas(variantes)
+    _reservar_claves_anteriores(variantes)
+    ref_familia = _ref_write("familias_productos").document(id_familia)
+    ref_claves = _ref_write("claves_productos")
+    batch = db.batch()
+    for clave in variantes:
+        batch.create(ref_claves.document(_id_clave(clave)), {"Clave": clave, "familia_id": ref_familia.id})
+    batch.set(ref_familia, {**{c: familia_dict.get(c, "") for c in CAMPOS_FAMILIA}, "Variantes": variantes})
+    try:
+        resiliencia.escribir("alta familias", batch.commit, idempotente=False)
+    except AlreadyExists:
+        logging.info(f"Alguna Clave de la familia '{familia_dict.get('Modelo')}' ya existe.")
+        return None
+    logging.info(f"Familia '{ref_familia.id}' guardada con {len(variantes)} variantes.")
+    _clear_cache()
+    return ref_familia.id
+
+
+def agregar_variantes(id_familia, variantes):
+    """Agrega variantes a una familia existente. Devuelve False si alguna Clave ya estaba registrada."""
+    variantes = _variantes_validas(variantes)
+    _reservar_claves_anteriores(variantes)
+    ref_claves = _ref_write("claves_productos")
+    batch = db.batch()
+    for clave in variantes:
+        batch.create(ref_claves.document(_id_clave(clave)), {"Clave": clave, "familia_id": id_familia})
+    batch.update(_ref_write("familias_productos").document(id_familia),
+                 {FieldPath("Variantes", clave).to_api_repr(): datos for clave, datos in variantes.items()})
+    try:
+        resiliencia.escribir("agregar variantes", batch.commit, idempotente=False)
+    except AlreadyExists:
+        logging.info(f"Alguna Clave nueva de la familia '{id_familia}' ya existe.")
+        return False
+    logging.info(f"{len(variantes)} variantes agregadas a la familia '{id_familia}'.")
+    _clear_cache()
+    return True
+
+
+def _familia_de_clave(ref_claves, clave):
+    """ID de la familia de `clave` según su reserva, o None si no es una variante."""
+    reserva = resiliencia.leer("reserva de Clave", ref_claves.document(_id_clave(clave)).get)
+    return (reserva.to_dict() or {}).get("familia_id") if reserva.exists else None
+
+
+def _familias_por_clave(ref_claves):
+    """{Clave: ID de familia} de todas las variantes, leyendo solo sus reservas."""
+    familias = {}
+    consulta = ref_claves.where("familia_id", ">", "").select(["Clave", "familia_id"])
+    for d in resiliencia.leer("reservas de variantes", lambda timeout: list(consulta.stream(timeout=timeout))):
+        datos = d.to_dict() or {}
+        familias[str(datos.get("Clave"))] = datos.get("familia_id")
+    return familias
+
+
+def _rutas_variante(clave, campos):
+    """
+    {campo: valor} de un producto como actualización del documento de su familia:
+    los campos de variante van a Variantes.<Clave>.<campo> y los demás cambian la
+    familia completa. Se omiten la Clave y los vacíos que agrega
+    actualizar_producto_por_clave, que borrarían datos de toda la familia.
+    """
+    rutas = {}
+    for campo, valor in campos.items():
+        if campo == "Clave" or (campo in ("Marca_Tipo", "Modelo", "Color", "Talla") and valor == ""):
+            continue
+        rutas[FieldPath("Variantes", str(clave), campo).to_api_repr() if campo in CAMPOS_VARIANTE else campo] = valor
+    return rutas
+
+
+def _escrituras_variantes(uid, cambios):
+    """
+    [(documento de familia, rutas)] para aplicar {Clave: campos} a variantes, una
+    escritura por familia, y cuántas variantes cubren. Ignora las Claves que no
+    son variantes.
+    """
+    if not cambios:
+        return [], 0
+    ref_usuario = db.collection("usuarios").document(uid)
+    familias = _familias_por_clave(ref_usuario.collection("claves_productos"))
+    rutas = {}
+    for clave, campos in cambios.items():
+        if str(clave) in familias:
+            rutas.setdefault(familias[str(clave)], {}).update(_rutas_variante(clave, campos))
+    n_variantes = sum(str(c) in familias for c in cambios)
+    ref = ref_usuario.collection("familias_productos")
+    return [(ref.document(id_familia), r) for id_familia, r in rutas.items()], n_variantes
+
+
+def _ruta_existencia(ref_usuario, clave):
+    """
+    (documento, campo) donde se guarda la Cantidad de `clave`: el producto
+    individual o la ruta de la variante en su familia. (None, None) si no existe.
+    """
+    consulta = ref_usuario.collection("productos").where("Clave", "==", clave).limit(1)
+    productos = resiliencia.leer("productos por Clave", lambda timeout: list(consulta.stream(timeout=timeout)))
+    if productos:
+        return productos[0].reference, "Cantidad"
+    id_familia = _familia_de_clave(ref_usuario.collection("claves_productos"), clave)
+    if not id_familia:
+        return None, None
+    return (ref_usuario.collection("familias_productos").document(id_familia),
+            FieldPath("Variantes", str(clave), "Cantidad").to_api_repr())
+
+
+# ---------- Metadatos ----------
+_rangos_fechas = {}  # (uid, colección) -> (versión de datos, (mínima, máxima))
+
+
+def rango_fechas(col, uid=None):
+    """(fecha mínima, fecha máxima) de `col`, recalculado solo cuando cambian los datos."""
+    uid = uid or _uid()
+    version = version_datos(uid)
+    with _cache_lock:
+        guardado = _rangos_fechas.get((uid, col))
+    if guardado and guardado[0] == version:
+        return guardado[1]
+
+    fechas = pd.to_datetime(_leer_tipado(col, uid, ["Fecha"])["Fecha"], errors="coerce").dropna()
+    rango = (fechas.min().date(), fechas.max().date()) if not fechas.empty else (None, None)
+    with _cache_lock:
+        _rangos_fechas[(uid, col)] = (version, rango)
+    return rango
+
+
+# ---------- Mapa del catálogo ----------
+# Clave -> datos de venta, para buscar un producto en O(1) (p. ej. al escanear).
+# Se reconstruye solo cuando cambia la versión de datos del usuario.
+CAMPOS_MAPA_CATALOGO = ["Clave", "Nombre", "Precio Unitario", "Cantidad"]
+_mapas_catalogo = {}  # uid -> (versión de datos, {Clave: {...}})
+
+
+def mapa_catalogo(uid=None):
+    """{Clave: {"Nombre", "Precio Unitario", "Cantidad"}}. El dict es compartido: no modificarlo."""
+    uid = uid or _uid()
+    version = version_datos(uid)
+    with _cache_lock:
+        guardado = _mapas_catalogo.get(uid)
+    if guardado and guardado[0] == version:
+        return guardado[1]
+
+    df = leer_productos(uid, campos=CAMPOS_MAPA_CATALOGO)
+    mapa = {
+        str(clave): {"Nombre": nombre, "Precio Unitario": float(precio), "Cantidad": float(cantidad)}
+        for clave, nombre, precio, cantidad in zip(df["Clave"], df["Nombre"], df["Precio Unitario"], df["Cantidad"])
+    }
+    with _cache_lock:
+        _mapas_catalogo[uid] = (version, mapa)
+    return mapa
+
+
+# ---------------------------
+# Movimientos de inventario (kardex)
+# ---------------------------
+# Cada cambio de existencia deja un documento compacto en movimientos_inventario.
+# Las fotos periódicas (existencias_snapshots) permiten calcular la existencia a
+# una fecha con la última foto más los movimientos posteriores.
+TIPOS_MOVIMIENTO = ["Venta", "Entrada", "Ajuste", "Cancelación"]
+
+
+def _ahora():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def _movimiento_dict(clave, tipo, cantidad, costo_unitario, existencia=None, referencia=""):
+    return {
+        "Fecha": _ahora(),
+        "Clave": str(clave),
+        "Tipo": tipo,
+        "Cantidad": float(cantidad),  # positivo entra, negativo sale
+        "Costo Unitario": float(costo_unitario or 0.0),
+        "Existencia": None if existencia is None else float(existencia),
+        "Referencia": referencia,
+    }
+
+
+def registrar_movimiento(clave, tipo, cantidad, costo_unitario, existencia=None, referencia=""):
+    movimiento = _movimiento_dict(clave, tipo, cantidad, costo_unitario, existencia, referencia)
+    _guardar_alta("movimientos_inventario", movimiento)
+    logging.info(f"Movimiento '{tipo}' de '{clave}' registrado.")
+
+
+def leer_kardex(clave, limite=50, despues_de=None):
+    """
+    Una página de movimientos de `clave`, del más reciente al más antiguo.
+    Devuelve (DataFrame, último documento) para pedir la página siguiente.
+    Requiere el índice compuesto (Clave ASC, Fecha DESC) en movimientos_inventario.
+    """
+    columnas = ["Fecha", "Tipo", "Cantidad", "Costo Unitario", "Existencia", "Referencia"]
+    inicializar_firebase()
+    ref = _ref_user("movimientos_inventario")
+    if ref is None:
+        return pd.DataFrame(columns=columnas), None
+
+    consulta = ref.where("Clave", "==", str(clave)).order_by("Fecha", direction=firestore.Query.DESCENDING)
+    if despues_de is not None:
+        consulta = consulta.start_after(despues_de)
+    docs = resiliencia.leer("kardex", lambda timeout: list(consulta.limit(limite).stream(timeout=timeout)))
+    df = pd.DataFrame([{c: (d.to_dict() or {}).get(c) for c in columnas} for d in docs], columns=columnas)
+    return df, (docs[-1] if len(docs) == limite else None)
+
+
+def tomar_snapshot_existencias(uid=None):
+    """Guarda una foto de existencia y costo de cada producto. Devuelve cuántos productos incluyó."""
+    uid = uid or _uid()
+    inicializar_firebase()
+    productos = leer_productos(uid, campos=["Clave", "Cantidad", "Costo Unitario"])
+    if productos.empty:
+        return 0
+    fecha = _ahora()
+    ref = db.collection("usuarios").document(uid).collection("existencias_snapshots")
+    filas = productos.to_dict(orient="records")
+    for inicio in range(0, len(filas), 500):
+        batch = db.batch()
+        for fila in filas[inicio:inicio + 500]:
+            clave = str(fila["Clave"])
+            batch.set(ref.document(f"{fecha}_{clave.replace('/', '_')}"), {
+                "Fecha": fecha, "Clave": clave,
+                "Cantidad": float(fila["Cantidad"]), "Costo Unitario": float(fila["Costo Unitario"]),
+            })
+        resiliencia.escribir("snapshot de existencias", batch.commit)
+    logging.info(f"Snapshot de existencias ({len(filas)} productos) guardado.")
+    return len(filas)
+
+
+def existencias_a_fecha(fecha, uid=None):
+    """
+    Existencia, costo y valor de inventario por producto al cierre de `fecha`:
+    última foto anterior a esa fecha más los movimientos registrados después de ella.
+    """
+    columnas = ["Clave", "Cantidad", "Costo Unitario", "Valor"]
+    uid = uid or _uid()
+    if not uid:
+        return pd.DataFrame(columns=columnas)
+    inicializar_firebase()
+    base = db.collection("usuarios").document(uid)
+    limite = f"{fecha.isoformat()}T23:59:59"
+
+    # 1. Última foto anterior al límite
+    ref_snap = base.collection("existencias_snapshots")
+    anterior = ref_snap.where("Fecha", "<=", limite).order_by("Fecha", direction=firestore.Query.DESCENDING)
+    ultima = resiliencia.leer("existencias_snapshots", lambda timeout: list(anterior.limit(1).stream(timeout=timeout)))
+    fecha_snap = ultima[0].to_dict()["Fecha"] if ultima else ""
+    if ultima:
+        del_dia = ref_snap.where("Fecha", "==", fecha_snap)
+        docs = resiliencia.leer("existencias_snapshots", lambda timeout: list(del_dia.stream(timeout=timeout)))
+        snap = pd.DataFrame([d.to_dict() for d in docs])
+        snap = snap[["Clave", "Cantidad", "Costo Unitario"]]
+    else:
+        snap = pd.DataFrame(columns=["Clave", "Cantidad", "Costo Unitario"])
+
+    # 2. Movimientos entre la foto y el límite
+    consulta = base.collection("movimientos_inventario").where("Fecha", "<=", limite)
+    if fecha_snap:
+        consulta = consulta.where("Fecha", ">", fecha_snap)
+    docs = resiliencia.leer("movimientos_inventario", lambda timeout: list(consulta.stream(timeout=timeout)))
+    movs = pd.DataFrame([d.to_dict() for d in docs],
+                        columns=["Fecha", "Clave", "Cantidad", "Costo Unitario"])
+
+    delta = movs.groupby("Clave")["Cantidad"].sum()
+    costo_mov = movs.sort_values("Fecha").groupby("Clave")["Costo Unitario"].last()
+
+    snap = snap.set_index("Clave")
+    claves = snap.index.union(delta.index)
+    resultado = pd.DataFrame(index=claves)
+    resultado.index.name = "Clave"
+    resultado["Cantidad"] = (snap["Cantidad"].reindex(claves, fill_value=0.0)
+                             + delta.reindex(claves, fill_value=0.0)).astype(float)
+    resultado["Costo Unitario"] = costo_mov.reindex(claves).fillna(snap["Costo Unitario"].reindex(claves)).fillna(0.0)
+    resultado["Valor"] = resultado["Cantidad"] * resultado["Costo Unitario"]
+    return resultado.reset_index()[columnas]
+
+
+def aplicar_ajustes_inventario(ajustes, referencia="Conteo físico"):
+    """
+    Ajusta la existencia de varios productos a la cantidad contada. `ajustes` es un
+    DataFrame con Clave, Contado, Diferencia y Costo Unitario. Cada producto se
+    actualiza en el mismo batch que su movimiento de "Ajuste", así que ambos se
+    confirman juntos. Devuelve (productos ajustados, segundos).
+    """
+    inicio = time.time()
+    ref_productos = _ref_write("productos")
+    ref_familias = _ref_write("familias_productos")
+    ref_movimientos = _ref_write("movimientos_inventario")
+    # calcular_diferencias_conteo compara las Claves sin espacios a los lados: se
+    # buscan igual aquí y se escribe con la Clave tal como está guardada
+    ids, familias = {}, {}
+    for clave, doc_id in _ids_por_clave(ref_productos).items():
+        ids.setdefault(clave.strip(), (clave, doc_id))
+    for clave, id_familia in _familias_por_clave(_ref_write("claves_productos")).items():
+        familias.setdefault(clave.strip(), (clave, id_familia))
+
+    filas = [f for f in ajustes.to_dict(orient="records")
+             if str(f["Clave"]).strip() in ids or str(f["Clave"]).strip() in familias]
+    for i in range(0, len(filas), 250):  # 2 escrituras por producto, 500 por batch
+        batch = db.batch()
+        variantes = {}  # ID de familia -> rutas de Cantidad de sus variantes en este batch
+        for f in filas[i:i + 250]:
+            clave = str(f["Clave"]).strip()
+            if clave in ids:
+                clave, doc_id = ids[clave]
+                batch.update(ref_productos.document(doc_id), {"Cantidad": float(f["Contado"])})
+            else:
+                clave, id_familia = familias[clave]
+                variantes.setdefault(id_familia, {})[
+                    FieldPath("Variantes", clave, "Cantidad").to_api_repr()] = float(f["Contado"])
+            batch.set(ref_movimientos.document(), _movimiento_dict(
+                clave, "Ajuste", f["Diferencia"], f["Costo Unitario"],
+                existencia=f["Contado"], referencia=referencia
+            ))
+        for id_familia, rutas in variantes.items():
+            batch.update(ref_familias.document(id_familia), rutas)
+        resiliencia.escribir("ajustes de inventario", batch.commit)
+
+    segundos = time.time() - inicio
+    logging.info(f"{len(filas)} ajustes de inventario aplicados ({segundos:.2f} s).")
+    _clear_cache()
+    return len(filas), segundos
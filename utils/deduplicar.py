@@ -0,0 +1,101 @@
+# utils/deduplicar.py
+"""
+Limpieza única de Claves de producto duplicadas y alta de las reservas en
+claves_productos para los productos existentes (ver db.guardar_producto).
+
+De cada Clave repetida se conserva el documento con más campos llenos (luego el
+de mayor Cantidad) y se eliminan los demás. Sin --aplicar solo muestra el plan:
+
+    python -m utils.deduplicar <uid>
+    python -m utils.deduplicar <uid> --aplicar
+"""
+import sys
+import time
+import logging
+import pandas as pd
+from utils import db
+
+TAM_LOTE = 500
+
+
+def _refs(uid):
+    db.inicializar_firebase()
+    usuario = db.db.collection("usuarios").document(uid)
+    return usuario.collection("productos"), usuario.collection("claves_productos")
+
+
+def analizar_duplicados(uid):
+    """
+    Plan de deduplicación: una fila por documento de producto con Clave, ID,
+    Nombre, Cantidad y Acción ("Conservar" o "Eliminar").
+    """
+    ref_productos, _ = _refs(uid)
+    filas = []
+    for d in ref_productos.stream():
+        datos = d.to_dict() or {}
+        filas.append({
+            "Clave": str(datos.get("Clave") or ""),
+            "ID": d.id,
+            "Nombre": datos.get("Nombre", ""),
+            "Cantidad": pd.to_numeric(datos.get("Cantidad"), errors="coerce"),
+            "Campos llenos": sum(v not in (None, "") for v in datos.values()),
+        })
+    plan = pd.DataFrame(filas, columns=["Clave", "ID", "Nombre", "Cantidad", "Campos llenos"])
+    if plan.empty:
+        return plan.assign(Acción=pd.Series(dtype=str))
+
+    plan = plan.sort_values(["Clave", "Campos llenos", "Cantidad", "ID"],
+                            ascending=[True, False, False, True], na_position="last")
+    # Los productos sin Clave no se consideran duplicados entre sí
+    repetido = plan.duplicated("Clave", keep="first") & (plan["Clave"] != "")
+    plan["Acción"] = repetido.map({False: "Conservar", True: "Eliminar"})
+    return plan.drop(columns="Campos llenos").reset_index(drop=True)
+
+
+def aplicar_deduplicacion(uid, plan=None):
+    """
+    Elimina los documentos marcados en el plan y reserva en claves_productos la
+    Clave de cada producto conservado. Es idempotente. Devuelve un resumen.
+    """
+    inicio = time.time()
+    plan = analizar_duplicados(uid) if plan is None else plan
+    ref_productos, ref_claves = _refs(uid)
+
+    operaciones = [("eliminar", f["ID"], None) for f in plan[plan["Acción"] == "Eliminar"].to_dict("records")]
+    operaciones += [("reservar", db._id_clave(f["Clave"]), {"Clave": f["Clave"], "producto_id": f["ID"]})
+                    for f in plan[(plan["Acción"] == "Conservar") & (plan["Clave"] != "")].to_dict("records")]
+
+    for i in range(0, len(operaciones), TAM_LOTE):
+        batch = db.db.batch()
+        for tipo, doc_id, datos in operaciones[i:i + TAM_LOTE]:
+            if tipo == "eliminar":
+                batch.delete(ref_productos.document(doc_id))
+            else:
+                batch.set(ref_claves.document(doc_id), datos)
+        batch.commit()
+
+    db.invalidar_cache(uid)
+    resumen = {
+        "uid": uid,
+        "claves_duplicadas": int(plan.loc[plan["Acción"] == "Eliminar", "Clave"].nunique()),
+        "documentos_eliminados": int((plan["Acción"] == "Eliminar").sum()),
+        "claves_reservadas": int(((plan["Acción"] == "Conservar") & (plan["Clave"] != "")).sum()),
+        "segundos": round(time.time() - inicio, 2),
+    }
+    logging.info(f"Deduplicación de '{uid}': {resumen}")
+    return resumen
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] != "--aplicar"):
+        print("Uso: python -m utils.deduplicar <uid> [--aplicar]")
+        sys.exit(1)
+    uid_arg = sys.argv[1]
+    plan_uid = analizar_duplicados(uid_arg)
+    repetidas = plan_uid[plan_uid["Clave"].isin(plan_uid.loc[plan_uid["Acción"] == "Eliminar", "Clave"])]
+    print(repetidas.to_string(index=False) if not repetidas.empty else "No hay Claves duplicadas.")
+    if len(sys.argv) == 3:
+        print(aplicar_deduplicacion(uid_arg, plan_uid))
+    else:
+        print("\nSolo análisis. Agrega --aplicar para eliminar duplicados y reservar las Claves.")
@@ -0,0 +1,243 @@
+# utils/devoluciones.py
+"""
+Devoluciones y cancelaciones de ventas por Folio.
+
+Todo se escribe en un solo batch atómico:
+- renglones de venta en negativo (Tipo de venta "Devolución", mismo Folio);
+- transacciones que compensan las de la venta (misma Categoría y Folio, Monto
+  negativo): devolución de contado, reducción del crédito y anticipo restituido;
+- el regreso de la existencia con Increment y su movimiento "Cancelación" en el kardex;
+- el registro devoluciones/{Folio}-{n}. Se crea con create(), así que si dos cajas
+  devuelven la misma venta a la vez, una de las dos falla completa.
+
+Como los importes van en negativo, los saldos, el balance y los márgenes se
+netean solos. Después del batch se corrigen las lecturas en cache y los saldos
+precalculados con lo escrito, sin volver a leer las colecciones.
+"""
+import datetime
+import logging
+import pandas as pd
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+from utils import db, scheduler, cola_escrituras, resiliencia
+
+EPSILON = 0.005
+COLUMNAS_RESUMEN = ["Clave del Producto", "Producto", "Precio Unitario", "Vendido", "Devuelto", "Disponible"]
+# (campo de la venta, Categoría, Tipo, Método de pago, descripción) de cada transacción compensatoria
+REVERSOS = [
+    ("Monto Contado", "Ventas", "Ingreso", None, "Devolución de contado de la venta {folio} a {cliente}"),
+    ("Anticipo Aplicado", "Anticipo Aplicado", "Egreso", "Anticipo", "Anticipo restituido por devolución de la venta {folio}"),
+    ("Monto Crédito", "Ventas a Crédito", "Ingreso", "Crédito", "Reducción de crédito por devolución de la venta {folio}"),
+]
+
+
+def _num(serie):
+    return pd.to_numeric(serie, errors="coerce").fillna(0.0)
+
+
+def resumen_folio(folio, uid=None):
+    """
+    Lo vendido en `folio` por Clave, lo ya devuelto y lo que aún se puede devolver.
+    Devuelve (resumen, ventas_df, transacciones_df) del folio.
+    """
+    ventas, transacciones = db.buscar_folio(folio, uid)
+    if ventas.empty:
+        return pd.DataFrame(columns=COLUMNAS_RESUMEN), ventas, transacciones
+
+    ventas = ventas.assign(**{"Clave del Producto": ventas["Clave del Producto"].astype(str),
+                              "Cantidad": _num(ventas["Cantidad"])})
+    es_devolucion = ventas["Tipo de venta"] == "Devolución"
+    resumen = ventas[~es_devolucion].groupby("Clave del Producto", sort=False).agg(
+        Producto=("Producto", "first"), **{"Precio Unitario": ("Precio Unitario", "first")},
+        Vendido=("Cantidad", "sum"),
+    )
+    resumen["Devuelto"] = -ventas[es_devolucion].groupby("Clave del Producto")["Cantidad"].sum() \
+        .reindex(resumen.index, fill_value=0.0)
+    resumen["Disponible"] = resumen["Vendido"] - resumen["Devuelto"]
+    return resumen.reset_index()[COLUMNAS_RESUMEN], ventas, transacciones
+
+
+def _reverso_importes(ventas, importe, completa):
+    """Cuánto se revierte de crédito, anticipo y contado (positivo)."""
+    restante = {campo: max(0.0, float(_num(ventas[campo]).sum())) for campo, *_ in REVERSOS}
+    if completa:
+        return restante
+    # Devolución parcial: primero se reduce el crédito, luego el anticipo y al final el contado
+    reverso, pendiente = {}, importe
+    for campo in ("Monto Crédito", "Anticipo Aplicado", "Monto Contado"):
+        reverso[campo] = min(restante[campo], pendiente)
+        pendiente -= reverso[campo]
+    return reverso
+
+
+def devolver_venta(folio, cantidades=None, motivo="", fecha=None, uid=None):
+    """
+    Devuelve `cantidades` ({Clave: cantidad}) de la venta `folio`; sin cantidades
+    cancela todo lo que queda de la venta. Lanza ValueError si no hay nada válido
+    que devolver. Devuelve un resumen de lo registrado.
+    """
+    uid = uid or db._uid()
+    fecha = (fecha or datetime.date.today()).isoformat()
+    resumen, ventas, transacciones = resumen_folio(folio, uid)
+    if resumen.empty:
+        pendiente = " Si se acaba de registrar, espera a que se envíe a Firestore." if cola_escrituras.activa() else ""
+        raise ValueError(f"No existe la venta {folio}.{pendiente}")
+
+    disponible = resumen.set_index("Clave del Producto")["Disponible"]
+    if cantidades is None:
+        cantidades = disponible[disponible > 0].to_dict()
+    cantidades = {str(clave): float(cantidad) for clave, cantidad in cantidades.items() if cantidad}
+    if not cantidades:
+        raise ValueError(f"No hay productos por devolver en la venta {folio}.")
+    for clave, cantidad in cantidades.items():
+        if clave not in disponible.index:
+            raise ValueError(f"La clave '{clave}' no está en la venta {folio}.")
+        if cantidad < 0 or cantidad > disponible[clave] + 1e-9:
+            raise ValueError(f"De '{clave}' solo se pueden devolver {disponible[clave]:g} unidades.")
+
+    originales = ventas[ventas["Tipo de venta"] != "Devolución"]
+    primera = originales.iloc[0]
+    cliente = primera["Cliente"]
+    total_venta = float(_num(originales["Total"]).sum())
+    descuento_venta = float(_num(originales["Descuento"]).sum())
+    costos = _num(originales["Costo Unitario"]).groupby(originales["Clave del Producto"]).first()
+    completa = all(cantidades.get(c, 0.0) >= d - 1e-9 for c, d in disponible.items() if d > 0)
+
+    # Renglones de venta en negativo, con su parte del descuento
+    renglones = []
+    for clave, cantidad in cantidades.items():
+        fila = resumen.loc[resumen["Clave del Producto"] == clave].iloc[0]
+        bruto = round(cantidad * float(fila["Precio Unitario"]), 2)
+        descuento = round(descuento_venta * bruto / total_venta, 2) if total_venta else 0.0
+        renglones.append((clave, cantidad, fila, bruto, descuento))
+    importe = round(sum(bruto - descuento for *_, bruto, descuento in renglones), 2)
+    reverso = {campo: round(monto, 2) for campo, monto in _reverso_importes(ventas, importe, completa).items()}
+
+    ref_usuario = db.db.collection("usuarios").document(uid)
+    batch = db.db.batch()
+    nuevos = {"ventas": [], "transacciones": []}
+    incrementos, sin_inventario = {}, []
+
+    for i, (clave, cantidad, fila, bruto, descuento) in enumerate(renglones):
+        venta = {
+            "Fecha": fecha, "Cliente": cliente, "Producto": fila["Producto"], "Clave del Producto": clave,
+            "Cantidad": -cantidad, "Precio Unitario": float(fila["Precio Unitario"]),
+            "Total": -bruto, "Descuento": -descuento,
+            # Los importes de la venta van completos en el primer renglón, como al registrarla
+            "Importe Neto": -importe if i == 0 else 0.0,
+            "Monto Crédito": -reverso["Monto Crédito"] if i == 0 else 0.0,
+            "Monto Contado": -reverso["Monto Contado"] if i == 0 else 0.0,
+            "Anticipo Aplicado": -reverso["Anticipo Aplicado"] if i == 0 else 0.0,
+            "Método de pago": primera["Método de pago"] if i == 0 else "N/A",
+            "Tipo de venta": "Devolución", "Folio": folio,
+            "Costo Unitario": float(costos.get(clave, 0.0)),
+        }
+        ref = ref_usuario.collection("ventas").document()
+        batch.set(ref, venta)
+        nuevos["ventas"].append((ref.id, venta))
+
+        ref_existencia, campo_existencia = db._ruta_existencia(ref_usuario, clave)
+        if ref_existencia is None:
+            sin_inventario.append(clave)
+            continue
+        batch.update(ref_existencia, {campo_existencia: firestore.Increment(cantidad)})
+        batch.set(ref_usuario.collection("movimientos_inventario").document(), db._movimiento_dict(
+            clave, "Cancelación", cantidad, venta["Costo Unitario"], referencia=f"Devolución {folio} de {cliente}"
+        ))
+        incrementos[clave] = cantidad
+
+    # Transacciones compensatorias de las que la conciliación exige a la venta
+    # (ver reportes.detectar_transacciones_faltantes)
+    for campo, categoria, tipo, metodo, descripcion in REVERSOS:
+        if reverso[campo] <= EPSILON:
+            continue
+        if metodo is None:
+            metodos = transacciones.loc[transacciones["Categoría"] == categoria, "Método de pago"]
+            metodo = metodos.iloc[0] if not metodos.empty else primera["Método de pago"]
+        transaccion = {
+            "Fecha": fecha, "Descripción": descripcion.format(folio=folio, cliente=cliente),
+            "Categoría": categoria, "Tipo": tipo, "Monto": -reverso[campo], "Cliente": cliente,
+            "Método de pago": metodo, "Folio": folio,
+        }
+        ref = ref_usuario.collection("transacciones").document()
+        batch.set(ref, transaccion)
+        nuevos["transacciones"].append((ref.id, transaccion))
+
+    ref_devoluciones = ref_usuario.collection("devoluciones")
+    consulta = ref_devoluciones.where("Folio", "==", folio)
+    numero = len(resiliencia.leer("devoluciones", lambda timeout: list(consulta.stream(timeout=timeout)))) + 1
+    registro = f"{folio}-{numero:03d}"
+    batch.create(ref_devoluciones.document(registro), {
+        "Folio": folio, "Fecha": fecha, "Registrado": db._ahora(), "Cliente": cliente,
+        "Motivo": motivo, "Cancelación total": completa, "Cantidades": cantidades, "Importe": importe,
+        "Crédito": reverso["Monto Crédito"], "Anticipo": reverso["Anticipo Aplicado"],
+        "Contado": reverso["Monto Contado"],
+    })
+
+    # Se avanza la versión antes del batch para que ninguna lectura en curso guarde
+    # en cache datos que luego se corregirían dos veces
+    version = db.version_datos(uid)
+    db.aplicar_en_cache(uid, lambda col, columnas, df: df)
+    try:
+        # Increment y create: solo se reintenta si Firestore no aplicó nada
+        resiliencia.escribir("devolución", batch.commit, idempotente=False)
+    except AlreadyExists:
+        raise ValueError(f"Se registró otra devolución de la venta {folio} al mismo tiempo; revisa e intenta de nuevo.")
+    except Exception:
+        # Con un plazo vencido u otro error no se sabe si el batch se aplicó: se
+        # descartan las lecturas en cache para que la siguiente traiga lo que quedó
+        db.invalidar_cache(uid)
+        raise
+
+    _actualizar_caches(uid, version, cliente, nuevos, incrementos, reverso)
+    resultado = {
+        "folio": folio, "registro": registro, "completa": completa, "renglones": len(renglones),
+        "importe": importe, "credito": reverso["Monto Crédito"], "anticipo": reverso["Anticipo Aplicado"],
+        "contado": reverso["Monto Contado"], "sin_inventario": sin_inventario,
+    }
+    logging.info(f"Devolución de la venta {folio} ('{uid}'): {resultado}")
+    return resultado
+
+
+# ---------------------------
+# Caches y resultados precalculados
+# ---------------------------
+def _actualizar_caches(uid, version, cliente, nuevos, incrementos, reverso):
+    """Agrega lo escrito a las lecturas en cache y a los saldos precalculados."""
+    def parchar(col, columnas, df):
+        if col in nuevos:
+            esquema = db._ESQUEMAS[col]
+            filas = pd.DataFrame([{c: datos.get(c) if c in esquema else doc_id for c in columnas}
+                                  for doc_id, datos in nuevos[col]], columns=list(columnas))
+            return pd.concat([df, filas], ignore_index=True) if not filas.empty else df
+        if col == "productos":
+            if "Cantidad" not in columnas:
+                return df
+            if "Clave" not in columnas:
+                return None
+            df = df.copy()
+            df["Cantidad"] = _num(df["Cantidad"]) + df["Clave"].astype(str).map(incrementos).fillna(0.0)
+            return df
+        return None  # kardex y demás colecciones: se vuelven a leer
+
+    db.aplicar_en_cache(uid, parchar)
+
+    def parchar_saldos(saldos):
+        # El anticipo restituido depende de anticipos que el resultado no guarda: se recalcula
+        if saldos is None or reverso["Anticipo Aplicado"] > EPSILON:
+            return None
+        if reverso["Monto Crédito"] <= EPSILON:
+            return saldos
+        if not (saldos["Cliente"] == cliente).any():
+            return None
+        saldos = saldos.copy()
+        fila = saldos["Cliente"] == cliente
+        saldos.loc[fila, "Crédito Otorgado"] -= reverso["Monto Crédito"]
+        saldos.loc[fila, "Saldo Pendiente"] -= reverso["Monto Crédito"]
+        saldos.loc[fila, "Saldo Pendiente Display"] = saldos.loc[fila, "Saldo Pendiente"].clip(lower=0)
+        return saldos
+
+    # Los renglones en negativo no generan transacciones esperadas: la conciliación no cambia
+    scheduler.actualizar_resultado(uid, "saldos", parchar_saldos, version, version + 2)
+    scheduler.actualizar_resultado(uid, "transacciones_faltantes", lambda faltantes: faltantes,
+                                   version, version + 2)
@@ -0,0 +1,121 @@
+# utils/familias.py
+"""
+Conversión única de productos individuales a familias de variantes (ver
+"Familias de variantes" en utils/db.py).
+
+Los productos con el mismo Marca_Tipo y Modelo (no vacío) se juntan en un solo
+documento de familias_productos cuando son al menos MIN_VARIANTES. Cada Clave
+conserva su reserva, ahora apuntando a la familia, y se eliminan los documentos
+individuales. Conviene correr antes utils.deduplicar: las Claves repetidas se
+dejan fuera. Sin --aplicar solo muestra el plan:
+
+    python -m utils.familias <uid>
+    python -m utils.familias <uid> --aplicar
+"""
+import sys
+import time
+import logging
+from urllib.parse import quote
+import pandas as pd
+from google.cloud.firestore_v1.field_path import FieldPath
+from utils import db
+
+MIN_VARIANTES = 2
+
+
+def _refs(uid):
+    db.inicializar_firebase()
+    usuario = db.db.collection("usuarios").document(uid)
+    return usuario.collection("productos"), usuario.collection("claves_productos"), \
+        usuario.collection("familias_productos")
+
+
+def _id_familia(marca_tipo, modelo):
+    """ID de documento estable para un Marca_Tipo y Modelo."""
+    return "f_" + quote(f"{marca_tipo}|{modelo}", safe="")
+
+
+def analizar_familias(uid):
+    """
+    Plan de conversión: una fila por producto que pasará a ser variante, con
+    Familia (ID del documento), Marca_Tipo, Modelo, Clave, ID y los demás campos
+    del producto.
+    """
+    columnas = ["Familia", "Marca_Tipo", "Modelo", "Clave", "ID", "Nombre", "Color", "Talla"]
+    columnas += [c for c in db._ESQUEMAS["productos"] if c not in columnas]
+    ref_productos, _, _ = _refs(uid)
+    filas = [{"ID": d.id, **{c: (d.to_dict() or {}).get(c) for c in db._ESQUEMAS["productos"]}}
+             for d in ref_productos.stream()]
+    productos = pd.DataFrame(filas, columns=["ID", *db._ESQUEMAS["productos"]])
+    for c in ["Clave", "Marca_Tipo", "Modelo"]:
+        productos[c] = productos[c].fillna("").astype(str).str.strip()
+
+    candidatos = productos[(productos["Modelo"] != "") & (productos["Clave"] != "")]
+    candidatos = candidatos[~candidatos["Clave"].duplicated(keep=False)]
+    tamanos = candidatos.groupby(["Marca_Tipo", "Modelo"])["Clave"].transform("size")
+    plan = candidatos[tamanos >= MIN_VARIANTES].copy()
+    if plan.empty:
+        return pd.DataFrame(columns=columnas)
+
+    plan["Familia"] = [_id_familia(m, mo) for m, mo in zip(plan["Marca_Tipo"], plan["Modelo"])]
+    return plan.sort_values(["Familia", "Clave"])[columnas].reset_index(drop=True)
+
+
+def aplicar_familias(uid, plan=None):
+    """
+    Crea cada familia del plan, reasigna las reservas de sus Claves y elimina los
+    productos individuales. Cada familia se escribe en sus propios batches. Es
+    idempotente. Devuelve un resumen.
+    """
+    inicio = time.time()
+    plan = analizar_familias(uid) if plan is None else plan
+    ref_productos, ref_claves, ref_familias = _refs(uid)
+    por_lote = (db.MAX_VARIANTES_LOTE + 1) // 3  # 3 escrituras por variante
+
+    for id_familia, grupo in plan.groupby("Familia", sort=False):
+        # Los datos comunes se toman del primer producto del modelo; si la familia
+        # ya existe (una corrida anterior) solo se le agregan variantes
+        primero = grupo.iloc[0]
+        existe = ref_familias.document(id_familia).get().exists
+        filas = grupo.to_dict("records")
+        for i in range(0, len(filas), por_lote):
+            lote = filas[i:i + por_lote]
+            variantes = db._variantes_validas({f["Clave"]: f for f in lote})
+            batch = db.db.batch()
+            if i == 0 and not existe:
+                batch.set(ref_familias.document(id_familia), {
+                    **{c: primero[c] if pd.notna(primero[c]) else "" for c in db.CAMPOS_FAMILIA},
+                    "Variantes": variantes,
+                })
+            else:
+                batch.update(ref_familias.document(id_familia),
+                             {FieldPath("Variantes", c).to_api_repr(): v for c, v in variantes.items()})
+            for f in lote:
+                batch.set(ref_claves.document(db._id_clave(f["Clave"])), {"Clave": f["Clave"], "familia_id": id_familia})
+                batch.delete(ref_productos.document(f["ID"]))
+            batch.commit()
+
+    db.invalidar_cache(uid)
+    resumen = {
+        "uid": uid,
+        "familias": int(plan["Familia"].nunique()),
+        "productos_convertidos": len(plan),
+        "segundos": round(time.time() - inicio, 2),
+    }
+    logging.info(f"Familias de variantes de '{uid}': {resumen}")
+    return resumen
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] != "--aplicar"):
+        print("Uso: python -m utils.familias <uid> [--aplicar]")
+        sys.exit(1)
+    uid_arg = sys.argv[1]
+    plan_uid = analizar_familias(uid_arg)
+    print(plan_uid[["Familia", "Clave", "Nombre", "Color", "Talla"]].to_string(index=False)
+          if not plan_uid.empty else "No hay modelos con varios productos para agrupar.")
+    if len(sys.argv) == 3:
+        print(aplicar_familias(uid_arg, plan_uid))
+    else:
+        print("\nSolo análisis. Agrega --aplicar para crear las familias.")
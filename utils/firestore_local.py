@@ -0,0 +1,288 @@
+# utils/firestore_local.py
+"""
+Sustituto en memoria de Firestore para pruebas de carga y desarrollo sin red.
+
+Implementa solo lo que usa utils/db: colecciones anidadas, add/set/update/delete,
+where/order_by/limit/start_after/select, Increment, DELETE_FIELD, rutas de campo
+anidadas en update ("Variantes.`CLAVE`.Cantidad"), batches y listado de subcolecciones.
+Se activa con MINEGOCIO_FIRESTORE_LOCAL=1; MINEGOCIO_FIRESTORE_LOCAL_LATENCIA_MS
+agrega una latencia fija por llamada para simular la red. El argumento `timeout`
+de las llamadas se acepta por compatibilidad y se ignora.
+"""
+import os
+import copy
+import time
+import uuid
+import operator
+import threading
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1.field_path import parse_field_path
+from google.cloud.firestore_v1.transforms import Increment, DELETE_FIELD
+
+_OPERADORES = {
+    "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+    ">": operator.gt, ">=": operator.ge,
+    "in": lambda a, b: a in b, "array_contains": lambda a, b: b in (a or []),
+}
+
+
+def _latencia():
+    ms = float(os.getenv("MINEGOCIO_FIRESTORE_LOCAL_LATENCIA_MS", "0") or 0)
+    if ms > 0:
+        time.sleep(ms / 1000)
+
+
+def _campo(path):
+    return path.replace("`", "")
+
+
+class Snapshot:
+    def __init__(self, ref, datos):
+        self.reference = ref
+        self.id = ref.id
+        self._datos = datos
+        self.exists = datos is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._datos) if self._datos is not None else None
+
+    def get(self, campo):
+        return (self._datos or {}).get(campo)
+
+
+class DocumentoLocal:
+    def __init__(self, cliente, ruta):
+        self._cliente = cliente
+        self._ruta = ruta
+        self.id = ruta[-1]
+        self.path = "/".join(ruta)
+
+    def collection(self, nombre):
+        return ColeccionLocal(self._cliente, self._ruta + (nombre,))
+
+    def collections(self):
+        _latencia()
+        return [ColeccionLocal(self._cliente, self._ruta + (n,)) for n in self._cliente._subcolecciones(self._ruta)]
+
+    def get(self, transaction=None, timeout=None):
+        _latencia()
+        with self._cliente._lock:
+            return Snapshot(self, copy.deepcopy(self._cliente._docs.get(self._ruta)))
+
+    def set(self, datos, merge=False, timeout=None):
+        _latencia()
+        self._cliente._escribir(self._ruta, datos, merge=merge)
+
+    def create(self, datos, timeout=None):
+        _latencia()
+        self._cliente._crear(self._ruta, datos)
+
+    def update(self, datos, timeout=None):
+        _latencia()
+        self._cliente._actualizar(self._ruta, datos)
+
+    def delete(self, timeout=None):
+        _latencia()
+        with self._cliente._lock:
+            self._cliente._docs.pop(self._ruta, None)
+
+
+class ConsultaLocal:
+    def __init__(self, cliente, ruta, filtros=(), orden=(), limite=None, despues=None, campos=None, grupo=False):
+        self._cliente = cliente
+        self._ruta = ruta
+        self._grupo = grupo  # collection_group: todas las colecciones con ese nombre
+        self._filtros = filtros
+        self._orden = orden
+        self._limite = limite
+        self._despues = despues
+        self._campos = campos
+
+    def _copia(self, **cambios):
+        datos = dict(filtros=self._filtros, orden=self._orden, limite=self._limite,
+                     despues=self._despues, campos=self._campos, grupo=self._grupo)
+        datos.update(cambios)
+        return ConsultaLocal(self._cliente, self._ruta, **datos)
+
+    def where(self, campo=None, op=None, valor=None, filter=None):
+        if filter is not None:
+            campo, op, valor = filter.field_path, filter.op_string, filter.value
+        return self._copia(filtros=self._filtros + ((_campo(campo), op, valor),))
+
+    def order_by(self, campo, direction="ASCENDING"):
+        return self._copia(orden=self._orden + ((_campo(campo), direction == "DESCENDING"),))
+
+    def limit(self, n):
+        return self._copia(limite=n)
+
+    def start_after(self, snapshot):
+        return self._copia(despues=snapshot)
+
+    def select(self, campos):
+        return self._copia(campos=[_campo(c) for c in campos])
+
+    @staticmethod
+    def _valor(doc_id, datos, campo):
+        return doc_id if campo == "__name__" else datos.get(campo)
+
+    def _rutas(self):
+        if self._grupo:
+            return [r for r in self._cliente._docs if len(r) % 2 == 0 and r[-2] == self._ruta[-1]]
+        prefijo = len(self._ruta) + 1
+        return [r for r in self._cliente._docs if len(r) == prefijo and r[:-1] == self._ruta]
+
+    def _resultados(self):
+        _latencia()
+        with self._cliente._lock:
+            rutas = {r[-1] if not self._grupo else "/".join(r): r for r in self._rutas()}
+            docs = [(i, copy.deepcopy(self._cliente._docs[r])) for i, r in rutas.items()]
+        for campo, op, valor in self._filtros:
+            if campo == "__name__":
+                valor = getattr(valor, "id", valor)
+            docs = [(i, d) for i, d in docs
+                    if self._valor(i, d, campo) is not None and _OPERADORES[op](self._valor(i, d, campo), valor)]
+        docs.sort(key=lambda x: x[0])
+        for campo, desc in reversed(self._orden):
+            docs = [x for x in docs if self._valor(x[0], x[1], campo) is not None]
+            docs.sort(key=lambda x: self._valor(x[0], x[1], campo), reverse=desc)
+        if self._despues is not None:
+            ids = [i for i, _ in docs]
+            ultimo = self._despues.reference.path if self._grupo else self._despues.id
+            if ultimo in ids:
+                docs = docs[ids.index(ultimo) + 1:]
+        if self._limite is not None:
+            docs = docs[:self._limite]
+        if self._campos is not None:
+            docs = [(i, {c: d[c] for c in self._campos if c in d}) for i, d in docs]
+        return [Snapshot(DocumentoLocal(self._cliente, rutas[i] if self._grupo else self._ruta + (i,)), d)
+                for i, d in docs]
+
+    def stream(self, transaction=None, timeout=None):
+        return iter(self._resultados())
+
+    def get(self, transaction=None, timeout=None):
+        return self._resultados()
+
+
+class ColeccionLocal(ConsultaLocal):
+    def __init__(self, cliente, ruta):
+        super().__init__(cliente, ruta)
+        self.id = ruta[-1]
+
+    def document(self, doc_id=None):
+        return DocumentoLocal(self._cliente, self._ruta + (doc_id or uuid.uuid4().hex[:20],))
+
+    def add(self, datos):
+        ref = self.document()
+        ref.set(datos)
+        return time.time(), ref
+
+
+class BatchLocal:
+    def __init__(self, cliente):
+        self._cliente = cliente
+        self._operaciones = []
+
+    def set(self, ref, datos, merge=False):
+        self._operaciones.append(("set", ref, datos, merge))
+
+    def create(self, ref, datos):
+        self._operaciones.append(("create", ref, datos, False))
+
+    def update(self, ref, datos):
+        self._operaciones.append(("update", ref, datos, False))
+
+    def delete(self, ref):
+        self._operaciones.append(("delete", ref, None, False))
+
+    def commit(self, timeout=None):
+        _latencia()
+        with self._cliente._lock:
+            # Copia profunda de los documentos que toca el batch: si una operación
+            # falla, se restauran tal como estaban, sin depender de que las demás
+            # no los hayan modificado en su lugar
+            docs = self._cliente._docs
+            respaldo = {ref._ruta: copy.deepcopy(docs.get(ref._ruta)) for _, ref, _, _ in self._operaciones}
+            try:
+                for tipo, ref, datos, merge in self._operaciones:
+                    if tipo == "set":
+                        self._cliente._escribir(ref._ruta, datos, merge=merge)
+                    elif tipo == "create":
+                        self._cliente._crear(ref._ruta, datos)
+                    elif tipo == "update":
+                        self._cliente._actualizar(ref._ruta, datos)
+                    else:
+                        self._cliente._docs.pop(ref._ruta, None)
+            except Exception:
+                for ruta, datos in respaldo.items():
+                    if datos is None:
+                        docs.pop(ruta, None)
+                    else:
+                        docs[ruta] = datos
+                raise
+        self._operaciones = []
+
+
+class ClienteLocal:
+    _compartido = None
+
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def compartido(cls):
+        if cls._compartido is None:
+            cls._compartido = cls()
+        return cls._compartido
+
+    def collection(self, nombre):
+        return ColeccionLocal(self, (nombre,))
+
+    def collection_group(self, nombre):
+        return ConsultaLocal(self, (nombre,), grupo=True)
+
+    def batch(self):
+        return BatchLocal(self)
+
+    def _subcolecciones(self, ruta):
+        with self._lock:
+            return sorted({r[len(ruta)] for r in self._docs if len(r) > len(ruta) + 1 and r[:len(ruta)] == ruta})
+
+    @staticmethod
+    def _combinar(base, datos, rutas=False):
+        """Aplica `datos` sobre `base`; con `rutas`, las claves con "." o "`" son rutas anidadas."""
+        for campo, valor in copy.deepcopy(datos).items():
+            partes = parse_field_path(campo) if rutas and ("." in campo or "`" in campo) else [campo]
+            destino = base
+            for parte in partes[:-1]:
+                # Copia de cada mapa intermedio: el batch puede revertir
+                destino[parte] = dict(destino.get(parte) or {})
+                destino = destino[parte]
+            campo = partes[-1]
+            if valor is DELETE_FIELD:
+                destino.pop(campo, None)
+                continue
+            if isinstance(valor, Increment):
+                actual = destino.get(campo)
+                valor = (actual if isinstance(actual, (int, float)) else 0) + valor.value
+            destino[campo] = valor
+        return base
+
+    def _escribir(self, ruta, datos, merge=False):
+        with self._lock:
+            base = dict(self._docs.get(ruta) or {}) if merge else {}
+            self._docs[ruta] = self._combinar(base, datos)
+
+    def _crear(self, ruta, datos):
+        with self._lock:
+            if ruta in self._docs:
+                raise AlreadyExists(f"El documento {'/'.join(ruta)} ya existe.")
+            self._docs[ruta] = copy.deepcopy(datos)
+
+    def _actualizar(self, ruta, datos):
+        with self._lock:
+            if ruta not in self._docs:
+                raise NotFound(f"No existe el documento {'/'.join(ruta)}.")
+            # Documento nuevo, no modificación en su lugar: el batch puede revertir
+            self._docs[ruta] = self._combinar(dict(self._docs[ruta]), datos, rutas=True)
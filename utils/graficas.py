@@ -0,0 +1,73 @@
+# utils/graficas.py
+"""
+Figuras de Plotly memorizadas por (uid, gráfica, filtro, huella de los datos).
+
+La huella es un hash del DataFrame con el que se construye la figura, así que
+los reruns reutilizan la figura ya construida (incluidas las agregaciones que
+hace `construir`) mientras esos datos no cambien, vengan de donde vengan: el
+cache de utils/db o un frame de session_state que se recarga a su propio ritmo.
+Las series de tiempo largas se agrupan por semana o mes con `agrupar_por_periodo`.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+MAX_FIGURAS = 256   # figuras en memoria para todo el proceso
+MAX_PUNTOS = 400    # puntos por serie antes de pasar a un periodo más largo
+PERIODOS = [("D", "día"), ("W", "semana"), ("MS", "mes")]
+
+_figuras = OrderedDict()
+_lock = threading.Lock()
+
+
+def _huella(datos):
+    """Hash del contenido, índice y columnas de `datos` (DataFrame o Serie)."""
+    columnas = tuple(datos.columns) if isinstance(datos, pd.DataFrame) else (datos.name,)
+    filas = pd.util.hash_pandas_object(datos, index=True).to_numpy()
+    return hashlib.blake2b(repr(columnas).encode() + filas.tobytes(), digest_size=16).hexdigest()
+
+
+def figura(uid, nombre, datos, construir, filtro=()):
+    """
+    Devuelve la figura `nombre` de `uid` para `filtro`; solo llama a `construir()`
+    si no existe para el contenido actual de `datos`, que debe ser el DataFrame (o
+    las columnas) del que sale la figura. La figura es compartida: no modificarla.
+    """
+    clave = (uid, nombre, filtro, _huella(datos))
+    with _lock:
+        fig = _figuras.get(clave)
+        if fig is not None:
+            _figuras.move_to_end(clave)
+            return fig
+
+    fig = construir()
+    with _lock:
+        # Las figuras de datos anteriores ya no se usarán
+        for vieja in [k for k in _figuras if k[:3] == clave[:3]]:
+            del _figuras[vieja]
+        _figuras[clave] = fig
+        while len(_figuras) > MAX_FIGURAS:
+            _figuras.popitem(last=False)
+    return fig
+
+
+def agrupar_por_periodo(df, columna_fecha, columna_valor, max_puntos=MAX_PUNTOS):
+    """
+    Suma `columna_valor` por día; si hay más de `max_puntos`, por semana y luego
+    por mes. Devuelve (DataFrame [columna_fecha, columna_valor], nombre del periodo).
+    """
+    serie = df[[columna_fecha, columna_valor]].copy()
+    serie[columna_fecha] = pd.to_datetime(serie[columna_fecha], errors="coerce")
+    serie[columna_valor] = pd.to_numeric(serie[columna_valor], errors="coerce").fillna(0.0)
+    serie = serie.dropna(subset=[columna_fecha]).set_index(columna_fecha)[columna_valor]
+
+    for regla, nombre in PERIODOS:
+        if regla == "D":  # solo los días con movimientos, como el groupby por fecha
+            agrupada = serie.groupby(serie.index.normalize()).sum()
+        else:
+            agrupada = serie.resample(regla).sum()
+        agrupada.index.name = columna_fecha
+        if len(agrupada) <= max_puntos:
+            break
+    return agrupada.reset_index(), nombre
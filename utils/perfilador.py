@@ -0,0 +1,163 @@
+# utils/perfilador.py
+"""
+Perfilado bajo demanda de los render() de cada página.
+
+Se activa para todo el proceso con MINEGOCIO_PERFILAR=1 o, por sesión, con el
+interruptor de administrador del menú lateral. Cada rerun perfilado deja en
+RUTA_PERFILES cuatro archivos con el negocio y la página en el nombre:
+
+    .prof       estadísticas de cProfile (snakeviz, pstats)
+    .txt        funciones con más tiempo acumulado
+    .collapsed  pilas muestreadas en formato "a;b;c N" (flamegraph.pl, speedscope)
+    .html       flamegraph autocontenido
+"""
+import os
+import re
+import sys
+import html
+import time
+import pstats
+import cProfile
+import datetime
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+RUTA_PERFILES = os.getenv("MINEGOCIO_PERFILES_DIR", os.path.join(".minegocio", "perfiles"))
+INTERVALO_MUESTREO = 0.005  # segundos entre muestras de la pila
+TOP_FUNCIONES = 40
+
+_lock_perfil = threading.Lock()  # cProfile admite un solo perfilador activo por proceso
+
+
+def perfilado_global():
+    return os.getenv("MINEGOCIO_PERFILAR", "").lower() in ("1", "true", "si", "sí")
+
+
+def _slug(texto):
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", str(texto)).strip("_") or "pagina"
+
+
+# ---------------------------
+# Muestreo de pilas
+# ---------------------------
+class _Muestreador(threading.Thread):
+    """Toma la pila del hilo `id_hilo` cada INTERVALO_MUESTREO segundos."""
+
+    def __init__(self, id_hilo):
+        super().__init__(name="perfilador-muestreo", daemon=True)
+        self.id_hilo = id_hilo
+        self.pilas = Counter()
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.wait(INTERVALO_MUESTREO):
+            frame = sys._current_frames().get(self.id_hilo)
+            pila = []
+            while frame is not None:
+                codigo = frame.f_code
+                pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if pila:
+                self.pilas[";".join(reversed(pila))] += 1
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+def _arbol(pilas):
+    raiz = {"n": 0, "hijos": {}}
+    for pila, n in pilas.items():
+        nodo = raiz
+        nodo["n"] += n
+        for marco in pila.split(";"):
+            nodo = nodo["hijos"].setdefault(marco, {"n": 0, "hijos": {}})
+            nodo["n"] += n
+    return raiz
+
+
+def _html_flamegraph(pilas, titulo):
+    """Flamegraph en HTML plano: cada nivel es una fila de bloques con ancho proporcional."""
+    raiz = _arbol(pilas)
+    total = max(raiz["n"], 1)
+
+    def bloques(nodo, nivel):
+        partes = []
+        for nombre, hijo in sorted(nodo["hijos"].items(), key=lambda x: -x[1]["n"]):
+            ancho = 100 * hijo["n"] / nodo["n"]
+            tono = 20 + (hash(nombre.split(" ")[0]) % 30)
+            etiqueta = html.escape(nombre)
+            partes.append(
+                f'<div class="b" style="width:{ancho:.4f}%">'
+                f'<div class="f" style="background:hsl({tono},90%,60%)" '
+                f'title="{etiqueta} — {hijo["n"]} muestras ({100 * hijo["n"] / total:.1f}%)">{etiqueta}</div>'
+                f'{bloques(hijo, nivel + 1)}</div>'
+            )
+        return f'<div class="r">{"".join(partes)}</div>' if partes else ""
+
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(titulo)}</title>
+<style>
+body {{ font: 11px monospace; margin: 10px; }}
+.r {{ display: flex; width: 100%; }}
+.b {{ overflow: hidden; }}
+.f {{ border: 1px solid #fff; padding: 1px 2px; white-space: nowrap; overflow: hidden; cursor: default; }}
+</style></head>
+<body><h3>{html.escape(titulo)} — {raiz["n"]} muestras cada {INTERVALO_MUESTREO * 1000:.0f} ms</h3>
+{bloques(raiz, 0)}
+</body></html>"""
+
+
+# ---------------------------
+# Perfilado de un render
+# ---------------------------
+def _guardar(perfil, pilas, uid, pagina, segundos):
+    os.makedirs(RUTA_PERFILES, exist_ok=True)
+    marca = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    base = os.path.join(RUTA_PERFILES, f"{marca}_{_slug(uid)}_{_slug(pagina)}")
+    titulo = f"{pagina} · {uid} · {segundos:.3f} s"
+
+    perfil.dump_stats(f"{base}.prof")
+    with open(f"{base}.txt", "w", encoding="utf-8") as f:
+        f.write(f"{titulo}\n\n")
+        pstats.Stats(perfil, stream=f).sort_stats("cumulative").print_stats(TOP_FUNCIONES)
+    with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+        f.writelines(f"{pila} {n}\n" for pila, n in pilas.most_common())
+    with open(f"{base}.html", "w", encoding="utf-8") as f:
+        f.write(_html_flamegraph(pilas, titulo))
+    return base
+
+
+@contextmanager
+def perfilar(uid, pagina):
+    """
+    Perfila el bloque (normalmente el render() de la página). Si ya hay otro
+    perfilado en curso en el proceso, el bloque se ejecuta sin perfilar.
+    """
+    if not _lock_perfil.acquire(blocking=False):
+        yield
+        return
+    perfil = cProfile.Profile()
+    muestreador = _Muestreador(threading.get_ident())
+    inicio = time.perf_counter()
+    muestreador.start()
+    perfil.enable()
+    try:
+        yield
+    finally:
+        # st.stop() y st.rerun() salen con excepción; el reporte se guarda igual
+        perfil.disable()
+        muestreador.detener()
+        try:
+            _guardar(perfil, muestreador.pilas, uid, pagina, time.perf_counter() - inicio)
+        finally:
+            _lock_perfil.release()
+
+
+def listar_perfiles():
+    """Reportes guardados, del más reciente al más antiguo: [(nombre base, ruta base)]."""
+    if not os.path.isdir(RUTA_PERFILES):
+        return []
+    bases = {os.path.splitext(a)[0] for a in os.listdir(RUTA_PERFILES) if a.endswith(".html")}
+    return [(b, os.path.join(RUTA_PERFILES, b)) for b in sorted(bases, reverse=True)]
@@ -0,0 +1,483 @@
+# utils/reportes.py
+import datetime
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+# ---------------------------
+# Antigüedad de saldos (cuentas por cobrar)
+# ---------------------------
+RANGOS_ANTIGUEDAD = ["0-30 días", "31-60 días", "61-90 días", "90+ días"]
+# Tipos de venta cuyo Monto Crédito cuenta en el saldo del cliente. Las
+# devoluciones llevan Monto Crédito negativo y reducen el de su venta.
+TIPOS_VENTA_CREDITO = ["Crédito", "Mixta", "Devolución"]
+
+
+def calcular_antiguedad_saldos(ventas_df, transacciones_df, fecha_corte=None):
+    """
+    Reparte los pagos de "Cobranza" de cada cliente contra sus ventas a crédito
+    en orden FIFO (la deuda más antigua se liquida primero) y clasifica lo que
+    queda pendiente por días transcurridos desde la venta.
+
+    Todo se resuelve con un ordenamiento y sumas acumuladas por cliente, sin
+    recorrer filas en Python.
+    """
+    columnas = ["Cliente"] + RANGOS_ANTIGUEDAD + ["Saldo Pendiente"]
+    if fecha_corte is None:
+        fecha_corte = datetime.date.today()
+    corte = pd.Timestamp(fecha_corte)
+
+    if ventas_df.empty:
+        return pd.DataFrame(columns=columnas)
+
+    # 1. Cargos: ventas a crédito hasta la fecha de corte, menos lo devuelto de cada una
+    tipos = ventas_df["Tipo de venta"].astype(str)
+    folios = ventas_df["Folio"].fillna("").astype(str) if "Folio" in ventas_df.columns \
+        else pd.Series("", index=ventas_df.index)
+    montos_credito = pd.to_numeric(ventas_df["Monto Crédito"], errors="coerce").fillna(0.0)
+    devuelto = montos_credito[(tipos == "Devolución") & (folios != "")].groupby(folios).sum()
+
+    cargos = ventas_df.loc[tipos.isin(["Crédito", "Mixta"]), ["Cliente", "Fecha"]].copy()
+    cargos["Fecha"] = pd.to_datetime(cargos["Fecha"], errors="coerce")
+    cargos["Monto Crédito"] = montos_credito[cargos.index] + folios[cargos.index].map(devuelto).fillna(0.0)
+    cargos = cargos[(cargos["Monto Crédito"] > 0) & (cargos["Fecha"] <= corte)]
+    if cargos.empty:
+        return pd.DataFrame(columns=columnas)
+
+    # 2. Abonos: total de cobranza por cliente hasta la fecha de corte
+    abonos = pd.Series(dtype=float)
+    if not transacciones_df.empty:
+        pagos = transacciones_df[transacciones_df["Categoría"].astype(str) == "Cobranza"]
+        fechas_pago = pd.to_datetime(pagos["Fecha"], errors="coerce")
+        pagos = pagos[fechas_pago.isna() | (fechas_pago <= corte)]
+        abonos = pd.to_numeric(pagos["Monto"], errors="coerce").fillna(0.0).groupby(pagos["Cliente"]).sum()
+
+    # 3. Asignación FIFO: cada cargo absorbe lo que sobra de los abonos tras cubrir los anteriores
+    cargos = cargos.sort_values(["Cliente", "Fecha"], kind="mergesort")
+    acumulado = cargos.groupby("Cliente")["Monto Crédito"].cumsum()
+    previo = acumulado - cargos["Monto Crédito"]
+    pagado = cargos["Cliente"].map(abonos).fillna(0.0)
+    aplicado = (pagado - previo).clip(lower=0.0)
+    aplicado = np.minimum(aplicado, cargos["Monto Crédito"])
+    cargos["Pendiente"] = cargos["Monto Crédito"] - aplicado
+    cargos = cargos[cargos["Pendiente"] > 0.005]
+    if cargos.empty:
+        return pd.DataFrame(columns=columnas)
+
+    # 4. Clasificación por antigüedad
+    dias = (corte - cargos["Fecha"]).dt.days.clip(lower=0)
+    cargos["Rango"] = pd.cut(dias, bins=[-1, 30, 60, 90, np.inf], labels=RANGOS_ANTIGUEDAD)
+
+    antiguedad = cargos.pivot_table(
+        index="Cliente", columns="Rango", values="Pendiente",
+        aggfunc="sum", fill_value=0.0, observed=False
+    ).reindex(columns=RANGOS_ANTIGUEDAD, fill_value=0.0)
+    antiguedad.columns = list(antiguedad.columns)
+    antiguedad["Saldo Pendiente"] = antiguedad[RANGOS_ANTIGUEDAD].sum(axis=1)
+
+    return (
+        antiguedad.reset_index()
+        .sort_values("Saldo Pendiente", ascending=False)
+        .reset_index(drop=True)[columnas]
+    )
+
+
+# ---------------------------
+# Saldos por cliente
+# ---------------------------
+def calcular_saldos(ventas_df, transacciones_df):
+    """
+    Crédito otorgado, pagos de cobranza, saldo pendiente y anticipo a favor por cliente.
+    """
+    columnas = ["Cliente", "Crédito Otorgado", "Pagos Cobranza", "Total Pagos y Aplicaciones",
+                "Saldo Pendiente", "Saldo Anticipos", "Saldo Pendiente Display"]
+
+    # 1. Calcular el total de crédito otorgado por cliente
+    credito_otorgado = ventas_df[
+        ventas_df["Tipo de venta"].astype(str).isin(TIPOS_VENTA_CREDITO)
+    ].groupby("Cliente")["Monto Crédito"].sum().rename("Crédito Otorgado")
+
+    # 2. Totales de transacciones por cliente y categoría en una sola pasada
+    por_categoria = transacciones_df[
+        transacciones_df["Categoría"].astype(str).isin(["Cobranza", "Anticipo Cliente", "Anticipo Aplicado"])
+    ].pivot_table(index="Cliente", columns="Categoría", values="Monto", aggfunc="sum", fill_value=0.0)
+    por_categoria = por_categoria.reindex(columns=["Cobranza", "Anticipo Cliente", "Anticipo Aplicado"],
+                                          fill_value=0.0)
+
+    # 3. Anticipos disponibles (saldo a favor del cliente): solo los positivos
+    saldo_anticipos = por_categoria["Anticipo Cliente"] - por_categoria["Anticipo Aplicado"]
+    saldo_anticipos = saldo_anticipos[(por_categoria["Anticipo Cliente"] > 0) & (saldo_anticipos > 0)]
+
+    # Clientes con deuda más los que solo tienen anticipos
+    clientes = credito_otorgado.index.union(saldo_anticipos.index)
+    if clientes.empty:
+        return pd.DataFrame(columns=columnas)
+
+    saldos = pd.DataFrame(index=clientes)
+    saldos.index.name = "Cliente"
+    saldos["Crédito Otorgado"] = credito_otorgado.reindex(clientes, fill_value=0.0)
+    # Los pagos solo cuentan para clientes con crédito otorgado
+    saldos["Pagos Cobranza"] = por_categoria["Cobranza"].reindex(credito_otorgado.index, fill_value=0.0) \
+        .reindex(clientes, fill_value=0.0)
+    saldos["Total Pagos y Aplicaciones"] = saldos["Pagos Cobranza"]
+    saldos["Saldo Pendiente"] = saldos["Crédito Otorgado"] - saldos["Total Pagos y Aplicaciones"]
+    saldos["Saldo Anticipos"] = saldo_anticipos.reindex(clientes, fill_value=0.0)
+    saldos["Saldo Pendiente Display"] = saldos["Saldo Pendiente"].clip(lower=0)
+
+    return saldos.reset_index()[columnas]
+
+
+# ---------------------------
+# Conciliación ventas / transacciones
+# ---------------------------
+COLUMNAS_TRANSACCION_VENTA = ["Fecha", "Descripción", "Categoría", "Tipo", "Monto", "Cliente", "Método de pago",
+                              "Folio"]
+# Categorías de las transacciones que se generan a partir de una venta
+CATEGORIAS_VENTA = ["Ventas", "Anticipo Aplicado", "Ventas a Crédito"]
+
+
+def transacciones_esperadas(ventas_df):
+    """Transacciones que cada venta debió generar: contado, anticipo aplicado y crédito."""
+    columnas = COLUMNAS_TRANSACCION_VENTA
+    if ventas_df.empty:
+        return pd.DataFrame(columns=columnas)
+
+    folios_venta = ventas_df["Folio"].fillna("").astype(str) if "Folio" in ventas_df.columns else ""
+    partes = []
+    for campo, categoria, tipo, descripcion in [
+        ("Monto Contado", "Ventas", "Ingreso", "Pago de contado por venta a {}"),
+        ("Anticipo Aplicado", "Anticipo Aplicado", "Egreso", "Anticipo aplicado a venta de {}"),
+        ("Monto Crédito", "Ventas a Crédito", "Ingreso", "Venta a crédito para {}"),
+    ]:
+        montos = pd.to_numeric(ventas_df[campo], errors="coerce").fillna(0.0)
+        sel = ventas_df[montos > 0]
+        if sel.empty:
+            continue
+        if campo == "Monto Contado":
+            metodo = sel["Método de pago"].fillna("Contado")
+        else:
+            metodo = "Anticipo" if campo == "Anticipo Aplicado" else "Crédito"
+        partes.append(pd.DataFrame({
+            "Fecha": sel["Fecha"],
+            "Descripción": sel["Cliente"].astype(str).map(descripcion.format),
+            "Categoría": categoria,
+            "Tipo": tipo,
+            "Monto": montos[montos > 0],
+            "Cliente": sel["Cliente"],
+            "Método de pago": metodo,
+            "Folio": folios_venta[montos > 0] if isinstance(folios_venta, pd.Series) else "",
+        }))
+    if not partes:
+        return pd.DataFrame(columns=columnas)
+    return pd.concat(partes, ignore_index=True)[columnas]
+
+
+def detectar_transacciones_faltantes(ventas_df, transacciones_df):
+    """
+    Transacciones esperadas de las ventas que no aparecen en transacciones. Las
+    ventas con Folio se buscan por (Folio, Categoría); las anteriores a los
+    folios, por (Fecha, Cliente, Monto).
+    """
+    columnas = COLUMNAS_TRANSACCION_VENTA
+    esperadas = transacciones_esperadas(ventas_df)
+    if esperadas.empty:
+        return esperadas
+
+    folios_trans = transacciones_df["Folio"].fillna("").astype(str) if "Folio" in transacciones_df.columns \
+        else pd.Series("", index=transacciones_df.index)
+    con_folio = esperadas["Folio"] != ""
+
+    # Ventas con folio: búsqueda exacta por (Folio, Categoría). Las transacciones en
+    # negativo de una devolución no cuentan como la original.
+    positivas = pd.to_numeric(transacciones_df["Monto"], errors="coerce").fillna(0.0) > 0
+    existentes_folio = pd.MultiIndex.from_arrays([folios_trans[positivas], transacciones_df.loc[positivas, "Categoría"]])
+    faltan_folio = ~pd.MultiIndex.from_arrays([esperadas["Folio"], esperadas["Categoría"]]).isin(existentes_folio)
+
+    # Ventas sin folio: heurística por (Fecha, Cliente, Monto)
+    existentes = pd.MultiIndex.from_arrays([
+        transacciones_df["Fecha"],
+        transacciones_df["Cliente"],
+        pd.to_numeric(transacciones_df["Monto"], errors="coerce").fillna(0.0).round(2),
+    ])
+    claves = pd.MultiIndex.from_arrays([esperadas["Fecha"], esperadas["Cliente"], esperadas["Monto"].round(2)])
+    faltan = (con_folio & faltan_folio) | (~con_folio & ~claves.isin(existentes))
+    return esperadas[faltan].reset_index(drop=True)[columnas]
+
+
+# ---------------------------
+# Conteo físico de inventario
+# ---------------------------
+COLUMNAS_CONTEO = ["Contado", "Cantidad contada", "Cantidad"]
+
+
+def calcular_diferencias_conteo(catalogo_df, conteo_df):
+    """
+    Cruza una hoja de conteo (Clave + cantidad contada) con el catálogo en una sola
+    unión. Devuelve (diferencias, claves del conteo que no existen en el catálogo).
+    La diferencia se valúa al Costo Unitario vigente.
+    """
+    columna_contado = next((c for c in COLUMNAS_CONTEO if c in conteo_df.columns), None)
+    if "Clave" not in conteo_df.columns or columna_contado is None:
+        raise ValueError(f"La hoja de conteo debe tener las columnas 'Clave' y una de {COLUMNAS_CONTEO}.")
+
+    conteo = pd.DataFrame({
+        "Clave": conteo_df["Clave"].astype(str).str.strip(),
+        "Contado": pd.to_numeric(conteo_df[columna_contado], errors="coerce"),
+    }).dropna(subset=["Contado"])
+    # Si una clave aparece en varias líneas (varios anaqueles), se suman
+    conteo = conteo.groupby("Clave", as_index=False)["Contado"].sum()
+
+    catalogo = catalogo_df[["Clave", "Nombre", "Cantidad", "Costo Unitario"]].copy()
+    catalogo["Clave"] = catalogo["Clave"].astype(str).str.strip()
+
+    cruce = conteo.merge(catalogo, on="Clave", how="left", indicator=True)
+    no_encontradas = cruce.loc[cruce["_merge"] == "left_only", "Clave"].tolist()
+
+    diferencias = cruce[cruce["_merge"] == "both"].rename(columns={"Cantidad": "Existencia Sistema"})
+    diferencias["Diferencia"] = diferencias["Contado"] - diferencias["Existencia Sistema"]
+    diferencias["Valor Diferencia"] = diferencias["Diferencia"] * diferencias["Costo Unitario"]
+    diferencias = diferencias[diferencias["Diferencia"] != 0]
+    return diferencias[[
+        "Clave", "Nombre", "Existencia Sistema", "Contado", "Diferencia", "Costo Unitario", "Valor Diferencia"
+    ]].reset_index(drop=True), no_encontradas
+
+
+# ---------------------------
+# Sugerencias de reabasto
+# ---------------------------
+VENTANAS_VELOCIDAD = [7, 30, 90]
+
+
+def calcular_reorden(ventas_df, productos_df, ventana=30, dias_cobertura=30, dias_entrega=7, fecha_corte=None):
+    """
+    Velocidad diaria de venta por clave en varias ventanas móviles, días de cobertura
+    con la existencia actual y cantidad sugerida para cubrir `dias_cobertura` más el
+    tiempo de entrega, usando la velocidad de la ventana elegida.
+    """
+    if fecha_corte is None:
+        fecha_corte = datetime.date.today()
+    corte = pd.Timestamp(fecha_corte)
+    ventanas = sorted(set(VENTANAS_VELOCIDAD + [ventana]))
+    col_velocidad = f"Venta diaria ({ventana} d)"
+
+    ventas = pd.DataFrame({
+        "Clave": ventas_df["Clave del Producto"].astype(str),
+        "Cantidad": pd.to_numeric(ventas_df["Cantidad"], errors="coerce").fillna(0.0),
+        "Dias": (corte - pd.to_datetime(ventas_df["Fecha"], errors="coerce")).dt.days,
+    })
+    ventas = ventas[(ventas["Dias"] >= 0) & (ventas["Dias"] < max(ventanas))]
+
+    reorden = productos_df[["Clave", "Nombre", "Cantidad"]].copy()
+    reorden["Clave"] = reorden["Clave"].astype(str)
+    reorden = reorden.rename(columns={"Cantidad": "Existencia"}).set_index("Clave")
+    for w in ventanas:
+        vendidas = ventas.loc[ventas["Dias"] < w].groupby("Clave")["Cantidad"].sum()
+        reorden[f"Venta diaria ({w} d)"] = (vendidas.reindex(reorden.index, fill_value=0.0) / w).round(3)
+
+    velocidad = reorden[col_velocidad]
+    reorden["Días de cobertura"] = (reorden["Existencia"] / velocidad.where(velocidad > 0)).round(1)
+    necesidad = velocidad * (dias_cobertura + dias_entrega) - reorden["Existencia"]
+    reorden["Sugerido"] = np.ceil(necesidad.clip(lower=0)).astype(int)
+
+    return (
+        reorden.reset_index()
+        .sort_values(["Sugerido", "Días de cobertura"], ascending=[False, True], na_position="last")
+        .reset_index(drop=True)
+    )
+
+
+# ---------------------------
+# Margen bruto de lo vendido
+# ---------------------------
+AGRUPACIONES_MARGEN = {
+    "Producto": ["Clave del Producto", "Producto"],
+    "Cliente": ["Cliente"],
+    "Día": ["Día"],
+    "Mes": ["Mes"],
+}
+
+
+def calcular_margenes(ventas_df, agrupaciones=tuple(AGRUPACIONES_MARGEN)):
+    """
+    Margen bruto con el Costo Unitario guardado en cada renglón de venta. El
+    descuento de una venta (guardado en su primer renglón) se reparte entre los
+    renglones del mismo Folio en proporción a su Total.
+
+    Los renglones se preparan una sola vez y se agrupan por cada criterio de
+    `agrupaciones`. Devuelve {criterio: DataFrame}.
+    """
+    columnas_valor = ["Cantidad", "Ingreso", "Costo", "Margen", "Margen %", "Renglones sin costo"]
+    if ventas_df.empty:
+        return {a: pd.DataFrame(columns=AGRUPACIONES_MARGEN[a] + columnas_valor) for a in agrupaciones}
+
+    num = {c: pd.to_numeric(ventas_df[c], errors="coerce") for c in
+           ["Cantidad", "Total", "Descuento", "Costo Unitario"]}
+    fechas = pd.to_datetime(ventas_df["Fecha"], errors="coerce")
+    lineas = pd.DataFrame({
+        "Clave del Producto": ventas_df["Clave del Producto"].astype(str),
+        "Producto": ventas_df["Producto"].astype(str),
+        "Cliente": ventas_df["Cliente"].astype(str),
+        "Día": fechas.dt.date,
+        "Mes": fechas.dt.to_period("M").astype(str),
+        "Cantidad": num["Cantidad"].fillna(0.0),
+        "Total": num["Total"].fillna(0.0),
+        "Descuento": num["Descuento"].fillna(0.0),
+        "Costo Unitario": num["Costo Unitario"].fillna(0.0),
+    }, index=ventas_df.index)
+
+    # Sin Folio (ventas anteriores) cada renglón es su propia venta
+    folio = ventas_df["Folio"].fillna("").astype(str).str.strip() if "Folio" in ventas_df.columns \
+        else pd.Series("", index=ventas_df.index)
+    grupo = folio.where(folio != "", pd.Series("__renglon_" + ventas_df.index.astype(str), index=ventas_df.index))
+    por_venta = lineas.groupby(grupo)
+    total_venta = por_venta["Total"].transform("sum")
+    descuento_venta = por_venta["Descuento"].transform("sum")
+    # Ventas con Total 0: el descuento se reparte por igual
+    peso = (lineas["Total"] / total_venta.where(total_venta != 0)).fillna(1.0 / por_venta["Total"].transform("size"))
+    lineas["Ingreso"] = lineas["Total"] - descuento_venta * peso
+    lineas["Costo"] = lineas["Cantidad"] * lineas["Costo Unitario"]
+    lineas["Margen"] = lineas["Ingreso"] - lineas["Costo"]
+    lineas["Renglones sin costo"] = (lineas["Costo Unitario"] <= 0).astype(int)
+
+    resultado = {}
+    for nombre in agrupaciones:
+        claves = AGRUPACIONES_MARGEN[nombre]
+        tabla = lineas.groupby(claves, as_index=False, dropna=False)[
+            ["Cantidad", "Ingreso", "Costo", "Margen", "Renglones sin costo"]
+        ].sum()
+        tabla["Margen %"] = (tabla["Margen"] / tabla["Ingreso"].where(tabla["Ingreso"] != 0) * 100).round(1)
+        orden = claves if nombre in ("Día", "Mes") else "Margen"
+        resultado[nombre] = tabla[claves + columnas_valor].sort_values(
+            orden, ascending=nombre in ("Día", "Mes")
+        ).round(2).reset_index(drop=True)
+    return resultado
+
+
+# ---------------------------
+# Estado de cuenta bancario (depósitos de clientes)
+# ---------------------------
+# Nombres de columna habituales en los estados de cuenta de los bancos
+COLUMNAS_ESTADO_CUENTA = {
+    "Fecha": ["fecha", "fecha operación", "fecha de operación", "fecha operacion", "fecha de operacion"],
+    "Referencia": ["referencia", "concepto", "descripción", "descripcion", "detalle"],
+    "Monto": ["abono", "abonos", "depósito", "deposito", "depósitos", "depositos", "monto", "importe"],
+}
+# Peso de cada señal al elegir el cliente de un depósito
+PUNTOS_COINCIDENCIA = {"RFC": 3, "ID": 3, "Nombre": 2, "Monto": 1}
+PALABRAS_IGNORADAS = {"DEL", "LAS", "LOS", "SAS", "SPEI", "PAGO", "DEPOSITO", "TRANSFERENCIA"}
+
+
+def normalizar_estado_cuenta(estado_df):
+    """
+    Depósitos de un estado de cuenta: ID Depósito, Fecha, Referencia y Monto (solo
+    abonos positivos). El ID sale del contenido del renglón, así que el mismo
+    depósito tiene el mismo ID cada vez que se importa el archivo.
+    """
+    nombres = {str(c).strip().lower(): c for c in estado_df.columns}
+    elegidas = {destino: next((nombres[n] for n in opciones if n in nombres), None)
+                for destino, opciones in COLUMNAS_ESTADO_CUENTA.items()}
+    faltantes = [destino for destino, columna in elegidas.items() if columna is None]
+    if faltantes:
+        raise ValueError(f"El estado de cuenta no tiene columna de {', '.join(faltantes)}; "
+                         f"se esperan nombres como {[opciones[0] for opciones in COLUMNAS_ESTADO_CUENTA.values()]}.")
+
+    montos = estado_df[elegidas["Monto"]]
+    if not pd.api.types.is_numeric_dtype(montos):
+        montos = montos.astype(str).str.replace(r"[$,\s]", "", regex=True)
+    # Fechas ISO tal cual; las demás como día/mes/año
+    fechas = pd.to_datetime(estado_df[elegidas["Fecha"]], errors="coerce", format="ISO8601")
+    fechas = fechas.fillna(pd.to_datetime(estado_df[elegidas["Fecha"]], errors="coerce", dayfirst=True, format="mixed"))
+    depositos = pd.DataFrame({
+        "Fecha": fechas.dt.date,
+        "Referencia": estado_df[elegidas["Referencia"]].fillna("").astype(str).str.strip(),
+        "Monto": pd.to_numeric(montos, errors="coerce").round(2),
+    })
+    depositos = depositos[(depositos["Monto"] > 0) & fechas.notna()].reset_index(drop=True)
+
+    llave = depositos["Fecha"].astype(str) + "|" + depositos["Referencia"] + "|" + depositos["Monto"].map("{:.2f}".format)
+    ocurrencia = depositos.groupby(llave).cumcount()  # depósitos idénticos el mismo día
+    depositos.insert(0, "ID Depósito", [
+        "d_" + hashlib.sha1(f"{k}|{n}".encode("utf-8")).hexdigest()[:20] for k, n in zip(llave, ocurrencia)
+    ])
+    return depositos
+
+
+def _palabras(serie):
+    """Lista de palabras en mayúsculas y sin acentos de cada texto."""
+    return (serie.fillna("").astype(str).str.upper().str.normalize("NFKD")
+            .str.encode("ascii", "ignore").str.decode("ascii").str.findall(r"[A-Z0-9&]+"))
+
+
+def conciliar_depositos(depositos, clientes_df, saldos_df):
+    """
+    Propone el cliente de cada depósito en una sola pasada de uniones:
+      - "RFC" / "ID": el RFC o el ID del cliente aparece en la referencia;
+      - "Nombre": al menos dos tercios de las palabras del nombre están en la referencia;
+      - "Monto": el depósito es igual al saldo pendiente del cliente.
+    Gana el cliente con más puntos (PUNTOS_COINCIDENCIA); si hay empate el
+    depósito queda sin cliente. Agrega Cliente, Coincidencia y Confianza
+    ("Alta", "Media", "Baja" o "Sin coincidencia").
+    """
+    deps = depositos.reset_index(drop=True)
+    palabras_dep = pd.DataFrame({"_dep": deps.index, "Palabra": _palabras(deps["Referencia"])}) \
+        .explode("Palabra").dropna().drop_duplicates()
+    clientes = pd.DataFrame({
+        "Cliente": clientes_df["Nombre"].astype(str),
+        "RFC": _palabras(clientes_df["RFC"]).str.join(""),
+        "ID": _palabras(clientes_df["ID"]).str.join(""),
+    }).drop_duplicates("Cliente")
+
+    # 1. RFC o ID en la referencia
+    claves = pd.concat([
+        clientes[["Cliente", campo]].rename(columns={campo: "Palabra"}).assign(Señal=campo)
+        for campo in ("RFC", "ID")
+    ])
+    claves = claves[claves["Palabra"].str.len() >= 4]
+    por_clave = palabras_dep.merge(claves, on="Palabra")[["_dep", "Cliente", "Señal"]]
+
+    # 2. Palabras del nombre en la referencia
+    nombre = pd.DataFrame({"Cliente": clientes["Cliente"], "Palabra": _palabras(clientes["Cliente"])}) \
+        .explode("Palabra").dropna().drop_duplicates()
+    nombre = nombre[(nombre["Palabra"].str.len() >= 3) & ~nombre["Palabra"].isin(PALABRAS_IGNORADAS)]
+    en_referencia = palabras_dep.merge(nombre, on="Palabra").groupby(["_dep", "Cliente"]).size().rename("n")
+    en_referencia = en_referencia.reset_index().merge(nombre.groupby("Cliente").size().rename("total").reset_index())
+    por_nombre = en_referencia.loc[en_referencia["n"] >= en_referencia["total"] * 2 / 3, ["_dep", "Cliente"]] \
+        .assign(Señal="Nombre")
+
+    # 3. Monto igual al saldo pendiente
+    saldos = saldos_df.loc[saldos_df["Saldo Pendiente Display"] > 0, ["Cliente", "Saldo Pendiente Display"]]
+    por_monto = pd.DataFrame({"_dep": deps.index, "Centavos": (deps["Monto"] * 100).round().astype("int64")}).merge(
+        saldos.assign(Centavos=(saldos["Saldo Pendiente Display"] * 100).round().astype("int64")), on="Centavos"
+    )[["_dep", "Cliente"]].assign(Señal="Monto")
+
+    senales = pd.concat([por_clave, por_nombre, por_monto]).drop_duplicates()
+    candidatos = senales.assign(Puntos=senales["Señal"].map(PUNTOS_COINCIDENCIA)) \
+        .groupby(["_dep", "Cliente"]).agg(Puntos=("Puntos", "sum"), Coincidencia=("Señal", ", ".join)).reset_index()
+    mejores = candidatos[candidatos["Puntos"] == candidatos.groupby("_dep")["Puntos"].transform("max")]
+    empatados = mejores.groupby("_dep")["Cliente"].transform("size") > 1
+    unicos = mejores[~empatados].set_index("_dep")
+    ambiguos = mejores[empatados].groupby("_dep")["Cliente"].agg(lambda c: "Empate: " + ", ".join(c))
+
+    resultado = deps.copy()
+    resultado["Cliente"] = unicos["Cliente"].reindex(deps.index)
+    resultado["Coincidencia"] = unicos["Coincidencia"].reindex(deps.index).fillna(ambiguos.reindex(deps.index))
+    puntos = unicos["Puntos"].reindex(deps.index)
+    resultado["Confianza"] = np.select(
+        [puntos >= 3, puntos == 2, puntos == 1], ["Alta", "Media", "Baja"], default="Sin coincidencia"
+    )
+    return resultado
+
+
+def repartir_depositos(depositos, saldos_df):
+    """
+    Reparte los depósitos con cliente entre Abono (hasta cubrir el saldo pendiente,
+    en orden de fecha) y Anticipo (el excedente), como el registro manual de cobranza.
+    """
+    pagos = depositos[depositos["Cliente"].notna() & (depositos["Cliente"].astype(str) != "")]
+    pagos = pagos.sort_values(["Fecha", "ID Depósito"]).copy()
+    saldo = pagos["Cliente"].map(saldos_df.set_index("Cliente")["Saldo Pendiente Display"]).fillna(0.0)
+    previos = pagos.groupby("Cliente")["Monto"].cumsum() - pagos["Monto"]
+    pagos["Abono"] = np.minimum((saldo - previos).clip(lower=0), pagos["Monto"]).round(2)
+    pagos["Anticipo"] = (pagos["Monto"] - pagos["Abono"]).round(2)
+    return pagos.reset_index(drop=True)
@@ -0,0 +1,193 @@
+# utils/resiliencia.py
+"""
+Política común para las llamadas a Firestore de utils/db: plazo por intento,
+reintentos con espera exponencial y jitter, lecturas cubiertas (hedged) y
+métricas de latencia, reintentos y plazos vencidos por operación.
+
+    filas = resiliencia.leer("ventas", lambda timeout: list(ref.stream(timeout=timeout)))
+    resiliencia.escribir("alta ventas", lambda timeout: ref.document(doc_id).set(datos, timeout=timeout))
+    resiliencia.escribir("alta productos", batch.commit, idempotente=False)
+
+La función recibe `timeout` (segundos que le quedan al intento) y debe pasarlo a
+la llamada del cliente para que la RPC se cancele al vencer el plazo; si no, el
+hilo seguiría ocupado esperando una respuesta que ya nadie usa. El plazo cuenta
+desde que la llamada empieza a ejecutarse, no desde que entra a la cola del pool.
+
+- Lecturas: se reintentan ante DeadlineExceeded, InternalServerError,
+  ServiceUnavailable, ResourceExhausted y el plazo propio vencido. Con
+  MINEGOCIO_FIRESTORE_COBERTURA=1, si una lectura tarda más que el p95 reciente
+  de su operación se lanza una copia y se usa la primera que responda.
+- Escrituras idempotentes (set con ID generado en el cliente, update con valores
+  absolutos, borrados): se reintentan igual que las lecturas, sin cobertura.
+- Escrituras no idempotentes (create, Increment): solo ante los errores que
+  normalmente indican que Firestore no aplicó nada (ServiceUnavailable,
+  ResourceExhausted, Aborted), como el reintento predeterminado de commit. Un
+  plazo vencido se informa sin reintentar, porque la escritura pudo aplicarse.
+
+Agotados los intentos se propaga el último error; un plazo propio vencido se
+informa como DeadlineExceeded. La función se ejecuta en un hilo aparte, así que
+no debe usar st.session_state: las referencias se arman antes de llamar.
+
+Variables: MINEGOCIO_FIRESTORE_PLAZO_LECTURA y MINEGOCIO_FIRESTORE_PLAZO_ESCRITURA
+(segundos por intento), MINEGOCIO_FIRESTORE_INTENTOS y MINEGOCIO_FIRESTORE_COBERTURA.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from google.api_core import exceptions as gexc
+
+PLAZO_LECTURA = float(os.getenv("MINEGOCIO_FIRESTORE_PLAZO_LECTURA", "30"))
+PLAZO_ESCRITURA = float(os.getenv("MINEGOCIO_FIRESTORE_PLAZO_ESCRITURA", "15"))
+MAX_INTENTOS = int(os.getenv("MINEGOCIO_FIRESTORE_INTENTOS", "4"))
+ESPERA_INICIAL = 0.2   # segundos antes del primer reintento (antes del jitter)
+ESPERA_MAXIMA = 5.0
+MUESTRAS_LATENCIA = 500      # latencias recientes por operación para los percentiles
+MIN_MUESTRAS_COBERTURA = 20  # sin suficientes muestras no se cubre
+COBERTURA_MINIMA = 0.05      # segundos
+REVISION_COLA = 0.05         # segundos entre revisiones mientras la llamada espera hilo libre
+
+_REINTENTABLES = (gexc.DeadlineExceeded, gexc.InternalServerError, gexc.ServiceUnavailable,
+                  gexc.ResourceExhausted, gexc.Aborted, TimeoutError)
+# Errores con los que una escritura normalmente no se aplicó. No es una garantía:
+# un ServiceUnavailable puede llegar después de que el servidor confirmó el commit
+# (p. ej. si se corta la conexión en la respuesta), así que reintentar un create
+# puede terminar en AlreadyExists y un Increment puede aplicarse dos veces.
+_NO_APLICADOS = (gexc.ServiceUnavailable, gexc.ResourceExhausted, gexc.Aborted)
+
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv("MINEGOCIO_FIRESTORE_HILOS", "32")),
+                           thread_name_prefix="firestore")
+_lock = threading.Lock()
+_metricas = {}  # operación -> contadores y latencias recientes
+
+
+def cobertura_activa():
+    return os.getenv("MINEGOCIO_FIRESTORE_COBERTURA", "") not in ("", "0")
+
+
+# ---------------------------
+# Métricas
+# ---------------------------
+def _contar(nombre, tipo, latencia=None, **incrementos):
+    with _lock:
+        m = _metricas.setdefault(nombre, {
+            "tipo": tipo, "llamadas": 0, "errores": 0, "reintentos": 0, "plazos_vencidos": 0,
+            "coberturas": 0, "coberturas_ganadas": 0, "latencias": deque(maxlen=MUESTRAS_LATENCIA),
+        })
+        for campo, n in incrementos.items():
+            m[campo] += n
+        if latencia is not None:
+            m["latencias"].append(latencia)
+
+
+def _retardo_cobertura(nombre):
+    """p95 reciente de la operación, o None si aún no hay suficientes muestras."""
+    with _lock:
+        latencias = list(_metricas.get(nombre, {}).get("latencias", []))
+    if len(latencias) < MIN_MUESTRAS_COBERTURA:
+        return None
+    return max(COBERTURA_MINIMA, float(pd.Series(latencias).quantile(0.95)))
+
+
+def metricas():
+    """Una fila por operación con llamadas, errores, reintentos, plazos vencidos, coberturas y p50/p95/p99 en ms."""
+    with _lock:
+        copia = {n: {**m, "latencias": list(m["latencias"])} for n, m in _metricas.items()}
+    filas = []
+    for nombre, m in sorted(copia.items()):
+        lat = pd.Series(m["latencias"], dtype=float) * 1000
+        filas.append({
+            "Operación": nombre, "Tipo": m["tipo"], "Llamadas": m["llamadas"], "Errores": m["errores"],
+            "Reintentos": m["reintentos"], "Plazos vencidos": m["plazos_vencidos"],
+            "Coberturas": m["coberturas"], "Coberturas ganadas": m["coberturas_ganadas"],
+            **{f"p{q} ms": round(lat.quantile(q / 100), 1) if not lat.empty else None for q in (50, 95, 99)},
+        })
+    return pd.DataFrame(filas, columns=[
+        "Operación", "Tipo", "Llamadas", "Errores", "Reintentos", "Plazos vencidos",
+        "Coberturas", "Coberturas ganadas", "p50 ms", "p95 ms", "p99 ms",
+    ])
+
+
+def reiniciar_metricas():
+    with _lock:
+        _metricas.clear()
+
+
+# ---------------------------
+# Ejecución
+# ---------------------------
+def _ejecutar(funcion, plazo, inicios):
+    inicios.append(time.monotonic())  # salió de la cola del pool: desde aquí corre el plazo
+    return funcion(timeout=plazo)
+
+
+def _intento(nombre, tipo, funcion, plazo, cubrir):
+    """
+    Un intento con su plazo, contado desde que la llamada empieza a ejecutarse; con
+    `cubrir`, lanza una copia si tarda más que el p95 reciente.
+    """
+    inicios = []
+    futuros = [_pool.submit(_ejecutar, funcion, plazo, inicios)]
+    retardo = _retardo_cobertura(nombre) if cubrir else None
+    cubierta = retardo is None or retardo >= plazo
+
+    pendientes, error = set(futuros), None
+    while pendientes:
+        if not inicios:
+            espera = REVISION_COLA  # aún sin hilo libre: la espera no cuenta contra el plazo
+        else:
+            transcurrido = time.monotonic() - inicios[0]
+            if transcurrido >= plazo:
+                break
+            if not cubierta and transcurrido >= retardo:
+                futuros.append(_pool.submit(_ejecutar, funcion, plazo - transcurrido, inicios))
+                pendientes.add(futuros[-1])
+                _contar(nombre, tipo, coberturas=1)
+                cubierta = True
+            espera = (plazo if cubierta else retardo) - transcurrido
+        hechos, pendientes = wait(pendientes, timeout=espera, return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+            if futuro.exception() is None:
+                if futuro is not futuros[0]:
+                    _contar(nombre, tipo, coberturas_ganadas=1)
+                return futuro.result()
+            error = futuro.exception()
+    if not pendientes:
+        raise error
+    raise TimeoutError(f"'{nombre}' superó el plazo de {plazo:g} s")
+
+
+def _llamar(nombre, tipo, funcion, plazo, reintentables, cubrir=False):
+    inicio = time.monotonic()
+    for intento in range(1, MAX_INTENTOS + 1):
+        try:
+            resultado = _intento(nombre, tipo, funcion, plazo, cubrir)
+        except Exception as e:
+            vencido = isinstance(e, TimeoutError)
+            if intento == MAX_INTENTOS or not isinstance(e, reintentables):
+                _contar(nombre, tipo, time.monotonic() - inicio, llamadas=1, errores=1, plazos_vencidos=int(vencido))
+                if vencido:
+                    raise gexc.DeadlineExceeded(str(e)) from e
+                raise
+            espera = random.uniform(0, min(ESPERA_MAXIMA, ESPERA_INICIAL * 2 ** (intento - 1)))
+            _contar(nombre, tipo, reintentos=1, plazos_vencidos=int(vencido))
+            logging.warning(f"Firestore '{nombre}' falló (intento {intento}), reintento en {espera:.2f} s: {e}")
+            time.sleep(espera)
+        else:
+            _contar(nombre, tipo, time.monotonic() - inicio, llamadas=1)
+            return resultado
+
+
+def leer(nombre, funcion):
+    """Ejecuta la lectura `funcion(timeout=...)` (debe traer los datos, p. ej. list(ref.stream(timeout=timeout)))."""
+    return _llamar(nombre, "lectura", funcion, PLAZO_LECTURA, _REINTENTABLES, cubrir=cobertura_activa())
+
+
+def escribir(nombre, funcion, idempotente=True):
+    """Ejecuta la escritura `funcion(timeout=...)`; `idempotente=False` para create o Increment."""
+    return _llamar(nombre, "escritura", funcion, PLAZO_ESCRITURA,
+                   _REINTENTABLES if idempotente else _NO_APLICADOS)
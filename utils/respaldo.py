@@ -0,0 +1,278 @@
+# utils/respaldo.py
+"""
+Respaldo y restauración de todas las subcolecciones de usuarios/{uid}, incluidas
+las anidadas bajo sus documentos (p. ej. "contadores/folios_venta/bloques").
+
+El respaldo es un .zip con un archivo Parquet (zstd) por subcolección y un
+manifest.json con conteos y columnas. Los mapas y listas (p. ej. Variantes de
+familias_productos) se guardan como JSON: Arrow los convertiría en structs con la
+unión de las claves de todos los documentos. Cada colección se decodifica de
+nuevo al exportar y los documentos que no regresan igual se anotan en el
+manifiesto ("diferencias"). Uso desde terminal:
+
+    python -m utils.respaldo exportar <uid> respaldo.zip
+    python -m utils.respaldo restaurar <uid> respaldo.zip
+"""
+import io
+import sys
+import json
+import time
+import numbers
+import zipfile
+import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from utils import db
+
+TAM_PAGINA = 1000      # documentos por página de lectura
+TAM_LOTE = 500         # máximo de escrituras por batch en Firestore
+HILOS = 8
+# Rangos de IDs que se leen en paralelo dentro de cada subcolección
+CORTES_ID = [None, "A", "N", "a", "n", None]
+COLUMNA_ID = "__id__"
+
+
+def _ref_usuario(uid):
+    db.inicializar_firebase()
+    return db.db.collection("usuarios").document(uid)
+
+
+# ---------------------------
+# Exportar
+# ---------------------------
+def _leer_rango(ref, inicio, fin):
+    """Lee en páginas los documentos de `ref` con ID en [inicio, fin)."""
+    consulta = ref.order_by(FieldPath.document_id())
+    if inicio:
+        consulta = consulta.where(filter=FieldFilter(FieldPath.document_id(), ">=", ref.document(inicio)))
+    if fin:
+        consulta = consulta.where(filter=FieldFilter(FieldPath.document_id(), "<", ref.document(fin)))
+
+    filas = []
+    ultimo = None
+    while True:
+        pagina = consulta.limit(TAM_PAGINA)
+        if ultimo is not None:
+            pagina = pagina.start_after(ultimo)
+        docs = list(pagina.stream())
+        for d in docs:
+            fila = d.to_dict() or {}
+            fila[COLUMNA_ID] = d.id
+            filas.append(fila)
+        if len(docs) < TAM_PAGINA:
+            return filas
+        ultimo = docs[-1]
+
+
+def _json_default(valor):
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return str(pd.Timestamp(valor))
+    return str(valor)
+
+
+def _a_json(valor):
+    return None if valor is None else json.dumps(valor, default=_json_default, ensure_ascii=False)
+
+
+def _a_tabla(filas):
+    """
+    DataFrame -> tabla Arrow. Las columnas con mapas o listas y las de tipos
+    mezclados se guardan como JSON.
+    """
+    df = pd.DataFrame(filas).convert_dtypes()
+    columnas_json = []
+    for c in df.columns:
+        if df[c].map(lambda v: isinstance(v, (dict, list))).any():
+            df[c] = df[c].map(_a_json)
+            columnas_json.append(c)
+            continue
+        try:
+            pa.array(df[c])
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[c] = df[c].map(_a_json)
+            columnas_json.append(c)
+    return pa.Table.from_pandas(df, preserve_index=False), columnas_json
+
+
+def _comparable(valor):
+    """Valor normalizado para comparar un documento con su versión restaurada."""
+    if isinstance(valor, dict):
+        return {k: _comparable(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_comparable(v) for v in valor]
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return str(pd.Timestamp(valor))
+    if isinstance(valor, numbers.Number) and not isinstance(valor, bool):
+        return float(valor)
+    return valor
+
+
+def _diferencias_ida_y_vuelta(filas, tabla, columnas_json):
+    """IDs de los documentos de `filas` que no regresan iguales de `tabla` al restaurar."""
+    buffer = io.BytesIO()
+    pq.write_table(tabla, buffer)
+    restaurados = dict(_a_documentos(pq.read_table(io.BytesIO(buffer.getvalue())).to_pandas(), columnas_json))
+    diferentes = []
+    for fila in filas:
+        doc_id = fila[COLUMNA_ID]
+        original = {k: _comparable(v) for k, v in fila.items() if k != COLUMNA_ID and v is not None}
+        if original != _comparable(restaurados.get(doc_id)):
+            diferentes.append(doc_id)
+    return diferentes
+
+
+def _leer_colecciones(pool, colecciones, filas_por_col):
+    """
+    Lee `colecciones` ({ruta relativa: ref}) en `filas_por_col` y devuelve las
+    subcolecciones de sus documentos, con ruta "col/doc/sub". Las de documentos
+    que no existen (solo tienen subcolecciones) no se encuentran.
+    """
+    tareas = {
+        (col, i): pool.submit(_leer_rango, ref, CORTES_ID[i], CORTES_ID[i + 1])
+        for col, ref in colecciones.items() for i in range(len(CORTES_ID) - 1)
+    }
+    for (col, _), futuro in tareas.items():
+        filas_por_col.setdefault(col, []).extend(futuro.result())
+
+    listados = {
+        (col, fila[COLUMNA_ID]): pool.submit(lambda d: list(d.collections()), ref.document(fila[COLUMNA_ID]))
+        for col, ref in colecciones.items() for fila in filas_por_col[col]
+    }
+    return {f"{col}/{doc_id}/{sub.id}": sub
+            for (col, doc_id), futuro in listados.items() for sub in futuro.result()}
+
+
+def exportar_usuario(uid, destino):
+    """Escribe el respaldo de `uid` en `destino` (ruta o archivo binario). Devuelve el manifiesto."""
+    inicio = time.time()
+    filas_por_col = {}
+    with ThreadPoolExecutor(max_workers=HILOS) as pool:
+        nivel = {ref.id: ref for ref in _ref_usuario(uid).collections()}
+        while nivel:
+            nivel = _leer_colecciones(pool, nivel, filas_por_col)
+
+    manifiesto = {
+        "uid": uid,
+        "creado": datetime.datetime.now().isoformat(timespec="seconds"),
+        "colecciones": {},
+    }
+    with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_STORED) as zf:
+        for col, filas in filas_por_col.items():
+            if not filas:
+                continue
+            tabla, columnas_json = _a_tabla(filas)
+            diferentes = _diferencias_ida_y_vuelta(filas, tabla, columnas_json)
+            if diferentes:
+                logging.error(f"Respaldo de '{uid}': {len(diferentes)} documentos de {col} no se "
+                              f"restaurarían iguales (p. ej. {diferentes[:5]}).")
+            buffer = io.BytesIO()
+            pq.write_table(tabla, buffer, compression="zstd")
+            zf.writestr(f"{col}.parquet", buffer.getvalue())
+            manifiesto["colecciones"][col] = {
+                "documentos": tabla.num_rows,
+                "columnas": [c for c in tabla.column_names if c != COLUMNA_ID],
+                "columnas_json": columnas_json,
+                "diferencias": diferentes[:20],
+            }
+        total = sum(c["documentos"] for c in manifiesto["colecciones"].values())
+        manifiesto["documentos"] = total
+        manifiesto["segundos"] = round(time.time() - inicio, 2)
+        manifiesto["docs_por_segundo"] = round(total / max(manifiesto["segundos"], 1e-6), 1)
+        zf.writestr("manifest.json", json.dumps(manifiesto, indent=2, ensure_ascii=False))
+
+    logging.info(f"Respaldo de '{uid}': {total} documentos en {manifiesto['segundos']} s.")
+    return manifiesto
+
+
+# ---------------------------
+# Restaurar
+# ---------------------------
+def _a_documentos(df, columnas_json):
+    """Filas del Parquet -> (id, dict) sin los campos vacíos."""
+    for c in columnas_json:
+        df[c] = df[c].map(lambda v: None if v is None or pd.isna(v) else json.loads(v))
+    for c in df.select_dtypes(include=["datetime", "datetimetz"]).columns:
+        df[c] = df[c].astype(object).where(df[c].notna(), None)
+    df = df.astype(object).where(df.notna(), None)
+    for fila in df.to_dict(orient="records"):
+        doc_id = fila.pop(COLUMNA_ID)
+        datos = {}
+        for k, v in fila.items():
+            if v is None:
+                continue
+            if isinstance(v, pd.Timestamp):
+                v = v.to_pydatetime()
+            elif hasattr(v, "tolist"):  # escalares y arreglos de numpy -> tipos de Python
+                v = v.tolist()
+            datos[k] = v
+        yield doc_id, datos
+
+
+def _ref_coleccion(ref_usuario, col):
+    """Referencia de la subcolección con ruta relativa `col` ("col" o "col/doc/sub/...")."""
+    partes = col.split("/")
+    ref = ref_usuario.collection(partes[0])
+    for doc_id, sub in zip(partes[1::2], partes[2::2]):
+        ref = ref.document(doc_id).collection(sub)
+    return ref
+
+
+def _escribir_lote(ref, lote):
+    batch = db.db.batch()
+    for doc_id, datos in lote:
+        batch.set(ref.document(doc_id), datos)
+    batch.commit()
+    return len(lote)
+
+
+def restaurar_usuario(uid, origen):
+    """
+    Restaura el respaldo `origen` (ruta o archivo binario) bajo usuarios/{uid}.
+    Los documentos conservan su ID, así que repetir la restauración no duplica datos.
+    """
+    inicio = time.time()
+    ref_usuario = _ref_usuario(uid)
+    resumen = {"uid": uid, "colecciones": {}}
+
+    with zipfile.ZipFile(origen) as zf, ThreadPoolExecutor(max_workers=HILOS) as pool:
+        manifiesto = json.loads(zf.read("manifest.json"))
+        futuros = []
+        for col, info in manifiesto["colecciones"].items():
+            df = pd.read_parquet(io.BytesIO(zf.read(f"{col}.parquet")))
+            ref = _ref_coleccion(ref_usuario, col)
+            lote = []
+            for doc in _a_documentos(df, info.get("columnas_json", [])):
+                lote.append(doc)
+                if len(lote) == TAM_LOTE:
+                    futuros.append((col, pool.submit(_escribir_lote, ref, lote)))
+                    lote = []
+            if lote:
+                futuros.append((col, pool.submit(_escribir_lote, ref, lote)))
+
+        for col, futuro in futuros:
+            resumen["colecciones"][col] = resumen["colecciones"].get(col, 0) + futuro.result()
+
+    db.invalidar_cache(uid)
+    resumen["documentos"] = sum(resumen["colecciones"].values())
+    resumen["segundos"] = round(time.time() - inicio, 2)
+    resumen["docs_por_segundo"] = round(resumen["documentos"] / max(resumen["segundos"], 1e-6), 1)
+    logging.info(f"Restauración de '{uid}': {resumen['documentos']} documentos en {resumen['segundos']} s.")
+    return resumen
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 4 or sys.argv[1] not in ("exportar", "restaurar"):
+        print("Uso: python -m utils.respaldo exportar|restaurar <uid> <archivo.zip>")
+        sys.exit(1)
+    accion, uid_arg, archivo = sys.argv[1:]
+    if accion == "exportar":
+        resultado = exportar_usuario(uid_arg, archivo)
+    else:
+        resultado = restaurar_usuario(uid_arg, archivo)
+    print(json.dumps({k: v for k, v in resultado.items() if k != "colecciones"}, indent=2))
@@ -0,0 +1,223 @@
+# utils/scheduler.py
+import os
+import time
+import random
+import sqlite3
+import logging
+import datetime
+import threading
+import pandas as pd
+from utils import db
+from utils.reportes import calcular_saldos, detectar_transacciones_faltantes
+
+# Tabla de tareas persistente (sobrevive reinicios del proceso)
+RUTA_BD_TAREAS = os.getenv("MINEGOCIO_TAREAS_DB", os.path.join(".minegocio", "tareas.sqlite3"))
+INTERVALO_REVISION = 5  # segundos entre revisiones del planificador
+
+_tareas = {}          # nombre -> configuración de la tarea
+_resultados = {}      # (uid, nombre) -> (versión de datos, valor)
+_lock = threading.Lock()
+_despertar = threading.Event()
+_hilo = None
+
+
+# ---------------------------
+# Tabla de tareas (SQLite)
+# ---------------------------
+def _conexion():
+    carpeta = os.path.dirname(RUTA_BD_TAREAS)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    con = sqlite3.connect(RUTA_BD_TAREAS, timeout=10)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tareas (
+            nombre TEXT PRIMARY KEY,
+            descripcion TEXT,
+            intervalo REAL,
+            proxima_ejecucion REAL DEFAULT 0,
+            ultima_ejecucion TEXT,
+            estado TEXT DEFAULT 'pendiente',
+            duracion REAL,
+            intentos INTEGER DEFAULT 0,
+            ejecuciones INTEGER DEFAULT 0,
+            fallos INTEGER DEFAULT 0,
+            ultimo_error TEXT
+        )
+    """)
+    return con
+
+
+def _actualizar(nombre, **campos):
+    asignaciones = ", ".join(f"{c} = ?" for c in campos)
+    with _conexion() as con:
+        con.execute(f"UPDATE tareas SET {asignaciones} WHERE nombre = ?", (*campos.values(), nombre))
+
+
+def estado_tareas():
+    """Estado de todas las tareas registradas, para la vista de administración."""
+    with _conexion() as con:
+        df = pd.read_sql_query("SELECT * FROM tareas ORDER BY nombre", con)
+    df["proxima_ejecucion"] = pd.to_datetime(df["proxima_ejecucion"], unit="s", utc=True) \
+        .dt.tz_convert(None).dt.floor("s")
+    return df
+
+
+# ---------------------------
+# Registro y ejecución
+# ---------------------------
+def registrar_tarea(nombre, funcion, intervalo, reintentos=3, descripcion=""):
+    """Registra una tarea periódica. `intervalo` en segundos."""
+    _tareas[nombre] = {"funcion": funcion, "intervalo": intervalo, "reintentos": reintentos}
+    with _conexion() as con:
+        con.execute(
+            "INSERT INTO tareas (nombre, descripcion, intervalo) VALUES (?, ?, ?) "
+            "ON CONFLICT(nombre) DO UPDATE SET descripcion = excluded.descripcion, intervalo = excluded.intervalo",
+            (nombre, descripcion, intervalo)
+        )
+
+
+def ejecutar_ahora(nombre):
+    _actualizar(nombre, proxima_ejecucion=0)
+    _despertar.set()
+
+
+def _reclamar(nombre, proxima_leida):
+    """
+    Toma la tarea para este proceso si su proxima_ejecucion sigue siendo la leída.
+    Todos los procesos del equipo comparten la tabla: el UPDATE condicional es
+    atómico, así que si otro la tomó antes no cambia ningún renglón y aquí no se
+    ejecuta. La nueva proxima_ejecucion sirve de plazo: si el proceso termina a
+    media ejecución, la tarea vuelve a vencer en un intervalo.
+    """
+    with _conexion() as con:
+        cursor = con.execute(
+            "UPDATE tareas SET estado = 'ejecutando', ultima_ejecucion = ?, proxima_ejecucion = ? "
+            "WHERE nombre = ? AND proxima_ejecucion = ?",
+            (datetime.datetime.now().isoformat(timespec="seconds"), time.time() + _tareas[nombre]["intervalo"],
+             nombre, proxima_leida)
+        )
+        return cursor.rowcount == 1
+
+
+def _ejecutar(nombre):
+    tarea = _tareas[nombre]
+    inicio = time.time()
+
+    error = None
+    intento = 0
+    for intento in range(1, tarea["reintentos"] + 1):
+        try:
+            tarea["funcion"]()
+            error = None
+            break
+        except Exception as e:
+            error = e
+            logging.warning(f"Tarea '{nombre}' falló (intento {intento}): {e}")
+            if intento < tarea["reintentos"]:
+                time.sleep(min(60, 2 ** intento) + random.random())
+
+    duracion = time.time() - inicio
+    with _conexion() as con:
+        con.execute(
+            "UPDATE tareas SET estado = ?, duracion = ?, intentos = ?, ejecuciones = ejecuciones + 1, "
+            "fallos = fallos + ?, ultimo_error = ?, proxima_ejecucion = ? WHERE nombre = ?",
+            ("error" if error else "ok", round(duracion, 3), intento, 1 if error else 0,
+             str(error) if error else None, time.time() + tarea["intervalo"], nombre)
+        )
+
+
+def _bucle():
+    while True:
+        try:
+            with _conexion() as con:
+                vencidas = [(n, proxima) for (n, proxima) in con.execute(
+                    "SELECT nombre, proxima_ejecucion FROM tareas WHERE proxima_ejecucion <= ?", (time.time(),)
+                ) if n in _tareas]
+            for nombre, proxima in vencidas:
+                if _reclamar(nombre, proxima):
+                    _ejecutar(nombre)
+        except Exception as e:
+            logging.error(f"Error en el planificador de tareas: {e}")
+        _despertar.wait(INTERVALO_REVISION)
+        _despertar.clear()
+
+
+def iniciar():
+    """Arranca el hilo del planificador una sola vez por proceso."""
+    global _hilo
+    with _lock:
+        if _hilo is not None:
+            return
+        _registrar_tareas_base()
+        _hilo = threading.Thread(target=_bucle, name="planificador-tareas", daemon=True)
+        _hilo.start()
+        logging.info("Planificador de tareas iniciado.")
+
+
+# ---------------------------
+# Resultados precalculados
+# ---------------------------
+def guardar_resultado(uid, nombre, valor, version):
+    """Guarda un resultado calculado a partir de la versión de datos `version` del usuario."""
+    with _lock:
+        _resultados[(uid, nombre)] = (version, valor)
+
+
+def leer_resultado(uid, nombre):
+    """Devuelve el resultado solo si sigue vigente (no hubo escrituras desde que se calculó)."""
+    with _lock:
+        version, valor = _resultados.get((uid, nombre), (None, None))
+    if version is None or version != db.version_datos(uid):
+        return None
+    return valor.copy() if isinstance(valor, pd.DataFrame) else valor
+
+
+def actualizar_resultado(uid, nombre, funcion, version_anterior, version_nueva):
+    """
+    Lleva un resultado calculado en `version_anterior` a `version_nueva` con
+    `funcion(valor)`, sin recalcularlo. Si no estaba vigente en esa versión, o si
+    hubo otras escrituras (la versión actual no es `version_nueva`), no hace nada.
+    """
+    with _lock:
+        version, valor = _resultados.get((uid, nombre), (None, None))
+        if version != version_anterior or db.version_datos(uid) != version_nueva:
+            return
+        _resultados[(uid, nombre)] = (version_nueva, funcion(valor))
+
+
+# ---------------------------
+# Tareas periódicas
+# ---------------------------
+def _tarea_precarga():
+    for uid in db.usuarios_activos():
+        db.precargar_usuario(uid)
+
+
+def _tarea_saldos():
+    for uid in db.usuarios_activos():
+        version = db.version_datos(uid)
+        saldos = calcular_saldos(db.leer_ventas(uid), db.leer_transacciones(uid))
+        guardar_resultado(uid, "saldos", saldos, version)
+
+
+def _tarea_conciliacion():
+    for uid in db.usuarios_activos():
+        version = db.version_datos(uid)
+        faltantes = detectar_transacciones_faltantes(db.leer_ventas(uid), db.leer_transacciones(uid))
+        guardar_resultado(uid, "transacciones_faltantes", faltantes, version)
+
+
+def _tarea_snapshot_existencias():
+    for uid in db.usuarios_activos():
+        db.tomar_snapshot_existencias(uid)
+
+
+def _registrar_tareas_base():
+    registrar_tarea("precarga_cache", _tarea_precarga, 10 * 60,
+                    descripcion="Precarga colecciones de usuarios activos en el cache compartido")
+    registrar_tarea("resumen_saldos", _tarea_saldos, 15 * 60,
+                    descripcion="Recalcula saldos por cliente para Cobranza")
+    registrar_tarea("conciliacion", _tarea_conciliacion, 24 * 3600,
+                    descripcion="Detecta ventas sin sus transacciones contables")
+    registrar_tarea("snapshot_existencias", _tarea_snapshot_existencias, 24 * 3600,
+                    descripcion="Foto diaria de existencias y costos para el kardex")